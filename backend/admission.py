@@ -0,0 +1,80 @@
+"""
+Admission Control - Backpressure for relay uploads
+Limits in-flight chunk uploads globally and per transfer (fair share),
+and refuses new data when the upload volume is nearly full
+"""
+import math
+import shutil
+import time
+from typing import Dict
+
+class AdmissionRejected(Exception):
+    """Request refused; client should retry after retry_after seconds"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Tracks in-flight uploads and decides whether to admit new ones"""
+
+    def __init__(self, upload_dir: str, max_inflight: int, max_inflight_per_transfer: int,
+                 free_space_watermark: int, retry_after: int = 1, disk_check_interval: float = 1.0):
+        self.upload_dir = upload_dir
+        self.max_inflight = max_inflight
+        self.max_inflight_per_transfer = max_inflight_per_transfer
+        self.free_space_watermark = free_space_watermark
+        self.retry_after = retry_after
+        self.disk_check_interval = disk_check_interval
+
+        self.inflight = 0
+        self.per_transfer: Dict[str, int] = {}
+        self.rejected = 0
+
+        self._free_space = None
+        self._free_space_checked = 0.0
+
+    def get_free_space(self) -> int:
+        """Free bytes on the upload volume (cached for disk_check_interval)"""
+        now = time.monotonic()
+        if self._free_space is None or now - self._free_space_checked > self.disk_check_interval:
+            self._free_space = shutil.disk_usage(self.upload_dir).free
+            self._free_space_checked = now
+        return self._free_space
+
+    def check_disk(self):
+        """Reject if free space is below the watermark"""
+        if self.get_free_space() < self.free_space_watermark:
+            self.rejected += 1
+            raise AdmissionRejected("Relay storage is nearly full", self.retry_after * 10)
+
+    def fair_share(self, transfer_id: str) -> int:
+        """Max in-flight uploads for one transfer given how many are active"""
+        active = len(self.per_transfer) + (0 if transfer_id in self.per_transfer else 1)
+        share = math.ceil(self.max_inflight / active)
+        return max(1, min(self.max_inflight_per_transfer, share))
+
+    def acquire(self, transfer_id: str):
+        """Admit one upload for transfer_id or raise AdmissionRejected"""
+        self.check_disk()
+
+        if self.inflight >= self.max_inflight:
+            self.rejected += 1
+            raise AdmissionRejected("Relay is busy", self.retry_after)
+
+        if self.per_transfer.get(transfer_id, 0) >= self.fair_share(transfer_id):
+            self.rejected += 1
+            raise AdmissionRejected("Too many concurrent uploads for this transfer", self.retry_after)
+
+        self.inflight += 1
+        self.per_transfer[transfer_id] = self.per_transfer.get(transfer_id, 0) + 1
+
+    def release(self, transfer_id: str):
+        """Release a slot taken by acquire()"""
+        self.inflight -= 1
+        count = self.per_transfer.get(transfer_id, 0) - 1
+        if count > 0:
+            self.per_transfer[transfer_id] = count
+        else:
+            self.per_transfer.pop(transfer_id, None)
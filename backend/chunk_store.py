@@ -0,0 +1,302 @@
+"""
+Chunk Store - Tiered chunk storage for the relay
+Small transfers live in a memory-budgeted tier and are served straight from RAM;
+they spill to disk when the budget is exceeded or they get old.
+Everything else is written to UPLOAD_DIR as before.
+A memory transfer is also written to disk once its upload completes (it keeps
+being served from RAM) and every memory transfer is spilled on shutdown, so only
+an upload still in progress when the relay dies has to be re-sent.
+"""
+import asyncio
+import os
+import shutil
+import time
+import uuid
+import aiofiles
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+class MemoryTransfer:
+    """Chunks of one transfer held in memory"""
+
+    def __init__(self, reserved: int, total_chunks: int = 0):
+        self.chunks: Dict[int, bytes] = {}
+        self.bytes = 0
+        self.reserved = reserved
+        self.total_chunks = total_chunks
+        # Written to disk once complete; later chunks are written through
+        self.persisted = False
+        self.created_at = time.monotonic()
+
+class ChunkStore:
+    """Stores chunks in memory or on disk depending on transfer size and age"""
+
+    def __init__(self, chunk_path: Callable[[str, int], Path], memory_budget: int,
+                 memory_transfer_max: int, memory_max_age: float):
+        self.chunk_path = chunk_path
+        self.memory_budget = memory_budget
+        self.memory_transfer_max = memory_transfer_max
+        self.memory_max_age = memory_max_age
+
+        self.memory: Dict[str, MemoryTransfer] = {}
+        self.memory_bytes = 0
+        self.memory_hits = 0
+        self.spilled = 0
+
+        self._spilling: Dict[str, asyncio.Task] = {}
+        self._persisting: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def reserved_bytes(self) -> int:
+        return sum(t.reserved for t in self.memory.values())
+
+    def is_memory(self, transfer_id: str) -> bool:
+        return transfer_id in self.memory
+
+    def register(self, transfer_id: str, total_size: int, total_chunks: int = 0) -> str:
+        """
+        Pick the tier for a new transfer
+        Small transfers go to memory, spilling older ones if the budget is reserved
+        total_chunks: chunk count, so the transfer is written to disk once complete
+        Returns 'memory' or 'disk'
+        """
+        if transfer_id in self.memory:
+            return 'memory'
+        if not self.memory_budget or total_size <= 0 or total_size > self.memory_transfer_max:
+            return 'disk'
+        if total_size > self.memory_budget:
+            return 'disk'
+
+        # Make room by spilling the oldest memory transfers
+        reserved = self.reserved_bytes
+        for transfer in sorted(self.memory, key=lambda t: self.memory[t].created_at):
+            if reserved + total_size <= self.memory_budget:
+                break
+            reserved -= self.memory[transfer].reserved
+            self.start_spill(transfer)
+
+        self.memory[transfer_id] = MemoryTransfer(total_size, total_chunks)
+        return 'memory'
+
+    async def put(self, transfer_id: str, chunk_id: int, data: bytes) -> int:
+        """Store a chunk; returns change in bytes held by this store"""
+        transfer = self.memory.get(transfer_id)
+        if transfer is not None and transfer_id not in self._spilling:
+            old = transfer.chunks.get(chunk_id)
+            transfer.chunks[chunk_id] = data
+            delta = len(data) - (len(old) if old is not None else 0)
+            transfer.bytes += delta
+            self.memory_bytes += delta
+
+            if transfer.persisted:
+                await self._write_disk(transfer_id, chunk_id, data)
+            elif transfer.total_chunks and len(transfer.chunks) >= transfer.total_chunks:
+                self.start_persist(transfer_id)
+            if self.memory_bytes > self.memory_budget:
+                self._spill_over_budget()
+            return delta
+
+        if transfer is not None:
+            # Spilling: the new chunk goes to disk, so stop serving the older copy from memory
+            old = transfer.chunks.pop(chunk_id, None)
+            if old is not None:
+                transfer.bytes -= len(old)
+                self.memory_bytes -= len(old)
+        return await self._write_disk(transfer_id, chunk_id, data)
+
+    async def _write_disk(self, transfer_id: str, chunk_id: int, data: bytes) -> int:
+        """
+        Write a chunk file (via temp file so partial chunks are never served)
+        The temp name is unique: a hedged upload may write the same chunk twice at once
+        """
+        chunk_path = self.chunk_path(transfer_id, chunk_id)
+        temp_path = chunk_path.with_name(f"{chunk_path.name}.{uuid.uuid4().hex[:8]}.part")
+
+        old_size = chunk_path.stat().st_size if chunk_path.exists() else 0
+
+        async with aiofiles.open(temp_path, 'wb') as f:
+            await f.write(data)
+        os.replace(temp_path, chunk_path)
+        return len(data) - old_size
+
+    async def copy(self, src_transfer: str, src_chunk: int, transfer_id: str, chunk_id: int) -> Optional[int]:
+        """
+        Copy a stored chunk into another transfer (hard link on disk when possible)
+        Returns the chunk size, or None if the source chunk is gone
+        """
+        source = self.memory.get(src_transfer)
+        data = source.chunks.get(src_chunk) if source is not None else None
+        src_path = self.chunk_path(src_transfer, src_chunk)
+        loop = asyncio.get_running_loop()
+        
+        if data is None and transfer_id in self.memory and transfer_id not in self._spilling:
+            try:
+                data = await loop.run_in_executor(None, src_path.read_bytes)
+            except FileNotFoundError:
+                return None
+        
+        if data is not None:
+            await self.put(transfer_id, chunk_id, data)
+            return len(data)
+        
+        def link() -> int:
+            chunk_path = self.chunk_path(transfer_id, chunk_id)
+            temp_path = chunk_path.with_name(f"{chunk_path.name}.{uuid.uuid4().hex[:8]}.part")
+            try:
+                os.link(src_path, temp_path)
+            except OSError:
+                shutil.copyfile(src_path, temp_path)
+            os.replace(temp_path, chunk_path)
+            # rename() is a no-op when both names already link the same file
+            temp_path.unlink(missing_ok=True)
+            return chunk_path.stat().st_size
+        
+        try:
+            return await loop.run_in_executor(None, link)
+        except FileNotFoundError:
+            return None
+    
+    def get_memory(self, transfer_id: str, chunk_id: int) -> Optional[bytes]:
+        """Get a chunk from the memory tier (None if it isn't there)"""
+        transfer = self.memory.get(transfer_id)
+        if transfer is None:
+            return None
+        data = transfer.chunks.get(chunk_id)
+        if data is not None:
+            self.memory_hits += 1
+        return data
+
+    def list_chunks(self, transfer_id: str) -> List[int]:
+        """Sorted chunk ids stored in either tier"""
+        chunk_ids = set()
+        transfer = self.memory.get(transfer_id)
+        if transfer is not None:
+            chunk_ids.update(transfer.chunks)
+
+        chunk_dir = self.chunk_path(transfer_id, 0).parent
+        if chunk_dir.exists():
+            with os.scandir(chunk_dir) as it:
+                for entry in it:
+                    name = entry.name
+                    if name.startswith("chunk_") and not name.endswith(".part"):
+                        chunk_ids.add(int(name[6:]))
+        return sorted(chunk_ids)
+
+    def drop(self, transfer_id: str):
+        """Forget a transfer's memory tier (disk files are removed by cleanup)"""
+        transfer = self.memory.pop(transfer_id, None)
+        if transfer is not None:
+            self.memory_bytes -= transfer.bytes
+        for tasks in (self._spilling, self._persisting):
+            task = tasks.pop(transfer_id, None)
+            if task is not None:
+                task.cancel()
+
+    def _spill_over_budget(self):
+        """Spill oldest memory transfers until the rest fit the budget"""
+        remaining = self.memory_bytes
+        for transfer_id in sorted(self.memory, key=lambda t: self.memory[t].created_at):
+            if remaining <= self.memory_budget:
+                break
+            if transfer_id in self._spilling:
+                continue
+            remaining -= self.memory[transfer_id].bytes
+            self.start_spill(transfer_id)
+
+    def start_spill(self, transfer_id: str):
+        """Spill a transfer to disk in the background"""
+        if transfer_id in self.memory and transfer_id not in self._spilling:
+            self._spilling[transfer_id] = asyncio.create_task(self.spill(transfer_id))
+
+    def start_persist(self, transfer_id: str):
+        """Write a complete memory transfer to disk in the background (it stays in memory)"""
+        transfer = self.memory.get(transfer_id)
+        if transfer is not None and not transfer.persisted:
+            transfer.persisted = True
+            self._persisting[transfer_id] = asyncio.create_task(self.persist(transfer_id))
+
+    def _write_chunks(self, transfer_id: str, transfer: MemoryTransfer, chunks: Dict[int, bytes]):
+        """
+        Write memory chunks to their files (worker thread)
+        A chunk already on disk was rewritten meanwhile and is newer, so it's never overwritten
+        """
+        for chunk_id, data in chunks.items():
+            chunk_path = self.chunk_path(transfer_id, chunk_id)
+            if chunk_id not in transfer.chunks or chunk_path.exists():
+                continue
+            temp_path = chunk_path.with_name(f"{chunk_path.name}.{uuid.uuid4().hex[:8]}.part")
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            try:
+                # Link fails if a newer upload landed since the check (no clobbering it)
+                os.link(temp_path, chunk_path)
+            except FileExistsError:
+                pass
+            except OSError:
+                if not chunk_path.exists():
+                    os.replace(temp_path, chunk_path)
+            finally:
+                temp_path.unlink(missing_ok=True)
+
+    async def persist(self, transfer_id: str):
+        """Write a complete memory transfer to disk so it survives a restart; reads stay in memory"""
+        transfer = self.memory.get(transfer_id)
+        if transfer is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write_chunks, transfer_id, transfer, dict(transfer.chunks))
+        except Exception as e:
+            print(f"❌ Failed to write transfer {transfer_id} to disk: {e}")
+        finally:
+            self._persisting.pop(transfer_id, None)
+
+    async def spill(self, transfer_id: str):
+        """
+        Write a memory transfer's chunks to disk in a worker thread
+        Chunks stay readable from memory until every file is written
+        """
+        transfer = self.memory.get(transfer_id)
+        if transfer is None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write_chunks, transfer_id, transfer, dict(transfer.chunks))
+
+            # Chunks that arrived while spilling went straight to disk
+            if self.memory.pop(transfer_id, None) is transfer:
+                self.memory_bytes -= transfer.bytes
+                self.spilled += 1
+        except Exception as e:
+            print(f"❌ Failed to spill transfer {transfer_id}: {e}")
+        finally:
+            self._spilling.pop(transfer_id, None)
+
+    async def _run(self, interval: float):
+        """Spill transfers that outlived memory_max_age"""
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for transfer_id, transfer in list(self.memory.items()):
+                if now - transfer.created_at > self.memory_max_age:
+                    self.start_spill(transfer_id)
+
+    def start(self, interval: float = 10.0):
+        """Start the background ager"""
+        if self._task is None and self.memory_budget:
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        """Stop the background ager and spill every memory transfer (they'd be lost on exit)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for transfer_id in list(self.memory):
+            self.start_spill(transfer_id)
+        await asyncio.gather(*self._spilling.values(), *self._persisting.values(), return_exceptions=True)
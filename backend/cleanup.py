@@ -0,0 +1,178 @@
+"""
+Cleanup Scheduler - Background reaper for the relay
+Expires old transfers and enforces the disk quota from the TransferIndex
+Eviction only takes transfers without recent chunk traffic, and only as much as
+the relay's own storage can actually make up
+"""
+import asyncio
+import shutil
+import socket
+import sys
+import os
+import time
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (
+    CLEANUP_AFTER_HOURS, CLEANUP_INTERVAL, CLEANUP_SCAN_BATCH,
+    CLEANUP_MAX_DELETES_PER_SECOND, CLEANUP_ACTIVE_WINDOW, RELAY_DISK_QUOTA, RELAY_MIN_FREE_SPACE
+)
+from backend.transfer_index import TransferIndex, SharedTransferIndex, scan_transfer_dir, list_transfer_dirs
+from backend.metrics import REGISTRY
+
+CLEANUP_SWEEPS = REGISTRY.counter("relay_cleanup_sweeps_total", "Cleanup sweeps run")
+CLEANUP_EXPIRED = REGISTRY.counter("relay_cleanup_expired_total", "Transfers deleted for age")
+CLEANUP_EVICTED = REGISTRY.counter("relay_cleanup_evicted_total", "Transfers evicted for disk quota")
+CLEANUP_FREED_BYTES = REGISTRY.counter("relay_cleanup_freed_bytes_total", "Bytes freed by cleanup")
+CLEANUP_SWEEP_SECONDS = REGISTRY.histogram(
+    "relay_cleanup_sweep_seconds", "Cleanup sweep duration",
+    buckets=(0.01, 0.1, 1.0, 10.0, 60.0, 300.0)
+)
+
+class CleanupScheduler:
+    """
+    Runs cleanup sweeps on a schedule; all disk work happens in worker threads
+    With several relay workers only the holder of the 'cleanup' lease sweeps
+    """
+
+    def __init__(self, index: Union[TransferIndex, SharedTransferIndex], upload_dir: str,
+                 on_delete: Optional[Callable[[str], None]] = None):
+        self.index = index
+        self.upload_dir = upload_dir
+        self.on_delete = on_delete
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.indexed = False
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def load_index(self):
+        """Index existing transfers in batches, yielding to the event loop between them"""
+        loop = asyncio.get_running_loop()
+        transfer_dirs = await loop.run_in_executor(None, list_transfer_dirs, self.upload_dir)
+
+        for start in range(0, len(transfer_dirs), CLEANUP_SCAN_BATCH):
+            batch = transfer_dirs[start:start + CLEANUP_SCAN_BATCH]
+            results = await loop.run_in_executor(None, lambda: [scan_transfer_dir(d) for d in batch])
+
+            for result in results:
+                if result is None:
+                    continue
+                transfer_id, created_at, size, chunks = result
+                if transfer_id not in self.index:
+                    self.index.add(transfer_id, created_at, size, chunks)
+
+        self.indexed = True
+
+    async def delete(self, transfer_id: str):
+        """Delete a transfer directory in a worker thread and drop it from the index"""
+        entry = self.index.get(transfer_id)
+        if entry is not None:
+            CLEANUP_FREED_BYTES.inc(entry['bytes'])
+        self.index.remove(transfer_id)
+        if self.on_delete:
+            self.on_delete(transfer_id)
+
+        transfer_dir = Path(self.upload_dir) / transfer_id
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, lambda: shutil.rmtree(transfer_dir, ignore_errors=True))
+
+    async def get_free_space(self) -> int:
+        """Free bytes on the upload volume"""
+        loop = asyncio.get_running_loop()
+        usage = await loop.run_in_executor(None, shutil.disk_usage, self.upload_dir)
+        return usage.free
+
+    async def _eviction_target(self, idle_bytes: int) -> int:
+        """
+        Bytes to evict for the disk quota and the free space watermark
+        A free space shortfall bigger than idle_bytes (what eviction could free) comes
+        from outside the relay, so it is left alone rather than emptying the relay
+        """
+        over_quota = max(0, self.index.total_bytes - RELAY_DISK_QUOTA) if RELAY_DISK_QUOTA else 0
+        shortfall = max(0, RELAY_MIN_FREE_SPACE - await self.get_free_space())
+        if shortfall > idle_bytes:
+            print(f"⚠️  Free space is {shortfall} bytes below the watermark, more than eviction can free")
+            shortfall = 0
+        return max(over_quota, shortfall)
+
+    async def sweep(self) -> dict:
+        """
+        Expire transfers older than CLEANUP_AFTER_HOURS, then evict oldest-first
+        while over quota, skipping transfers with chunk traffic in the last
+        CLEANUP_ACTIVE_WINDOW seconds. Deletions are rate limited.
+        """
+        async with self._lock:
+            started = time.monotonic()
+            expired = []
+            evicted = []
+            cutoff = time.time() - CLEANUP_AFTER_HOURS * 3600
+            delay = 1.0 / CLEANUP_MAX_DELETES_PER_SECOND
+
+            while True:
+                oldest = self.index.oldest()
+                if oldest is None or oldest[0] >= cutoff:
+                    break
+                expired.append(oldest[1])
+                await self.delete(oldest[1])
+                await asyncio.sleep(delay)
+
+            loop = asyncio.get_running_loop()
+            active_since = time.time() - CLEANUP_ACTIVE_WINDOW
+            idle = await loop.run_in_executor(None, self.index.idle_transfers, active_since)
+            target = await self._eviction_target(sum(size for _, size in idle))
+            for transfer_id, size in idle:
+                if target <= 0:
+                    break
+                # Traffic may have started since the list was made
+                entry = self.index.get(transfer_id)
+                if entry is None or (entry['active_at'] or 0) >= active_since:
+                    continue
+                evicted.append(transfer_id)
+                await self.delete(transfer_id)
+                target -= size
+                await asyncio.sleep(delay)
+
+            CLEANUP_SWEEPS.inc()
+            CLEANUP_EXPIRED.inc(len(expired))
+            CLEANUP_EVICTED.inc(len(evicted))
+            CLEANUP_SWEEP_SECONDS.observe(time.monotonic() - started)
+
+            return {
+                "expired": expired,
+                "evicted": evicted,
+                "stored_bytes": self.index.total_bytes
+            }
+
+    async def _run(self):
+        """Background loop"""
+        while True:
+            try:
+                if not self.index.acquire_lease("cleanup", self.owner, CLEANUP_INTERVAL * 3):
+                    await asyncio.sleep(CLEANUP_INTERVAL)
+                    continue
+
+                if not self.indexed:
+                    await self.load_index()
+
+                result = await self.sweep()
+                if result["expired"] or result["evicted"]:
+                    print(f"🧹 Cleanup: expired {len(result['expired'])}, evicted {len(result['evicted'])}")
+            except Exception as e:
+                print(f"❌ Cleanup sweep failed: {e}")
+            await asyncio.sleep(CLEANUP_INTERVAL)
+
+    def start(self):
+        """Start the background reaper"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background reaper"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,96 @@
+"""
+Manifest Cache - Parsed relay manifests kept in memory
+Serves GET /manifest and chunk hash lookups without touching disk
+Entries can carry a stamp of the manifest file they were read from; with several
+relay workers a lookup passes the file's current stamp, so a manifest rewritten
+by another worker is read again instead of served stale
+"""
+import gzip
+import hashlib
+import sys
+import os
+from collections import OrderedDict
+from typing import Callable, Optional, Sequence
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.manifest_codec import encode_compact, dumps_manifest
+
+class CachedManifest:
+    """One parsed manifest plus its binary form (JSON view built on demand)"""
+
+    def __init__(self, manifest: dict, body: bytes, chunk_hashes: Sequence[Optional[str]]):
+        self.manifest = manifest
+        self.body = body
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.json_etag = f'"{digest}-json"'
+        self.chunk_hashes = chunk_hashes
+        self._json_body: Optional[bytes] = None
+        self._gzip_body: Optional[bytes] = None
+        # (inode, mtime, size) of the manifest file this entry matches, when checked
+        self.stamp: Optional[tuple] = None
+        # Rough memory footprint: parsed manifest (chunk tables) + body
+        self.size = len(body) * 2
+
+    @property
+    def json_body(self) -> bytes:
+        """JSON compatibility view (computed once)"""
+        if self._json_body is None:
+            self._json_body = dumps_manifest(self.manifest, separators=(',', ':')).encode()
+        return self._json_body
+
+    @property
+    def gzip_body(self) -> bytes:
+        """Gzip-compressed JSON view (computed once)"""
+        if self._gzip_body is None:
+            self._gzip_body = gzip.compress(self.json_body, compresslevel=6)
+        return self._gzip_body
+
+class ManifestCache:
+    """LRU cache of manifests bounded by approximate byte size"""
+
+    def __init__(self, max_bytes: int, get_chunk_hashes: Callable[[dict], Sequence[Optional[str]]]):
+        self.max_bytes = max_bytes
+        self.get_chunk_hashes = get_chunk_hashes
+        self.entries: "OrderedDict[str, CachedManifest]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def build(self, manifest: dict, body: Optional[bytes] = None) -> CachedManifest:
+        """Create an entry from a parsed manifest (encoding it if body isn't given)"""
+        if body is None:
+            body = encode_compact(manifest)
+        return CachedManifest(manifest, body, self.get_chunk_hashes(manifest))
+
+    def get(self, transfer_id: str, stamp: Optional[tuple] = None) -> Optional[CachedManifest]:
+        """
+        Get a cached manifest and mark it recently used
+        stamp: the manifest file's current stamp; an entry made from another version is dropped
+        """
+        entry = self.entries.get(transfer_id)
+        if entry is not None and stamp is not None and entry.stamp != stamp:
+            self.discard(transfer_id)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(transfer_id)
+        return entry
+
+    def put(self, transfer_id: str, entry: CachedManifest):
+        """Insert an entry, evicting least recently used ones over budget"""
+        self.discard(transfer_id)
+        self.entries[transfer_id] = entry
+        self.total_bytes += entry.size
+
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            _, old = self.entries.popitem(last=False)
+            self.total_bytes -= old.size
+
+    def discard(self, transfer_id: str):
+        """Remove a manifest from the cache"""
+        entry = self.entries.pop(transfer_id, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
@@ -0,0 +1,124 @@
+"""
+Metrics - Minimal Prometheus-style counters, gauges and histograms
+Plain in-process numbers updated from the event loop; rendered in the
+Prometheus text exposition format by GET /metrics
+"""
+from bisect import bisect_left
+from typing import Callable, List, Optional, Sequence
+
+# Latency buckets in seconds (1ms .. 30s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_value(value: float) -> str:
+    """Format a sample value"""
+    if value != value:
+        return 'NaN'
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Metric:
+    """Base class: name, help text and type"""
+    type_name = 'untyped'
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """Render HELP/TYPE lines and samples"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    """Monotonically increasing value, or read from a callback at scrape time"""
+    type_name = 'counter'
+
+    def __init__(self, name: str, help_text: str, function: Optional[Callable[[], float]] = None):
+        super().__init__(name, help_text)
+        self.value = 0
+        self.function = function
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def current(self) -> float:
+        """Current value (callback result if one is set)"""
+        if self.function is None:
+            return self.value
+        try:
+            return self.function()
+        except Exception:
+            return float('nan')
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self.current())}"]
+
+class Gauge(Counter):
+    """Value that goes up and down, or is read from a callback at scrape time"""
+    type_name = 'gauge'
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+class Histogram(Metric):
+    """Bucketed distribution of observations (e.g. latencies)"""
+    type_name = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+        # Per-bucket (non-cumulative) counts; last slot is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format_value(self.sum)}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, function: Optional[Callable[[], float]] = None) -> Counter:
+        return self.register(Counter(name, help_text, function))
+
+    def gauge(self, name: str, help_text: str, function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, help_text, function))
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, buckets))
+
+    def render(self) -> str:
+        """Render all metrics in Prometheus text format"""
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+# Default registry shared by relay modules
+REGISTRY = Registry()
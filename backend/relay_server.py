@@ -2,22 +2,52 @@
 Relay Server - Handles chunk upload/download with resume support
 Production-ready with hash verification and automatic cleanup
 """
-from fastapi import FastAPI, UploadFile, File, HTTPException, Response
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, Header, HTTPException, Response, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
+import re
 import hashlib
 import json
+import gzip
+import zlib
+import asyncio
+import time
+import uuid
 import aiofiles
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
 from pathlib import Path
+from typing import Dict, List, Optional, Sequence
 import sys
 
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import UPLOAD_DIR, RELAY_HOST, RELAY_PORT, CLEANUP_AFTER_HOURS
+from config import (
+    UPLOAD_DIR, RELAY_HOST, RELAY_PORT, RELAY_WORKERS, RELAY_INDEX_DB, CLEANUP_AFTER_HOURS, CLEANUP_INTERVAL, RELAY_HASH_WORKERS,
+    RELAY_MAX_INFLIGHT_UPLOADS, RELAY_MAX_INFLIGHT_PER_TRANSFER, RELAY_FREE_SPACE_WATERMARK, RELAY_RETRY_AFTER,
+    RELAY_MANIFEST_CACHE_BYTES, RELAY_MEMORY_BUDGET, RELAY_MEMORY_TRANSFER_MAX, RELAY_MEMORY_MAX_AGE,
+    CLEANUP_ACTIVE_WINDOW
+)
+from backend.transfer_index import TransferIndex, SharedTransferIndex, scan_transfer_dir
+from backend.cleanup import CleanupScheduler
+from backend.admission import AdmissionController, AdmissionRejected
+from backend.manifest_cache import ManifestCache, CachedManifest
+from backend.metrics import REGISTRY
+from backend.chunk_store import ChunkStore
+from engine.manifest_codec import MANIFEST_MEDIA_TYPE, StoredHashes, compact_manifest, decode_compact, is_compact
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background cleanup and memory-tier ageing with the server"""
+    cleanup_scheduler.start()
+    chunk_store.start()
+    yield
+    await chunk_store.stop()
+    await cleanup_scheduler.stop()
 
-app = FastAPI(title="Send Anywhere Relay Server")
+app = FastAPI(title="Send Anywhere Relay Server", lifespan=lifespan)
 
 # Enable CORS for web clients
 app.add_middleware(
@@ -28,8 +58,103 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Admission control: bounded in-flight uploads with fair share per transfer
+# (limits are per process, so they are split across workers)
+admission = AdmissionController(
+    UPLOAD_DIR,
+    max_inflight=max(1, RELAY_MAX_INFLIGHT_UPLOADS // RELAY_WORKERS),
+    max_inflight_per_transfer=max(1, RELAY_MAX_INFLIGHT_PER_TRANSFER // RELAY_WORKERS),
+    free_space_watermark=RELAY_FREE_SPACE_WATERMARK,
+    retry_after=RELAY_RETRY_AFTER
+)
+
+# Hot-path metrics (plain counters updated on the event loop; see GET /metrics)
+REQUESTS_IN_FLIGHT = REGISTRY.gauge("relay_requests_in_flight", "HTTP requests being handled")
+BYTES_RECEIVED = REGISTRY.counter("relay_chunk_bytes_received_total", "Chunk bytes uploaded")
+BYTES_SENT = REGISTRY.counter("relay_chunk_bytes_sent_total", "Chunk bytes served")
+CHUNK_UPLOAD_SECONDS = REGISTRY.histogram("relay_chunk_upload_seconds", "Chunk upload handling time")
+CHUNK_DOWNLOAD_SECONDS = REGISTRY.histogram("relay_chunk_download_seconds", "Chunk download handling time (until response starts)")
+STATUS_SECONDS = REGISTRY.histogram("relay_status_seconds", "Transfer status handling time")
+HASH_MISMATCHES = REGISTRY.counter("relay_chunk_hash_mismatch_total", "Uploaded chunks rejected by hash check")
+CHUNKS_NOT_FOUND = REGISTRY.counter("relay_chunk_not_found_total", "Chunk downloads for chunks not uploaded yet")
+CHUNKS_REUSED = REGISTRY.counter("relay_chunks_reused_total", "Chunks copied from other stored transfers instead of uploaded")
+REGISTRY.gauge("relay_uploads_in_flight", "Chunk uploads admitted and running", lambda: admission.inflight)
+REGISTRY.counter("relay_admission_rejected_total", "Requests refused with 429", lambda: admission.rejected)
+
+UPLOAD_CHUNK_PATH = re.compile(r"^/transfer/([^/]+)/chunk/\d+$")
+
+def throttled_response(e: AdmissionRejected) -> JSONResponse:
+    """429 response with Retry-After"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": e.reason},
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+@app.middleware("http")
+async def admission_middleware(request: Request, call_next):
+    """
+    Admit chunk uploads before their body is read
+    Over-limit requests get 429 + Retry-After
+    """
+    REQUESTS_IN_FLIGHT.inc()
+    try:
+        match = UPLOAD_CHUNK_PATH.match(request.url.path) if request.method == "POST" else None
+        if not match:
+            return await call_next(request)
+        
+        transfer_id = match.group(1)
+        try:
+            admission.acquire(transfer_id)
+        except AdmissionRejected as e:
+            return throttled_response(e)
+        
+        try:
+            return await call_next(request)
+        finally:
+            admission.release(transfer_id)
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+
 # Storage structure: uploads/{transfer_id}/chunks/{chunk_id}
-# Storage structure: uploads/{transfer_id}/manifest.json
+# Storage structure: uploads/{transfer_id}/manifest.bin (binary manifest; manifest.json before)
+
+# Worker pool for chunk hashing so large uploads don't stall the event loop
+hash_executor = ThreadPoolExecutor(max_workers=RELAY_HASH_WORKERS, thread_name_prefix="relay-hash")
+
+def forget_transfer(transfer_id: str):
+    """Drop in-memory state for a deleted transfer"""
+    manifest_cache.discard(transfer_id)
+    chunk_store.drop(transfer_id)
+    last_download.pop(transfer_id, None)
+
+# Downloads mark their transfer active so cleanup doesn't evict it mid-transfer
+# (uploads are recorded by add_chunk); written at most every ACTIVE_MARK_INTERVAL
+ACTIVE_MARK_INTERVAL = CLEANUP_ACTIVE_WINDOW / 10
+last_download: Dict[str, float] = {}
+
+async def mark_downloading(transfer_id: str):
+    """Record download traffic for a transfer in the index (rate limited)"""
+    now = time.time()
+    if now - last_download.get(transfer_id, 0) < ACTIVE_MARK_INTERVAL:
+        return
+    if len(last_download) >= 4096:
+        # Transfers deleted by another worker are never forgotten here
+        for other, at in list(last_download.items()):
+            if now - at >= ACTIVE_MARK_INTERVAL:
+                del last_download[other]
+    last_download[transfer_id] = now
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, transfer_index.touch, transfer_id, now)
+
+# Transfer/chunk index + background reaper (replaces scanning UPLOAD_DIR)
+# Multiple workers share the index through SQLite so /status is consistent on every worker
+transfer_index = SharedTransferIndex(RELAY_INDEX_DB) if RELAY_WORKERS > 1 else TransferIndex()
+cleanup_scheduler = CleanupScheduler(transfer_index, UPLOAD_DIR, on_delete=forget_transfer)
+
+REGISTRY.gauge("relay_active_transfers", "Transfers stored on the relay", lambda: len(transfer_index))
+REGISTRY.gauge("relay_stored_bytes", "Bytes stored across transfers", lambda: transfer_index.total_bytes)
+REGISTRY.gauge("relay_disk_free_bytes", "Free bytes on the upload volume", lambda: admission.get_free_space())
 
 def get_transfer_dir(transfer_id: str) -> Path:
     """Get transfer directory path"""
@@ -41,8 +166,134 @@ def get_chunk_dir(transfer_id: str) -> Path:
 
 def get_manifest_path(transfer_id: str) -> Path:
     """Get manifest file path"""
+    return get_transfer_dir(transfer_id) / "manifest.bin"
+
+def get_legacy_manifest_path(transfer_id: str) -> Path:
+    """Get JSON manifest path of transfers stored by older relays"""
     return get_transfer_dir(transfer_id) / "manifest.json"
 
+def get_chunk_path(transfer_id: str, chunk_id: int) -> Path:
+    """Get chunk file path"""
+    return get_chunk_dir(transfer_id) / f"chunk_{chunk_id:06d}"
+
+# Chunk storage: RAM tier for small transfers, UPLOAD_DIR for the rest
+# (RAM tier is per process, so it is disabled with multiple workers)
+chunk_store = ChunkStore(
+    get_chunk_path,
+    memory_budget=RELAY_MEMORY_BUDGET if RELAY_WORKERS == 1 else 0,
+    memory_transfer_max=RELAY_MEMORY_TRANSFER_MAX,
+    memory_max_age=RELAY_MEMORY_MAX_AGE
+)
+
+REGISTRY.gauge("relay_memory_tier_bytes", "Chunk bytes held in the RAM tier", lambda: chunk_store.memory_bytes)
+REGISTRY.gauge("relay_memory_tier_transfers", "Transfers held in the RAM tier", lambda: len(chunk_store.memory))
+REGISTRY.counter("relay_memory_tier_hits_total", "Chunks served from the RAM tier", lambda: chunk_store.memory_hits)
+REGISTRY.counter("relay_memory_tier_spills_total", "Transfers spilled from RAM to disk", lambda: chunk_store.spilled)
+
+def get_chunk_hashes(manifest: dict) -> Sequence[Optional[str]]:
+    """
+    Manifest chunk hashes in relay chunk id order (looked up from the chunk tables on access)
+    Folder chunks are numbered globally, file after file.
+    Pack chunks (small folder files) follow the file chunks.
+    Compressed chunks are stored as sent, so their compressedHash is used.
+    Returns empty list if the manifest carries no per-chunk hashes (web UI)
+    """
+    if 'files' in manifest and not all('chunks' in f for f in manifest['files']):
+        return []
+    return StoredHashes(manifest)
+
+def get_total_size(manifest: dict) -> int:
+    """Total bytes for a file or folder manifest"""
+    return manifest.get('totalSize', manifest.get('size', 0)) or 0
+
+def get_total_chunks(manifest: dict) -> int:
+    """Total relay chunks for a file or folder manifest"""
+    if 'files' in manifest:
+        return sum(f.get('totalChunks', 0) for f in manifest['files']) + len(manifest.get('packs', []))
+    return manifest.get('totalChunks', 0)
+
+# Parsed manifests (+ serialized body, ETag and chunk hashes) kept in memory
+manifest_cache = ManifestCache(RELAY_MANIFEST_CACHE_BYTES, get_chunk_hashes)
+
+REGISTRY.counter("relay_manifest_cache_hits_total", "Manifest cache hits", lambda: manifest_cache.hits)
+REGISTRY.counter("relay_manifest_cache_misses_total", "Manifest cache misses", lambda: manifest_cache.misses)
+REGISTRY.gauge("relay_manifest_cache_bytes", "Approximate manifest cache size", lambda: manifest_cache.total_bytes)
+
+# Manifests are rewritten on re-create (pipelined -> final, streaming placeholder -> folder,
+# resume), possibly by another worker: with several workers cache hits are checked against the file
+CHECK_MANIFEST_FILE = RELAY_WORKERS > 1
+
+def get_manifest_stamp(transfer_id: str) -> Optional[tuple]:
+    """(inode, mtime, size) of a transfer's manifest.bin, None if there is none"""
+    try:
+        stat = get_manifest_path(transfer_id).stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+async def load_manifest(transfer_id: str) -> Optional[CachedManifest]:
+    """Get a transfer manifest from cache, reading it from disk on a miss"""
+    stamp = None
+    if CHECK_MANIFEST_FILE:
+        stamp = get_manifest_stamp(transfer_id)
+        if stamp is None:
+            # Deleted or legacy JSON manifest: nothing to check the cache against
+            manifest_cache.discard(transfer_id)
+    entry = manifest_cache.get(transfer_id, stamp)
+    if entry is not None:
+        return entry
+    
+    manifest_path = get_manifest_path(transfer_id)
+    loop = asyncio.get_running_loop()
+    
+    if manifest_path.exists():
+        async with aiofiles.open(manifest_path, 'rb') as f:
+            body = await f.read()
+        entry = await loop.run_in_executor(None, lambda: manifest_cache.build(decode_compact(body), body))
+        # Stamped before the read: a file replaced meanwhile only costs another read
+        entry.stamp = stamp
+    else:
+        # Transfer stored by an older relay: JSON manifest, re-encoded on load
+        manifest_path = get_legacy_manifest_path(transfer_id)
+        if not manifest_path.exists():
+            return None
+        async with aiofiles.open(manifest_path, 'rb') as f:
+            body = await f.read()
+        entry = await loop.run_in_executor(None, lambda: manifest_cache.build(compact_manifest(json.loads(body))))
+    
+    manifest_cache.put(transfer_id, entry)
+    return entry
+
+async def get_expected_hash(transfer_id: str, chunk_id: int) -> Optional[str]:
+    """Get the manifest hash for a chunk, or None if it can't be verified"""
+    entry = await load_manifest(transfer_id)
+    if entry is None:
+        return None
+    
+    hashes = entry.chunk_hashes
+    if 0 <= chunk_id < len(hashes):
+        return hashes[chunk_id]
+    return None
+
+def decode_manifest_body(body: bytes, content_encoding: str) -> dict:
+    """
+    Decompress (gzip/deflate) and parse a manifest request body
+    Binary manifests are decoded as is; JSON chunk lists are converted to chunk tables
+    """
+    content_encoding = content_encoding.lower()
+    if content_encoding == 'gzip':
+        body = gzip.decompress(body)
+    elif content_encoding == 'deflate':
+        body = zlib.decompress(body)
+    if is_compact(body):
+        return decode_compact(body)
+    return compact_manifest(json.loads(body))
+
+async def hash_in_worker(data: bytes) -> str:
+    """Calculate SHA256 of data in the hash worker pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(hash_executor, lambda: hashlib.sha256(data).hexdigest())
+
 def calculate_hash(file_path: str) -> str:
     """Calculate SHA256 hash of a file"""
     sha256 = hashlib.sha256()
@@ -51,68 +302,197 @@ def calculate_hash(file_path: str) -> str:
             sha256.update(chunk)
     return sha256.hexdigest()
 
+async def reuse_stored_chunks(transfer_id: str, chunk_hashes: Sequence[Optional[str]]) -> int:
+    """
+    Copy chunks whose hash is already stored (by any transfer) into this transfer
+    so a re-sent, edited file only uploads the chunks that changed
+    """
+    # Index calls run off the event loop: the shared index is SQLite and large manifests have millions of chunks
+    loop = asyncio.get_running_loop()
+    present = set(await loop.run_in_executor(None, transfer_index.list_chunks, transfer_id))
+    wanted = {chunk_hash for chunk_id, chunk_hash in enumerate(chunk_hashes)
+              if chunk_hash is not None and chunk_id not in present}
+    if not wanted:
+        return 0
+    
+    # One batched lookup
+    sources = await loop.run_in_executor(None, transfer_index.find_chunks, wanted)
+    reused = []
+    
+    for chunk_id, chunk_hash in enumerate(chunk_hashes):
+        source = sources.get(chunk_hash) if chunk_id not in present else None
+        if source is None:
+            continue
+        
+        size = await chunk_store.copy(source[0], source[1], transfer_id, chunk_id)
+        if size is not None:
+            reused.append((chunk_id, size, chunk_hash))
+    
+    await loop.run_in_executor(None, transfer_index.add_chunks, transfer_id, reused)
+    CHUNKS_REUSED.inc(len(reused))
+    return len(reused)
+
+def get_indexed_chunks(transfer_id: str) -> Optional[List[int]]:
+    """Chunk ids the index has for a transfer, None if it isn't indexed"""
+    if transfer_id not in transfer_index:
+        return None
+    return transfer_index.list_chunks(transfer_id)
+
+async def get_stored_chunk_hashes(transfer_id: str, chunk_ids: List[int]) -> Dict[int, str]:
+    """
+    Hashes of stored chunks (used by senders to resume)
+    Chunks indexed from disk without a hash are hashed once and recorded
+    """
+    loop = asyncio.get_running_loop()
+    known = await loop.run_in_executor(None, transfer_index.chunk_hashes, transfer_id)
+    hashes = {}
+    
+    for chunk_id in chunk_ids:
+        chunk_hash = known.get(chunk_id)
+        if chunk_hash is None:
+            chunk_path = get_chunk_path(transfer_id, chunk_id)
+            try:
+                size = chunk_path.stat().st_size
+                chunk_hash = await loop.run_in_executor(hash_executor, calculate_hash, str(chunk_path))
+            except FileNotFoundError:
+                continue
+            await loop.run_in_executor(None, transfer_index.add_chunk, transfer_id, chunk_id, size, chunk_hash)
+        hashes[chunk_id] = chunk_hash
+    
+    return hashes
+
 @app.post("/transfer/create")
-async def create_transfer(transfer_id: str, manifest: str):
+async def create_transfer(request: Request, transfer_id: str, manifest: Optional[str] = None):
     """
     Create a new transfer session with manifest
     Manifest contains: fileName, size, chunkSize, totalChunks, hash
+    Manifest is sent as the JSON request body (Content-Encoding gzip/deflate allowed);
+    the old ?manifest= query parameter is still accepted
     """
     try:
+        # Refuse new transfers when the volume is nearly full
+        try:
+            admission.check_disk()
+        except AdmissionRejected as e:
+            raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+        
+        # Parse manifest off the event loop (folder manifests can be large)
+        body = await request.body()
+        loop = asyncio.get_running_loop()
+        
+        if body:
+            encoding = request.headers.get('content-encoding', '')
+            try:
+                manifest_data = await loop.run_in_executor(None, decode_manifest_body, body, encoding)
+            except (ValueError, OSError, zlib.error) as e:
+                raise HTTPException(status_code=400, detail=f"Invalid manifest: {str(e)}")
+        elif manifest:
+            manifest_data = compact_manifest(json.loads(manifest))
+        else:
+            raise HTTPException(status_code=400, detail="Manifest required")
+        
         # Create transfer directories
+        # (re-creating an existing transfer keeps its chunks so the sender can resume)
         transfer_dir = get_transfer_dir(transfer_id)
         chunk_dir = get_chunk_dir(transfer_id)
+        legacy_path = get_legacy_manifest_path(transfer_id)
+        resumed = get_manifest_path(transfer_id).exists() or legacy_path.exists()
         
         transfer_dir.mkdir(parents=True, exist_ok=True)
         chunk_dir.mkdir(parents=True, exist_ok=True)
         
-        # Save manifest
-        manifest_data = json.loads(manifest)
+        # Save manifest with creation timestamp (kept in cache; replaced whole so
+        # other workers never read a partly written one)
+        manifest_data['created_at'] = datetime.now().isoformat()
+        entry = await loop.run_in_executor(None, manifest_cache.build, manifest_data)
+        
         manifest_path = get_manifest_path(transfer_id)
+        temp_path = manifest_path.with_name(f"{manifest_path.name}.{uuid.uuid4().hex[:8]}.part")
+        async with aiofiles.open(temp_path, 'wb') as f:
+            await f.write(entry.body)
+        os.replace(temp_path, manifest_path)
+        if legacy_path.exists():
+            legacy_path.unlink()
         
-        async with aiofiles.open(manifest_path, 'w') as f:
-            await f.write(json.dumps(manifest_data, indent=2))
+        if CHECK_MANIFEST_FILE:
+            entry.stamp = get_manifest_stamp(transfer_id)
+        manifest_cache.put(transfer_id, entry)
         
-        # Save creation timestamp
-        manifest_data['created_at'] = datetime.now().isoformat()
-        async with aiofiles.open(manifest_path, 'w') as f:
-            await f.write(json.dumps(manifest_data, indent=2))
+        # Index chunks already on disk if this transfer hasn't been indexed yet (e.g. after a restart)
+        if resumed and not await loop.run_in_executor(None, lambda: transfer_id in transfer_index):
+            scanned = await loop.run_in_executor(None, scan_transfer_dir, str(transfer_dir))
+            await loop.run_in_executor(None, transfer_index.add, transfer_id, None, scanned[2], scanned[3])
+        else:
+            await loop.run_in_executor(None, transfer_index.add, transfer_id)
+        
+        # Resumed transfers stay in the tier their chunks are already in
+        if resumed and not chunk_store.is_memory(transfer_id):
+            storage = 'disk'
+        else:
+            storage = chunk_store.register(transfer_id, get_total_size(manifest_data), get_total_chunks(manifest_data))
+        
+        # Chunks the relay already holds don't need to be uploaded again
+        reused = await reuse_stored_chunks(transfer_id, entry.chunk_hashes)
         
         return {
-            "status": "created",
+            "status": "resumed" if resumed else "created",
             "transfer_id": transfer_id,
-            "total_chunks": manifest_data.get("totalChunks", 0)
+            "total_chunks": get_total_chunks(manifest_data),
+            "storage": storage,
+            "reused_chunks": reused
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create transfer: {str(e)}")
 
 @app.post("/transfer/{transfer_id}/chunk/{chunk_id}")
-async def upload_chunk(transfer_id: str, chunk_id: int, file: UploadFile = File(...)):
+async def upload_chunk(transfer_id: str, chunk_id: int, file: UploadFile = File(...),
+                       x_chunk_hash: Optional[str] = Header(None)):
     """
     Upload a single chunk
+    Verifies the chunk against the manifest hash before storing it
+    Pipelined senders publish the hash with the chunk (X-Chunk-Hash) before the
+    manifest has it; it is checked and stored for receivers
     Returns chunk hash for verification
     """
+    started = time.perf_counter()
     try:
-        chunk_dir = get_chunk_dir(transfer_id)
-        
-        if not chunk_dir.exists():
+        if not chunk_store.is_memory(transfer_id) and not get_chunk_dir(transfer_id).exists():
             raise HTTPException(status_code=404, detail="Transfer not found")
         
-        # Save chunk
-        chunk_path = chunk_dir / f"chunk_{chunk_id:06d}"
+        content = await file.read()
+        
+        # Verify against manifest (hashing runs in worker pool)
+        chunk_hash = await hash_in_worker(content)
+        expected_hash = await get_expected_hash(transfer_id, chunk_id)
+        
+        expected_hash = expected_hash or (x_chunk_hash.lower() if x_chunk_hash else None)
+        
+        if expected_hash and chunk_hash != expected_hash:
+            HASH_MISMATCHES.inc()
+            raise HTTPException(
+                status_code=422,
+                detail=f"Chunk {chunk_id} hash mismatch: expected {expected_hash}, got {chunk_hash}"
+            )
         
-        async with aiofiles.open(chunk_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
+        # Save chunk (RAM tier or disk) and record it in the index
+        await chunk_store.put(transfer_id, chunk_id, content)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, transfer_index.add_chunk, transfer_id, chunk_id, len(content), chunk_hash)
         
-        # Calculate hash
-        chunk_hash = hashlib.sha256(content).hexdigest()
+        BYTES_RECEIVED.inc(len(content))
+        CHUNK_UPLOAD_SECONDS.observe(time.perf_counter() - started)
         
         return {
             "status": "uploaded",
             "chunk_id": chunk_id,
             "hash": chunk_hash,
-            "size": len(content)
+            "size": len(content),
+            "verified": expected_hash is not None
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to upload chunk: {str(e)}")
 
@@ -122,10 +502,22 @@ async def download_chunk(transfer_id: str, chunk_id: int):
     Download a single chunk
     Supports resume via range requests
     """
+    started = time.perf_counter()
     try:
-        chunk_path = get_chunk_dir(transfer_id) / f"chunk_{chunk_id:06d}"
+        headers = {"Content-Disposition": f'attachment; filename="chunk_{chunk_id:06d}"'}
+        
+        # Served straight from memory for RAM-tier transfers
+        data = chunk_store.get_memory(transfer_id, chunk_id)
+        if data is not None:
+            await mark_downloading(transfer_id)
+            BYTES_SENT.inc(len(data))
+            CHUNK_DOWNLOAD_SECONDS.observe(time.perf_counter() - started)
+            return Response(content=data, media_type="application/octet-stream", headers=headers)
+        
+        chunk_path = get_chunk_path(transfer_id, chunk_id)
         
         if not chunk_path.exists():
+            CHUNKS_NOT_FOUND.inc()
             # Check if transfer exists
             if not get_transfer_dir(transfer_id).exists():
                 raise HTTPException(status_code=404, detail=f"Transfer {transfer_id} not found")
@@ -135,6 +527,10 @@ async def download_chunk(transfer_id: str, chunk_id: int):
         if not chunk_path.is_file():
             raise HTTPException(status_code=500, detail=f"Chunk {chunk_id} exists but is not a file")
         
+        await mark_downloading(transfer_id)
+        BYTES_SENT.inc(chunk_path.stat().st_size)
+        CHUNK_DOWNLOAD_SECONDS.observe(time.perf_counter() - started)
+        
         return FileResponse(
             chunk_path,
             media_type="application/octet-stream",
@@ -147,54 +543,86 @@ async def download_chunk(transfer_id: str, chunk_id: int):
         raise HTTPException(status_code=500, detail=f"Failed to download chunk {chunk_id}: {str(e)}")
 
 @app.get("/transfer/{transfer_id}/manifest")
-async def get_manifest(transfer_id: str):
-    """Get transfer manifest"""
+async def get_manifest(request: Request, transfer_id: str):
+    """
+    Get transfer manifest (served from cache)
+    Binary form when the client accepts it, otherwise the JSON view
+    Supports If-None-Match (ETag) and gzip
+    """
     try:
-        manifest_path = get_manifest_path(transfer_id)
+        entry = await load_manifest(transfer_id)
         
-        if not manifest_path.exists():
+        if entry is None:
             raise HTTPException(status_code=404, detail="Transfer not found")
         
-        async with aiofiles.open(manifest_path, 'r') as f:
-            content = await f.read()
-            return json.loads(content)
+        compact = MANIFEST_MEDIA_TYPE in request.headers.get('accept', '')
+        etag = entry.etag if compact else entry.json_etag
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+        
+        if request.headers.get('if-none-match') == etag:
+            return Response(status_code=304, headers=headers)
+        
+        if compact:
+            return Response(content=entry.body, media_type=MANIFEST_MEDIA_TYPE, headers=headers)
+        
+        # JSON view is built (and gzipped) once per cached manifest, off the event loop
+        loop = asyncio.get_running_loop()
+        if 'gzip' in request.headers.get('accept-encoding', '') and len(entry.body) > 1024:
+            headers["Content-Encoding"] = "gzip"
+            body = await loop.run_in_executor(None, lambda: entry.gzip_body)
+            return Response(content=body, media_type="application/json", headers=headers)
+        
+        body = await loop.run_in_executor(None, lambda: entry.json_body)
+        return Response(content=body, media_type="application/json", headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get manifest: {str(e)}")
 
 @app.get("/transfer/{transfer_id}/status")
-async def get_transfer_status(transfer_id: str):
+async def get_transfer_status(transfer_id: str, hashes: bool = False):
     """
     Get transfer status - which chunks are uploaded
-    Returns list of available chunks
+    Returns list of available chunks (and their hashes with ?hashes=true)
     """
+    started = time.perf_counter()
     try:
         chunk_dir = get_chunk_dir(transfer_id)
         
-        if not chunk_dir.exists():
+        if not chunk_store.is_memory(transfer_id) and not chunk_dir.exists():
             raise HTTPException(status_code=404, detail="Transfer not found")
         
-        # Get list of uploaded chunks
-        uploaded_chunks = []
-        for chunk_file in sorted(chunk_dir.glob("chunk_*")):
-            chunk_id = int(chunk_file.name.split("_")[1])
-            uploaded_chunks.append(chunk_id)
+        # Get list of uploaded chunks from the index (storage scan if not indexed yet)
+        loop = asyncio.get_running_loop()
+        uploaded_chunks = await loop.run_in_executor(None, get_indexed_chunks, transfer_id)
+        if uploaded_chunks is None:
+            uploaded_chunks = chunk_store.list_chunks(transfer_id)
         
         # Get manifest
-        manifest_path = get_manifest_path(transfer_id)
-        async with aiofiles.open(manifest_path, 'r') as f:
-            manifest = json.loads(await f.read())
+        entry = await load_manifest(transfer_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Transfer not found")
         
-        total_chunks = manifest.get("totalChunks", 0)
+        total_chunks = get_total_chunks(entry.manifest)
         progress = len(uploaded_chunks) / total_chunks * 100 if total_chunks > 0 else 0
         
-        return {
+        status = {
             "transfer_id": transfer_id,
             "total_chunks": total_chunks,
             "uploaded_chunks": len(uploaded_chunks),
             "progress": round(progress, 2),
             "available_chunks": uploaded_chunks,
-            "complete": len(uploaded_chunks) == total_chunks
+            "complete": len(uploaded_chunks) == total_chunks,
+            "pipelined": bool(entry.manifest.get('pipelined'))
         }
+        
+        if hashes:
+            status["chunk_hashes"] = await get_stored_chunk_hashes(transfer_id, uploaded_chunks)
+        
+        STATUS_SECONDS.observe(time.perf_counter() - started)
+        return status
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get status: {str(e)}")
 
@@ -207,55 +635,45 @@ async def delete_transfer(transfer_id: str):
         if not transfer_dir.exists():
             raise HTTPException(status_code=404, detail="Transfer not found")
         
-        # Delete all files
-        import shutil
-        shutil.rmtree(transfer_dir)
+        # Delete all files (in worker thread)
+        await cleanup_scheduler.delete(transfer_id)
         
         return {"status": "deleted", "transfer_id": transfer_id}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete transfer: {str(e)}")
 
 @app.get("/cleanup")
 async def cleanup_old_transfers():
     """
-    Cleanup transfers older than CLEANUP_AFTER_HOURS
+    Run a cleanup sweep now (also runs every CLEANUP_INTERVAL seconds)
+    Expires transfers older than CLEANUP_AFTER_HOURS and enforces the disk quota
     Returns list of deleted transfers
     """
     try:
-        deleted = []
-        upload_path = Path(UPLOAD_DIR)
+        if not cleanup_scheduler.indexed:
+            await cleanup_scheduler.load_index()
         
-        if not upload_path.exists():
-            return {"deleted": deleted}
-        
-        cutoff_time = datetime.now() - timedelta(hours=CLEANUP_AFTER_HOURS)
-        
-        for transfer_dir in upload_path.iterdir():
-            if not transfer_dir.is_dir():
-                continue
-            
-            manifest_path = transfer_dir / "manifest.json"
-            if not manifest_path.exists():
-                continue
-            
-            # Check creation time
-            async with aiofiles.open(manifest_path, 'r') as f:
-                manifest = json.loads(await f.read())
-                created_at = datetime.fromisoformat(manifest.get('created_at', datetime.now().isoformat()))
-                
-                if created_at < cutoff_time:
-                    import shutil
-                    shutil.rmtree(transfer_dir)
-                    deleted.append(transfer_dir.name)
+        result = await cleanup_scheduler.sweep()
+        deleted = result["expired"] + result["evicted"]
         
         return {
             "status": "cleaned",
             "deleted_count": len(deleted),
-            "deleted_transfers": deleted
+            "deleted_transfers": deleted,
+            "expired": result["expired"],
+            "evicted": result["evicted"],
+            "stored_bytes": result["stored_bytes"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to cleanup: {str(e)}")
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics (text exposition format)"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.head("/")
 async def root_head():
     """HEAD endpoint for UptimeRobot"""
@@ -274,5 +692,10 @@ if __name__ == "__main__":
     import uvicorn
     print(f"🚀 Starting Relay Server on {RELAY_HOST}:{RELAY_PORT}")
     print(f"📁 Upload directory: {UPLOAD_DIR}")
-    print(f"🧹 Auto-cleanup after: {CLEANUP_AFTER_HOURS} hours")
-    uvicorn.run(app, host=RELAY_HOST, port=RELAY_PORT)
+    print(f"🧹 Auto-cleanup after: {CLEANUP_AFTER_HOURS} hours (sweep every {CLEANUP_INTERVAL}s)")
+    if RELAY_WORKERS > 1:
+        # Workers share the listening socket and the SQLite transfer index
+        print(f"⚙️  Workers: {RELAY_WORKERS} (shared index: {RELAY_INDEX_DB})")
+        uvicorn.run("backend.relay_server:app", host=RELAY_HOST, port=RELAY_PORT, workers=RELAY_WORKERS)
+    else:
+        uvicorn.run(app, host=RELAY_HOST, port=RELAY_PORT)
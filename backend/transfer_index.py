@@ -0,0 +1,381 @@
+"""
+Transfer Index - Index of relay transfers and their stored chunks
+Tracks creation time, stored bytes, chunk presence and the last chunk traffic
+so cleanup and /status never have to rescan UPLOAD_DIR.
+
+TransferIndex keeps everything in process memory (single worker).
+SharedTransferIndex keeps the same data in SQLite (WAL mode) so several relay
+worker processes behind one port see consistent state.
+"""
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+import sys
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.manifest_codec import read_header
+
+FIND_BATCH = 500          # hashes per lookup query (under SQLite's bound-parameter limit)
+
+class TransferIndex:
+    """Expiry heap + byte and chunk accounting for transfers stored on the relay"""
+
+    def __init__(self):
+        # {transfer_id: {created_at, bytes, chunks: {chunk_id: (size, hash)}}}
+        self.entries: Dict[str, dict] = {}
+        # Min-heap of (created_at, transfer_id); stale items are skipped lazily
+        self._heap: List[Tuple[float, str]] = []
+        # {chunk_hash: (transfer_id, chunk_id)} for reusing stored chunks
+        self.by_hash: Dict[str, Tuple[str, int]] = {}
+        self.total_bytes = 0
+
+    def __contains__(self, transfer_id: str) -> bool:
+        return transfer_id in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, transfer_id: str, created_at: Optional[float] = None, size: int = 0,
+            chunks: Optional[Dict[int, int]] = None):
+        """
+        Register a transfer (re-registering keeps its stored bytes and chunks)
+        chunks: {chunk_id: size} already on disk
+        A transfer (re-)created now counts as active; one indexed from disk doesn't
+        """
+        active_at = time.time() if created_at is None else None
+        created_at = created_at if created_at is not None else time.time()
+        entry = self.entries.get(transfer_id)
+
+        if entry is None:
+            self.entries[transfer_id] = {
+                'created_at': created_at,
+                'bytes': size,
+                'active_at': active_at,
+                'chunks': {chunk_id: (chunk_size, None) for chunk_id, chunk_size in (chunks or {}).items()}
+            }
+            self.total_bytes += size
+        else:
+            entry['created_at'] = created_at
+            entry['active_at'] = active_at or entry['active_at']
+
+        heapq.heappush(self._heap, (created_at, transfer_id))
+
+    def get(self, transfer_id: str) -> Optional[dict]:
+        """Get {created_at, bytes, active_at} for a transfer"""
+        entry = self.entries.get(transfer_id)
+        if entry is None:
+            return None
+        return {'created_at': entry['created_at'], 'bytes': entry['bytes'], 'active_at': entry['active_at']}
+
+    def add_chunk(self, transfer_id: str, chunk_id: int, size: int, chunk_hash: Optional[str] = None):
+        """Record a stored chunk and account its bytes"""
+        entry = self.entries.get(transfer_id)
+        if entry is None:
+            return
+
+        old = entry['chunks'].get(chunk_id)
+        delta = size - (old[0] if old else 0)
+        entry['chunks'][chunk_id] = (size, chunk_hash)
+        entry['bytes'] += delta
+        entry['active_at'] = time.time()
+        self.total_bytes += delta
+        
+        if old and old[1] and self.by_hash.get(old[1]) == (transfer_id, chunk_id):
+            del self.by_hash[old[1]]
+        if chunk_hash:
+            self.by_hash[chunk_hash] = (transfer_id, chunk_id)
+
+    def touch(self, transfer_id: str, at: Optional[float] = None):
+        """Record chunk traffic (e.g. a download) for a transfer"""
+        entry = self.entries.get(transfer_id)
+        if entry is not None:
+            entry['active_at'] = at if at is not None else time.time()
+
+    def list_chunks(self, transfer_id: str) -> List[int]:
+        """Sorted ids of stored chunks"""
+        entry = self.entries.get(transfer_id)
+        return sorted(entry['chunks']) if entry else []
+
+    def chunk_hashes(self, transfer_id: str) -> Dict[int, Optional[str]]:
+        """{chunk_id: hash} of stored chunks (hash is None if not known)"""
+        entry = self.entries.get(transfer_id)
+        return {chunk_id: info[1] for chunk_id, info in entry['chunks'].items()} if entry else {}
+
+    def remove(self, transfer_id: str):
+        """Drop a transfer from the index"""
+        entry = self.entries.pop(transfer_id, None)
+        if entry is not None:
+            self.total_bytes -= entry['bytes']
+            for chunk_id, (_, chunk_hash) in entry['chunks'].items():
+                if chunk_hash and self.by_hash.get(chunk_hash) == (transfer_id, chunk_id):
+                    del self.by_hash[chunk_hash]
+    
+    def find_chunk(self, chunk_hash: str) -> Optional[Tuple[str, int]]:
+        """Get (transfer_id, chunk_id) of a stored chunk with this hash"""
+        return self.by_hash.get(chunk_hash)
+
+    def find_chunks(self, chunk_hashes: Iterable[str]) -> Dict[str, Tuple[str, int]]:
+        """{hash: (transfer_id, chunk_id)} for the hashes that are stored"""
+        return {h: self.by_hash[h] for h in chunk_hashes if h in self.by_hash}
+
+    def add_chunks(self, transfer_id: str, chunks: List[Tuple[int, int, Optional[str]]]):
+        """Record several stored chunks given as (chunk_id, size, hash)"""
+        for chunk_id, size, chunk_hash in chunks:
+            self.add_chunk(transfer_id, chunk_id, size, chunk_hash)
+
+    def _peek(self) -> Optional[Tuple[float, str]]:
+        """Return the oldest live heap item, discarding stale ones"""
+        while self._heap:
+            created_at, transfer_id = self._heap[0]
+            entry = self.entries.get(transfer_id)
+            if entry is not None and entry['created_at'] == created_at:
+                return created_at, transfer_id
+            heapq.heappop(self._heap)
+        return None
+
+    def oldest(self) -> Optional[Tuple[float, str]]:
+        """Get (created_at, transfer_id) of the oldest transfer"""
+        return self._peek()
+
+    def idle_transfers(self, active_since: float) -> List[Tuple[str, int]]:
+        """(transfer_id, bytes) of transfers without chunk traffic since active_since, oldest first"""
+        idle = [(entry['created_at'], transfer_id, entry['bytes']) for transfer_id, entry in self.entries.items()
+                if (entry['active_at'] or 0) < active_since]
+        return [(transfer_id, size) for _, transfer_id, size in sorted(idle)]
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Single process: this worker always holds every lease"""
+        return True
+
+class SharedTransferIndex:
+    """TransferIndex stored in SQLite (WAL) and shared by relay worker processes"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS transfers (
+                transfer_id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                active_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS transfers_created_at ON transfers(created_at);
+            CREATE TABLE IF NOT EXISTS chunks (
+                transfer_id TEXT NOT NULL,
+                chunk_id INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                hash TEXT,
+                PRIMARY KEY (transfer_id, chunk_id)
+            );
+            CREATE INDEX IF NOT EXISTS chunks_hash ON chunks(hash);
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+        """)
+        # Databases made before activity tracking
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(transfers)")]
+        if 'active_at' not in columns:
+            self.conn.execute("ALTER TABLE transfers ADD COLUMN active_at REAL")
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _transaction(self, statements: List[Tuple[str, tuple]]):
+        """Run statements in one write transaction"""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    self.conn.execute(sql, params)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def __contains__(self, transfer_id: str) -> bool:
+        return bool(self._query("SELECT 1 FROM transfers WHERE transfer_id = ?", (transfer_id,)))
+
+    def __len__(self) -> int:
+        return self._query("SELECT COUNT(*) FROM transfers")[0][0]
+
+    @property
+    def total_bytes(self) -> int:
+        return self._query("SELECT COALESCE(SUM(bytes), 0) FROM transfers")[0][0]
+
+    def add(self, transfer_id: str, created_at: Optional[float] = None, size: int = 0,
+            chunks: Optional[Dict[int, int]] = None):
+        """Register a transfer (re-registering keeps its stored bytes and chunks)"""
+        active_at = time.time() if created_at is None else None
+        created_at = created_at if created_at is not None else time.time()
+        statements = [(
+            """INSERT INTO transfers (transfer_id, created_at, bytes, active_at) VALUES (?, ?, ?, ?)
+               ON CONFLICT(transfer_id) DO UPDATE SET created_at = excluded.created_at,
+                   active_at = COALESCE(excluded.active_at, transfers.active_at)""",
+            (transfer_id, created_at, size, active_at)
+        )]
+        for chunk_id, chunk_size in (chunks or {}).items():
+            statements.append((
+                "INSERT OR IGNORE INTO chunks (transfer_id, chunk_id, size) VALUES (?, ?, ?)",
+                (transfer_id, chunk_id, chunk_size)
+            ))
+        self._transaction(statements)
+
+    def get(self, transfer_id: str) -> Optional[dict]:
+        """Get {created_at, bytes, active_at} for a transfer"""
+        rows = self._query("SELECT created_at, bytes, active_at FROM transfers WHERE transfer_id = ?", (transfer_id,))
+        return {'created_at': rows[0][0], 'bytes': rows[0][1], 'active_at': rows[0][2]} if rows else None
+
+    def add_chunk(self, transfer_id: str, chunk_id: int, size: int, chunk_hash: Optional[str] = None):
+        """Record a stored chunk and account its bytes"""
+        self._transaction([
+            (
+                """UPDATE transfers SET bytes = bytes + ? - COALESCE(
+                       (SELECT size FROM chunks WHERE transfer_id = ? AND chunk_id = ?), 0), active_at = ?
+                   WHERE transfer_id = ?""",
+                (size, transfer_id, chunk_id, time.time(), transfer_id)
+            ),
+            (
+                "INSERT OR REPLACE INTO chunks (transfer_id, chunk_id, size, hash) VALUES (?, ?, ?, ?)",
+                (transfer_id, chunk_id, size, chunk_hash)
+            )
+        ])
+
+    def add_chunks(self, transfer_id: str, chunks: List[Tuple[int, int, Optional[str]]]):
+        """Record several stored chunks given as (chunk_id, size, hash) in one transaction"""
+        statements = []
+        now = time.time()
+        for chunk_id, size, chunk_hash in chunks:
+            statements += [
+                (
+                    """UPDATE transfers SET bytes = bytes + ? - COALESCE(
+                           (SELECT size FROM chunks WHERE transfer_id = ? AND chunk_id = ?), 0), active_at = ?
+                       WHERE transfer_id = ?""",
+                    (size, transfer_id, chunk_id, now, transfer_id)
+                ),
+                (
+                    "INSERT OR REPLACE INTO chunks (transfer_id, chunk_id, size, hash) VALUES (?, ?, ?, ?)",
+                    (transfer_id, chunk_id, size, chunk_hash)
+                )
+            ]
+        if statements:
+            self._transaction(statements)
+
+    def touch(self, transfer_id: str, at: Optional[float] = None):
+        """Record chunk traffic (e.g. a download) for a transfer"""
+        self._transaction([(
+            "UPDATE transfers SET active_at = ? WHERE transfer_id = ?",
+            (at if at is not None else time.time(), transfer_id)
+        )])
+
+    def list_chunks(self, transfer_id: str) -> List[int]:
+        """Sorted ids of stored chunks"""
+        rows = self._query("SELECT chunk_id FROM chunks WHERE transfer_id = ? ORDER BY chunk_id", (transfer_id,))
+        return [row[0] for row in rows]
+
+    def chunk_hashes(self, transfer_id: str) -> Dict[int, Optional[str]]:
+        """{chunk_id: hash} of stored chunks (hash is None if not known)"""
+        rows = self._query("SELECT chunk_id, hash FROM chunks WHERE transfer_id = ?", (transfer_id,))
+        return {row[0]: row[1] for row in rows}
+
+    def remove(self, transfer_id: str):
+        """Drop a transfer from the index"""
+        self._transaction([
+            ("DELETE FROM chunks WHERE transfer_id = ?", (transfer_id,)),
+            ("DELETE FROM transfers WHERE transfer_id = ?", (transfer_id,))
+        ])
+
+    def find_chunk(self, chunk_hash: str) -> Optional[Tuple[str, int]]:
+        """Get (transfer_id, chunk_id) of a stored chunk with this hash"""
+        rows = self._query("SELECT transfer_id, chunk_id FROM chunks WHERE hash = ? LIMIT 1", (chunk_hash,))
+        return (rows[0][0], rows[0][1]) if rows else None
+    
+    def find_chunks(self, chunk_hashes: Iterable[str]) -> Dict[str, Tuple[str, int]]:
+        """{hash: (transfer_id, chunk_id)} for the hashes that are stored (queried in batches)"""
+        chunk_hashes = list(chunk_hashes)
+        found = {}
+        for i in range(0, len(chunk_hashes), FIND_BATCH):
+            batch = chunk_hashes[i:i + FIND_BATCH]
+            rows = self._query(
+                f"SELECT hash, transfer_id, chunk_id FROM chunks WHERE hash IN ({','.join('?' * len(batch))})",
+                tuple(batch)
+            )
+            for chunk_hash, transfer_id, chunk_id in rows:
+                found.setdefault(chunk_hash, (transfer_id, chunk_id))
+        return found
+    
+    def oldest(self) -> Optional[Tuple[float, str]]:
+        """Get (created_at, transfer_id) of the oldest transfer"""
+        rows = self._query("SELECT created_at, transfer_id FROM transfers ORDER BY created_at LIMIT 1")
+        return (rows[0][0], rows[0][1]) if rows else None
+
+    def idle_transfers(self, active_since: float) -> List[Tuple[str, int]]:
+        """(transfer_id, bytes) of transfers without chunk traffic since active_since, oldest first"""
+        rows = self._query(
+            "SELECT transfer_id, bytes FROM transfers WHERE COALESCE(active_at, 0) < ? ORDER BY created_at",
+            (active_since,)
+        )
+        return [(row[0], row[1]) for row in rows]
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Take or renew a named lease (e.g. so only one worker runs cleanup)"""
+        now = time.time()
+        self._transaction([(
+            """INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+               ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+               WHERE leases.owner = excluded.owner OR leases.expires_at < ?""",
+            (name, owner, now + ttl, now)
+        )])
+        rows = self._query("SELECT owner FROM leases WHERE name = ?", (name,))
+        return bool(rows) and rows[0][0] == owner
+
+def scan_transfer_dir(transfer_dir: str) -> Optional[Tuple[str, float, int, Dict[int, int]]]:
+    """
+    Read creation time, stored size and chunks of one transfer directory
+    Returns (transfer_id, created_at, bytes, {chunk_id: size}) or None if it isn't a transfer
+    """
+    manifest_path = os.path.join(transfer_dir, "manifest.bin")
+    legacy_path = os.path.join(transfer_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        if not os.path.exists(legacy_path):
+            return None
+        manifest_path = legacy_path
+
+    try:
+        if manifest_path == legacy_path:
+            with open(manifest_path, 'r') as f:
+                header = json.load(f)
+        else:
+            header = read_header(manifest_path)
+        created_at = datetime.fromisoformat(header['created_at']).timestamp()
+    except Exception:
+        created_at = os.path.getmtime(manifest_path)
+
+    chunks = {}
+    chunk_dir = os.path.join(transfer_dir, "chunks")
+    if os.path.isdir(chunk_dir):
+        with os.scandir(chunk_dir) as it:
+            for entry in it:
+                if entry.name.startswith("chunk_") and not entry.name.endswith(".part"):
+                    chunks[int(entry.name[6:])] = entry.stat().st_size
+
+    return os.path.basename(transfer_dir), created_at, sum(chunks.values()), chunks
+
+def list_transfer_dirs(upload_dir: str) -> List[str]:
+    """List transfer directory paths under upload_dir"""
+    if not os.path.isdir(upload_dir):
+        return []
+
+    with os.scandir(upload_dir) as it:
+        return [entry.path for entry in it if entry.is_dir()]
@@ -9,10 +9,14 @@ SIGNALING_PORT = 3000
 
 RELAY_HOST = "0.0.0.0"
 RELAY_PORT = 8000
+# Relay worker processes sharing the port (uvicorn also reads WEB_CONCURRENCY)
+RELAY_WORKERS = int(os.environ.get("RELAY_WORKERS", os.environ.get("WEB_CONCURRENCY", 1)))
 
 # Storage Configuration
 UPLOAD_DIR = "uploads"
 TEMP_DIR = "temp"
+RELAY_INDEX_DB = os.path.join(UPLOAD_DIR, "index.sqlite3")   # Shared transfer index (multi-worker)
+UPLOAD_STATE_FILE = os.path.join(TEMP_DIR, "upload_state.json")  # Sender resume state
 try:
     os.makedirs(UPLOAD_DIR, exist_ok=True)
     os.makedirs(TEMP_DIR, exist_ok=True)
@@ -24,21 +28,101 @@ except Exception as e:
 CHUNK_SIZE_LAN = 2 * 1024 * 1024      # 2MB for LAN
 CHUNK_SIZE_WEBRTC = 512 * 1024        # 512KB for WebRTC
 CHUNK_SIZE_RELAY = 1 * 1024 * 1024    # 1MB for Relay
+CHUNKING = "fixed"                    # Relay chunking: 'fixed' or 'cdc' (content-defined)
+CDC_MIN_SIZE = 256 * 1024             # content-defined chunk bounds
+CDC_AVG_SIZE = 1 * 1024 * 1024
+CDC_MAX_SIZE = 4 * 1024 * 1024
+PACK_SMALL_FILES = True               # Folder files under PACK_FILE_MAX share pack chunks
+PACK_FILE_MAX = 256 * 1024
 
 # Performance Configuration
 MAX_PARALLEL_CHUNKS = 5               # Download 5 chunks simultaneously
 MIN_PARALLEL_CHUNKS = 1
 MAX_RETRY_ATTEMPTS = 3
 RETRY_DELAY = 2                       # seconds
+MAX_BACKPRESSURE_WAIT = 600           # seconds a chunk may wait on relay 429s
+PIPELINE_MIN_SIZE = 64 * 1024 * 1024  # Relay files from 64MB are hashed and uploaded in one pass
+PIPELINE_POLL_INTERVAL = 1            # seconds between receiver polls of a pipelined transfer
+PIPELINE_STALL_TIMEOUT = 300          # seconds without new chunks before a receiver gives up
+
+# Tail Latency (relay chunk requests)
+RETRY_MAX_DELAY = 30                  # cap on the full-jitter exponential backoff (seconds)
+RETRY_BUDGET_RATIO = 0.2              # retries allowed per request made in a transfer
+RETRY_BUDGET_MIN = 10                 # retries always allowed on top of the ratio
+LATENCY_WINDOW = 200                  # recent chunk latencies kept per transfer
+LATENCY_MIN_SAMPLES = 20              # latencies needed before timeouts/hedging use them
+CHUNK_TIMEOUT_PERCENTILE = 99         # chunk timeout = this latency percentile x multiplier,
+CHUNK_TIMEOUT_MULTIPLIER = 4          # clamped to CHUNK_TIMEOUT_MIN..CHUNK_TIMEOUT
+CHUNK_TIMEOUT_MIN = 5                 # seconds
+HEDGE_AFTER = 0.9                     # fraction of chunks done before stragglers are hedged
+HEDGE_PERCENTILE = 95                 # requests slower than this latency percentile get a duplicate
+
+# Bandwidth Shaping (relay chunk bytes per second, both directions; 0 = unlimited)
+BANDWIDTH_LIMIT = int(os.environ.get("BANDWIDTH_LIMIT", 0))  # all transfers of this process
+BANDWIDTH_TRANSFER_LIMIT = 0          # each transfer
+BANDWIDTH_SCHEDULE = []               # local time-of-day global caps, e.g. [("09:00", "18:00", 2 * 1024 * 1024)]
+BANDWIDTH_BURST = 1.0                 # seconds of traffic a bucket can save up
+BANDWIDTH_RECHECK = 0.25              # max seconds a throttled request sleeps before re-reading the rate
+
+# Compression Configuration (relay uploads)
+CHUNK_COMPRESSION = None              # opt-in: 'zlib' or 'zstd' (needs zstandard, else zlib)
+CHUNK_COMPRESSION_LEVEL = 3           # zlib 1-9 / zstd 1-22
+COMPRESSION_MIN_SAVINGS = 0.1         # send a chunk raw unless compression saves 10%
+COMPRESSION_WORKERS = 4               # threads (de)compressing chunks off the event loop
+COMPRESSION_SPOOL = True              # keep chunks compressed for the manifest so uploads don't compress again
+COMPRESSION_SPOOL_DIR = os.path.join(TEMP_DIR, "spool")
+
+# Relay Configuration
+RELAY_HASH_WORKERS = 4                # Threads verifying uploaded chunk hashes
+RELAY_MAX_INFLIGHT_UPLOADS = 64       # Concurrent chunk uploads across all transfers
+RELAY_MAX_INFLIGHT_PER_TRANSFER = 16  # Concurrent chunk uploads for one transfer
+RELAY_FREE_SPACE_WATERMARK = 512 * 1024 * 1024  # Refuse uploads below 512MB free
+RELAY_RETRY_AFTER = 1                 # seconds suggested to throttled clients
+RELAY_MANIFEST_CACHE_BYTES = 256 * 1024 * 1024  # Parsed manifests kept in memory
+RELAY_MEMORY_BUDGET = 512 * 1024 * 1024         # RAM tier for small transfers (0 = disabled, single worker only)
+RELAY_MEMORY_TRANSFER_MAX = 100 * 1024 * 1024   # Transfers up to 100MB may use the RAM tier
+RELAY_MEMORY_MAX_AGE = 600            # seconds before a RAM-tier transfer spills to disk
 
 # Cleanup Configuration
 CLEANUP_AFTER_HOURS = 24              # Auto-delete transfers after 24 hours
+CLEANUP_INTERVAL = 300                # seconds between background cleanup sweeps
+CLEANUP_SCAN_BATCH = 100              # transfer dirs indexed per step at startup
+CLEANUP_MAX_DELETES_PER_SECOND = 5    # bounded deletion rate
+RELAY_DISK_QUOTA = 50 * 1024 * 1024 * 1024   # 50GB total stored (0 = unlimited)
+RELAY_MIN_FREE_SPACE = 1024 * 1024 * 1024    # evict oldest when free space < 1GB
+CLEANUP_ACTIVE_WINDOW = 600           # transfers with chunk traffic this recent are never evicted
 
 # Pair Code Configuration
 PAIR_CODE_LENGTH = 6
 PAIR_CODE_EXPIRY = 3600               # 1 hour in seconds
 
 # Network Configuration
-LAN_DISCOVERY_PORT = 9000
+LAN_DISCOVERY_PORT = 9000             # LAN server (TCP) and discovery (UDP)
+LAN_MULTICAST_GROUP = "239.255.73.65" # discovery queries go here and to broadcast
+LAN_DISCOVERY_TIMEOUT = 0.5           # seconds a receiver waits for a LAN sender
+LAN_DISCOVERY_RETRY = 0.1             # seconds between discovery queries
+LAN_PREFER = True                     # receivers use a reachable LAN sender before the relay
+LAN_DISCOVERY_SETTLE = 0.2            # seconds to keep collecting peers after the first answer
 CONNECTION_TIMEOUT = 30               # seconds
 CHUNK_TIMEOUT = 60                    # seconds per chunk
+
+# LAN Stream Transport (persistent framed TCP; HTTP is the fallback)
+LAN_STREAM = True                     # advertise/use the stream transport
+LAN_STREAM_PORT = LAN_DISCOVERY_PORT + 1
+LAN_STREAM_CONNECTIONS = 4            # long-lived connections per receiver
+LAN_STREAM_PIPELINE = 8               # requests in flight per connection
+LAN_SOCKET_BUFFER = 4 * 1024 * 1024   # SO_SNDBUF/SO_RCVBUF (0 = OS default)
+LAN_STRIPE_FILES = False              # fetch runs of consecutive chunks as one range request
+LAN_STRIPE_SIZE = 4 * 1024 * 1024     # bytes per range request when striping
+LAN_MAX_OPEN_FILES = 256              # LAN server keeps up to this many files open (LRU)
+# LAN server processes sharing the listening sockets (each with its own event loop)
+LAN_WORKERS = int(os.environ.get("LAN_WORKERS", 1))
+LAN_WORKER_STATS_INTERVAL = 1         # seconds between worker stats reports
+# Receivers seed the chunks they have verified to other receivers on the LAN (unauthenticated,
+# on every interface); off unless set here or the receiver is run with --seed
+LAN_SEED = False
+LAN_SEED_PORT = LAN_DISCOVERY_PORT + 2  # seeder HTTP port (its stream transport uses the next one)
+LAN_SEED_REFRESH = 1                  # seconds between re-reads of a partial seeder's chunk list
+# Multi-source downloads (relay + LAN sender + seeding receivers)
+SWARM_STEAL_FACTOR = 2.0              # duplicate a straggler when its holder needs this many times longer
+SWARM_RATE_SMOOTHING = 0.3            # weight of the newest sample in each source's throughput
@@ -0,0 +1,181 @@
+"""
+Bandwidth - Token-bucket shaping of relay transfer bytes
+A global bucket caps everything this process sends to and fetches from the relay,
+and each transfer has its own bucket on top. Buckets count bytes, so a 4MB chunk
+costs four times a 1MB one. The global cap can follow a time-of-day schedule, and
+every limit can be changed while transfers are running.
+"""
+import asyncio
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import BANDWIDTH_LIMIT, BANDWIDTH_TRANSFER_LIMIT, BANDWIDTH_SCHEDULE, BANDWIDTH_BURST, BANDWIDTH_RECHECK
+
+# (start minute, end minute, bytes/s); a window ending before it starts wraps past midnight
+Window = Tuple[int, int, float]
+
+UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def parse_rate(value) -> float:
+    """Bytes/s from a number or a string like '512K', '2M', '1.5MB' (0 = unlimited)"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?)(?:i?B)?(?:/s)?\s*', str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid rate: {value}")
+    return float(match.group(1)) * UNITS[match.group(2).upper()]
+
+def parse_minute(value: str) -> int:
+    """Minute of the day from 'HH:MM'"""
+    hours, _, minutes = value.partition(':')
+    minute = int(hours) * 60 + int(minutes or 0)
+    if not 0 <= minute <= 24 * 60:
+        raise ValueError(f"Invalid time of day: {value}")
+    return minute
+
+def parse_schedule(schedule) -> List[Window]:
+    """
+    Schedule windows from [(start, end, rate), ...] or a string like
+    '09:00-18:00=2M,18:00-09:00=0' (local time; rate 0 = unlimited)
+    """
+    if isinstance(schedule, str):
+        entries = []
+        for part in filter(None, (p.strip() for p in schedule.split(','))):
+            span, _, rate = part.partition('=')
+            start, _, end = span.partition('-')
+            if not rate or not end:
+                raise ValueError(f"Invalid schedule entry: {part}")
+            entries.append((start.strip(), end.strip(), rate))
+        schedule = entries
+    return [(parse_minute(start), parse_minute(end), parse_rate(rate)) for start, end, rate in schedule]
+
+class TokenBucket:
+    """
+    Byte-rate limiter (rate 0 = unlimited)
+    Up to `burst` seconds of traffic can be saved up. A request bigger than the
+    bucket still goes through at once and the debt is paid off by the requests
+    after it, so chunks of any size work with any rate.
+    """
+    
+    def __init__(self, rate: float = 0, burst: float = BANDWIDTH_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = rate * burst
+        self.updated = time.monotonic()
+        self.waited = 0.0                     # seconds requests spent throttled
+    
+    def current_rate(self) -> float:
+        return self.rate
+    
+    def set_rate(self, rate: float):
+        """Change the rate; requests already waiting pick it up within BANDWIDTH_RECHECK"""
+        self._refill()
+        self.rate = rate
+    
+    def _refill(self) -> float:
+        """Add the tokens earned since the last call; returns the rate in effect"""
+        now = time.monotonic()
+        rate = self.current_rate()
+        if rate:
+            self.tokens = min(rate * self.burst, self.tokens + (now - self.updated) * rate)
+        else:
+            self.tokens = 0.0
+        self.updated = now
+        return rate
+    
+    async def consume(self, nbytes: int):
+        """Wait until nbytes may be transferred"""
+        started = time.monotonic()
+        while True:
+            rate = self._refill()
+            if not rate:
+                break
+            if self.tokens >= 0:
+                self.tokens -= nbytes
+                break
+            # Sleep in short steps so rate changes apply to waiting requests
+            await asyncio.sleep(min(-self.tokens / rate, BANDWIDTH_RECHECK))
+        self.waited += time.monotonic() - started
+
+class ScheduledBucket(TokenBucket):
+    """Token bucket whose rate follows a time-of-day schedule (its own rate outside every window)"""
+    
+    def __init__(self, rate: float = 0, schedule: Optional[List[Window]] = None, burst: float = BANDWIDTH_BURST):
+        self.schedule = schedule or []
+        super().__init__(rate, burst)
+    
+    def current_rate(self) -> float:
+        if not self.schedule:
+            return self.rate
+        now = time.localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+        for start, end, rate in self.schedule:
+            if start <= minute < end or (end < start and (minute >= start or minute < end)):
+                return rate
+        return self.rate
+
+class BandwidthLimiter:
+    """Global and per-transfer byte limits for relay chunk traffic; all setters apply to running transfers"""
+    
+    def __init__(self, limit=BANDWIDTH_LIMIT, transfer_limit=BANDWIDTH_TRANSFER_LIMIT,
+                 schedule=BANDWIDTH_SCHEDULE):
+        self.bucket = ScheduledBucket(parse_rate(limit), parse_schedule(schedule))
+        self.transfer_limit = parse_rate(transfer_limit)
+        self.transfer_limits: Dict[str, float] = {}   # transfer_id -> its own cap
+        self.transfers: Dict[str, TokenBucket] = {}
+    
+    def set_limit(self, rate):
+        """Global cap outside the schedule windows (bytes/s or '2M'; 0 = unlimited)"""
+        self.bucket.set_rate(parse_rate(rate))
+    
+    def set_schedule(self, schedule):
+        """Replace the time-of-day schedule ([(start, end, rate)] or '09:00-18:00=2M,...')"""
+        self.bucket._refill()
+        self.bucket.schedule = parse_schedule(schedule)
+    
+    def set_transfer_limit(self, rate, transfer_id: Optional[str] = None):
+        """Cap one transfer, or (no transfer_id) every transfer without a cap of its own"""
+        rate = parse_rate(rate)
+        if transfer_id is not None:
+            self.transfer_limits[transfer_id] = rate
+            if transfer_id in self.transfers:
+                self.transfers[transfer_id].set_rate(rate)
+            return
+        self.transfer_limit = rate
+        for other, bucket in self.transfers.items():
+            if other not in self.transfer_limits:
+                bucket.set_rate(rate)
+    
+    @property
+    def limited(self) -> bool:
+        return bool(self.bucket.current_rate() or self.bucket.schedule or self.transfer_limit or self.transfer_limits)
+    
+    async def throttle(self, transfer_id: str, nbytes: int):
+        """Wait until nbytes of transfer_id may be sent or fetched"""
+        bucket = self.transfers.get(transfer_id)
+        if bucket is None:
+            bucket = self.transfers[transfer_id] = TokenBucket(self.transfer_limits.get(transfer_id, self.transfer_limit))
+        await bucket.consume(nbytes)
+        await self.bucket.consume(nbytes)
+    
+    def release(self, transfer_id: str):
+        """Forget a finished transfer's bucket (its own cap, if set, is kept)"""
+        self.transfers.pop(transfer_id, None)
+    
+    def describe(self) -> str:
+        """Current limits, for status output"""
+        def rate_text(rate: float) -> str:
+            return f"{rate / 1024 / 1024:.2f} MB/s" if rate else "unlimited"
+        
+        parts = [f"global {rate_text(self.bucket.current_rate())}"]
+        if self.bucket.schedule:
+            parts.append(f"{len(self.bucket.schedule)} schedule window(s), otherwise {rate_text(self.bucket.rate)}")
+        parts.append(f"per transfer {rate_text(self.transfer_limit)}")
+        return ", ".join(parts)
+
+# Shared by every TransferEngine in the process so the global cap covers all of them
+bandwidth = BandwidthLimiter()
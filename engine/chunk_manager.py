@@ -5,22 +5,67 @@ import os
 import hashlib
 import json
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional, Tuple
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import CHUNK_SIZE_LAN, CHUNK_SIZE_WEBRTC, CHUNK_SIZE_RELAY
+from config import (
+    CHUNK_SIZE_LAN, CHUNK_SIZE_WEBRTC, CHUNK_SIZE_RELAY,
+    CHUNKING, CDC_MIN_SIZE, CDC_AVG_SIZE, CDC_MAX_SIZE, PACK_SMALL_FILES, PACK_FILE_MAX,
+    CHUNK_COMPRESSION, CHUNK_COMPRESSION_LEVEL, COMPRESSION_MIN_SAVINGS
+)
+from engine.compression import get_algorithm, compress_chunk, spool_chunk
+from engine.manifest_codec import ChunkTable, json_default
+
+# Gear table for content-defined chunking (derived from SHA256 so every sender cuts alike)
+GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'big') for i in range(256)]
+MASK64 = (1 << 64) - 1
+
+def find_cdc_boundary(data: bytes, start: int, end: int, min_size: int, avg_size: int, max_size: int) -> int:
+    """
+    Find the end of the chunk starting at data[start] (FastCDC-style gear hash)
+    A cut is made where the rolling hash falls under a threshold; the threshold is
+    stricter before avg_size and looser after it so sizes cluster around avg_size
+    """
+    if end - start <= min_size:
+        return end
+    
+    bits = avg_size.bit_length() - 1
+    strict = 1 << (64 - bits - 1)
+    loose = 1 << (64 - bits + 1)
+    normal = min(start + avg_size, end)
+    limit = min(start + max_size, end)
+    gear = GEAR
+    h = 0
+    
+    for i in range(start + min_size, normal):
+        h = ((h << 1) + gear[data[i]]) & MASK64
+        if h < strict:
+            return i + 1
+    for i in range(normal, limit):
+        h = ((h << 1) + gear[data[i]]) & MASK64
+        if h < loose:
+            return i + 1
+    return limit
 
 class ChunkManager:
     """Manages file chunking and manifest generation"""
     
-    def __init__(self, mode: str = "relay"):
+    def __init__(self, mode: str = "relay", compression: Optional[str] = CHUNK_COMPRESSION):
         """
         Initialize chunk manager
         mode: 'lan', 'webrtc', or 'relay'
+        compression: relay chunk compression (None = chunks are stored raw)
         """
         self.mode = mode
         self.chunk_size = self._get_chunk_size(mode)
+        # Content-defined chunks let the relay reuse unchanged regions between versions
+        self.chunking = CHUNKING if mode == 'relay' else 'fixed'
+        # Relay chunks may be stored compressed (recorded per chunk in the manifest)
+        self.compression = get_algorithm(compression) if mode == 'relay' else None
+        self.compression_level = CHUNK_COMPRESSION_LEVEL
+        # Small folder files are concatenated into shared pack chunks
+        self.packing = PACK_SMALL_FILES
     
     def _get_chunk_size(self, mode: str) -> int:
         """Get chunk size based on transfer mode"""
@@ -43,93 +88,310 @@ class ChunkManager:
         """Calculate SHA256 hash of chunk data"""
         return hashlib.sha256(data).hexdigest()
     
+    def get_manifest_fingerprint(self, manifest: Dict) -> str:
+        """
+        Fingerprint of a file/folder manifest's content
+        Same fingerprint = same chunks, so an interrupted upload can be resumed
+        """
+        sha256 = hashlib.sha256()
+        sha256.update(f"{manifest['chunkSize']}\0{manifest.get('chunking', 'fixed')}\0".encode())
+        if 'files' in manifest:
+            for file_info in manifest['files']:
+                sha256.update(f"{file_info['relativePath']}\0{file_info['hash']}\0{file_info.get('pack')}\0".encode())
+        else:
+            sha256.update(manifest['hash'].encode())
+        return sha256.hexdigest()
+    
+    def iter_chunks(self, f, chunking: Optional[str] = None, chunk_size: Optional[int] = None) -> Iterator[bytes]:
+        """Yield the chunks of an open file (fixed size or content-defined)"""
+        chunking = chunking or self.chunking
+        chunk_size = chunk_size or self.chunk_size
+        
+        if chunking != 'cdc':
+            while chunk_data := f.read(chunk_size):
+                yield chunk_data
+            return
+        
+        buffer = b''
+        pos = 0
+        eof = False
+        while True:
+            if not eof and len(buffer) - pos < CDC_MAX_SIZE:
+                data = f.read(CDC_MAX_SIZE * 4)
+                eof = not data
+                buffer = buffer[pos:] + data
+                pos = 0
+            if pos >= len(buffer):
+                return
+            
+            cut = find_cdc_boundary(buffer, pos, len(buffer), CDC_MIN_SIZE, CDC_AVG_SIZE, CDC_MAX_SIZE)
+            if cut == len(buffer) and not eof and cut - pos < CDC_MAX_SIZE:
+                continue
+            yield buffer[pos:cut]
+            pos = cut
+    
+    def describe_chunk(self, chunk_id: int, chunk_data: bytes) -> Dict:
+        """
+        Manifest entry for a chunk: {id, hash, size}
+        Compressed form is what the relay stores and verifies, so its size and hash are added
+        (and the compressed bytes are spooled for the upload)
+        """
+        chunk_info = {
+            'id': chunk_id,
+            'hash': self.calculate_chunk_hash(chunk_data),
+            'size': len(chunk_data)
+        }
+        
+        compressed = compress_chunk(chunk_data, self.compression, self.compression_level, COMPRESSION_MIN_SAVINGS)
+        if compressed is not None:
+            chunk_info['compression'] = self.compression
+            chunk_info['compressedSize'] = len(compressed)
+            chunk_info['compressedHash'] = self.calculate_chunk_hash(compressed)
+            spool_chunk(chunk_info['compressedHash'], compressed)
+        return chunk_info
+    
     def create_file_manifest(self, file_path: str) -> Dict:
         """
         Create manifest for a single file
         Returns: {fileName, size, chunkSize, totalChunks, hash, chunks: [{id, hash, size}]}
+        Compressed chunks also carry compression, compressedSize and compressedHash;
+        content-defined chunks carry their offset. chunks is a ChunkTable (array-backed,
+        entries built on access)
         """
         file_path = Path(file_path)
         
-        if not file_path.exists():
+        if not file_path.is_file():
             raise FileNotFoundError(f"File not found: {file_path}")
         
-        file_size = file_path.stat().st_size
-        total_chunks = (file_size + self.chunk_size - 1) // self.chunk_size
-        
-        # Calculate file hash
-        file_hash = self.calculate_file_hash(str(file_path))
-        
-        # Generate chunk metadata
-        chunks = []
+        # File hash and chunk metadata in one read
+        file_hash = hashlib.sha256()
+        chunks = ChunkTable(self.chunk_size)
         with open(file_path, 'rb') as f:
             chunk_id = 0
-            while True:
-                chunk_data = f.read(self.chunk_size)
-                if not chunk_data:
-                    break
+            offset = 0
+            for chunk_data in self.iter_chunks(f):
+                file_hash.update(chunk_data)
+                chunk_info = self.describe_chunk(chunk_id, chunk_data)
+                if self.chunking == 'cdc':
+                    chunk_info['offset'] = offset
                 
-                chunks.append({
-                    'id': chunk_id,
-                    'hash': self.calculate_chunk_hash(chunk_data),
-                    'size': len(chunk_data)
-                })
+                chunks.append(chunk_info)
                 chunk_id += 1
+                offset += len(chunk_data)
         
-        return {
+        manifest = {
             'fileName': file_path.name,
             'filePath': str(file_path),
-            'size': file_size,
+            'size': offset,
             'chunkSize': self.chunk_size,
-            'totalChunks': total_chunks,
-            'hash': file_hash,
+            'totalChunks': len(chunks),
+            'hash': file_hash.hexdigest(),
             'chunks': chunks
         }
+        if self.chunking == 'cdc':
+            manifest['chunking'] = 'cdc'
+        if self.compression:
+            manifest['compression'] = self.compression
+            manifest['compressionLevel'] = self.compression_level
+        return manifest
+    
+    def create_pipelined_manifest(self, file_path: str) -> Dict:
+        """
+        Manifest of a file before it is hashed: sizes only (fixed-size chunks)
+        Chunk hashes and the file hash are filled in while the file is uploaded
+        """
+        file_path = Path(file_path)
+        
+        if not file_path.is_file():
+            raise FileNotFoundError(f"File not found: {file_path}")
+        
+        size = file_path.stat().st_size
+        return {
+            'fileName': file_path.name,
+            'filePath': str(file_path),
+            'size': size,
+            'chunkSize': self.chunk_size,
+            'totalChunks': (size + self.chunk_size - 1) // self.chunk_size,
+            'hash': None,
+            'pipelined': True
+        }
     
     def create_folder_manifest(self, folder_path: str) -> Dict:
         """
         Create manifest for entire folder
-        Returns: {folderName, totalSize, totalFiles, files: [file_manifests]}
+        Returns: {folderName, totalSize, totalFiles, files: [file_manifests], packs: [pack entries]}
+        Files under PACK_FILE_MAX have no chunks of their own; they carry pack and
+        packOffset and their bytes live in the pack chunk (one request per pack)
         """
         folder_path = Path(folder_path)
         
-        if not folder_path.exists() or not folder_path.is_dir():
+        if not folder_path.is_dir():
             raise NotADirectoryError(f"Folder not found: {folder_path}")
         
         files = []
-        total_size = 0
-        
-        # Scan all files recursively
-        for file_path in folder_path.rglob('*'):
-            if file_path.is_file():
-                file_manifest = self.create_file_manifest(str(file_path))
-                
-                # Store relative path
-                file_manifest['relativePath'] = str(file_path.relative_to(folder_path))
-                
-                files.append(file_manifest)
-                total_size += file_manifest['size']
+        packs = []
+        for kind, entry in self.iter_folder_manifest(str(folder_path)):
+            if kind == 'file':
+                files.append(entry)
+            else:
+                packs.append(entry)
         
-        return {
+        return self.build_folder_manifest(str(folder_path), files, packs)
+    
+    def build_folder_manifest(self, folder_path: str, files: List[Dict], packs: List[Dict]) -> Dict:
+        """Assemble a folder manifest from streamed file and pack entries"""
+        folder_path = Path(folder_path)
+        manifest = {
             'folderName': folder_path.name,
             'folderPath': str(folder_path),
-            'totalSize': total_size,
+            'totalSize': sum(f['size'] for f in files),
             'totalFiles': len(files),
             'chunkSize': self.chunk_size,
+            'chunking': self.chunking,
             'mode': self.mode,
             'files': files
         }
+        if packs:
+            manifest['packs'] = packs
+        if self.compression:
+            manifest['compression'] = self.compression
+            manifest['compressionLevel'] = self.compression_level
+        return manifest
+    
+    def scan_folder(self, folder_path: str) -> Iterator[Tuple[str, str, int]]:
+        """
+        Walk a folder with os.scandir, yielding (path, relative_path, size) for every file
+        Directory entry type info is reused, so each file costs one stat at most
+        (symlinked directories are not followed, like Path.rglob)
+        """
+        stack = [(folder_path, '')]
+        while stack:
+            directory, prefix = stack.pop()
+            try:
+                it = os.scandir(directory)
+            except OSError as e:
+                print(f"⚠️  Skipping {directory}: {e}")
+                continue
+            
+            with it:
+                for entry in it:
+                    relative_path = os.path.join(prefix, entry.name) if prefix else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((entry.path, relative_path))
+                        elif entry.is_file():
+                            yield entry.path, relative_path, entry.stat().st_size
+                    except OSError as e:
+                        print(f"⚠️  Skipping {entry.path}: {e}")
+    
+    def iter_folder_manifest(self, folder_path: str) -> Iterator[Tuple[str, Dict]]:
+        """
+        Stream a folder manifest: yields ('file', file_manifest) as each file is hashed
+        and ('pack', pack_info) whenever a pack chunk is full
+        Files under PACK_FILE_MAX have no chunks of their own; they carry pack and
+        packOffset and their bytes live in the pack chunk (one request per pack)
+        """
+        file_index = 0
+        pack_id = 0
+        pack_data = bytearray()
+        pack_files = []
+        
+        def flush_pack() -> Dict:
+            pack_info = self.describe_chunk(pack_id, bytes(pack_data))
+            pack_info['files'] = list(pack_files)
+            pack_data.clear()
+            pack_files.clear()
+            return pack_info
+        
+        for file_path, relative_path, size in self.scan_folder(folder_path):
+            if self.packing and size < PACK_FILE_MAX:
+                with open(file_path, 'rb') as f:
+                    data = f.read()
+                if pack_files and len(pack_data) + len(data) > self.chunk_size:
+                    yield 'pack', flush_pack()
+                    pack_id += 1
+                
+                file_manifest = {
+                    'fileName': os.path.basename(file_path),
+                    'filePath': file_path,
+                    'relativePath': relative_path,
+                    'size': len(data),
+                    'chunkSize': self.chunk_size,
+                    'totalChunks': 0,
+                    'hash': self.calculate_chunk_hash(data),
+                    'chunks': [],
+                    'pack': pack_id,
+                    'packOffset': len(pack_data)
+                }
+                pack_files.append(file_index)
+                pack_data.extend(data)
+            else:
+                file_manifest = self.create_file_manifest(file_path)
+                
+                # Store relative path
+                file_manifest['relativePath'] = relative_path
+            
+            yield 'file', file_manifest
+            file_index += 1
+        
+        if pack_files:
+            yield 'pack', flush_pack()
     
-    def read_chunk(self, file_path: str, chunk_id: int) -> bytes:
-        """Read a specific chunk from file"""
-        offset = chunk_id * self.chunk_size
+    def read_pack(self, manifest: Dict, pack_info: Dict) -> bytes:
+        """Concatenate the files of a pack chunk"""
+        return b''.join(
+            Path(manifest['files'][file_index]['filePath']).read_bytes() for file_index in pack_info['files']
+        )
+    
+    def unpack(self, manifest: Dict, pack_info: Dict, pack_data: bytes, base_path: Path):
+        """Write the files of a downloaded pack chunk under base_path"""
+        for file_index in pack_info['files']:
+            file_info = manifest['files'][file_index]
+            file_path = base_path / file_info['relativePath']
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            
+            start = file_info['packOffset']
+            file_path.write_bytes(pack_data[start:start + file_info['size']])
+    
+    def is_pack_current(self, manifest: Dict, pack_info: Dict, base_path: Path) -> bool:
+        """Check whether every file of a pack already exists unchanged under base_path"""
+        for file_index in pack_info['files']:
+            file_info = manifest['files'][file_index]
+            file_path = base_path / file_info['relativePath']
+            if not file_path.is_file() or file_path.stat().st_size != file_info['size']:
+                return False
+            if self.calculate_chunk_hash(file_path.read_bytes()) != file_info['hash']:
+                return False
+        return True
+    
+    def get_chunk_span(self, file_manifest: Dict, chunk_id: int) -> Tuple[int, int]:
+        """
+        Get (offset, size) of a chunk in a file manifest
+        Content-defined chunks carry their offset; fixed chunks use the manifest chunkSize
+        """
+        chunks = file_manifest.get('chunks')
+        if isinstance(chunks, ChunkTable) and chunk_id < len(chunks):
+            return chunks.span(chunk_id)
+        if chunks and chunk_id < len(chunks) and 'offset' in chunks[chunk_id]:
+            return chunks[chunk_id]['offset'], chunks[chunk_id]['size']
+        
+        chunk_size = file_manifest.get('chunkSize', self.chunk_size)
+        return chunk_id * chunk_size, chunk_size
+    
+    def read_chunk(self, file_path: str, chunk_id: int, offset: Optional[int] = None,
+                   size: Optional[int] = None) -> bytes:
+        """Read a specific chunk from file (at offset if given)"""
+        if offset is None:
+            offset = chunk_id * self.chunk_size
         
         with open(file_path, 'rb') as f:
             f.seek(offset)
-            return f.read(self.chunk_size)
+            return f.read(size if size is not None else self.chunk_size)
     
-    def write_chunk(self, file_path: str, chunk_id: int, data: bytes):
+    def write_chunk(self, file_path: str, chunk_id: int, data: bytes, offset: Optional[int] = None):
         """Write a chunk to file at specific position"""
-        offset = chunk_id * self.chunk_size
+        if offset is None:
+            offset = chunk_id * self.chunk_size
         
         # Create parent directories if needed
         Path(file_path).parent.mkdir(parents=True, exist_ok=True)
@@ -152,21 +414,62 @@ class ChunkManager:
         actual_hash = self.calculate_file_hash(file_path)
         return actual_hash == expected_hash
     
-    def get_missing_chunks(self, file_path: str, total_chunks: int) -> List[int]:
+    def plan_delta(self, file_path: str, file_manifest: Dict) -> Tuple[List[int], Dict[int, int]]:
+        """
+        Compare an existing local copy against a file manifest
+        The local file is cut with the manifest's chunk layout and hashed, so chunks
+        that only moved (content-defined chunking) are found too
+        Returns (chunk ids to download, {chunk_id: offset of matching data in the local file})
+        """
+        chunks = file_manifest.get('chunks', [])
+        if not os.path.exists(file_path):
+            return [chunk['id'] for chunk in chunks], {}
+        
+        local = {}
+        with open(file_path, 'rb') as f:
+            offset = 0
+            for chunk_data in self.iter_chunks(f, file_manifest.get('chunking', 'fixed'), file_manifest.get('chunkSize')):
+                local.setdefault(self.calculate_chunk_hash(chunk_data), offset)
+                offset += len(chunk_data)
+        
+        missing = []
+        reuse = {}
+        for chunk in chunks:
+            if chunk['hash'] in local:
+                reuse[chunk['id']] = local[chunk['hash']]
+            else:
+                missing.append(chunk['id'])
+        return missing, reuse
+    
+    def get_missing_chunks(self, file_path: str, total_chunks: int, chunks: Optional[List[Dict]] = None) -> List[int]:
         """
         Get list of missing chunks for resume functionality
         Returns list of chunk IDs that need to be downloaded
+        chunks: manifest chunk entries, needed for content-defined (variable size) chunks
         """
         if not os.path.exists(file_path):
             # File doesn't exist, all chunks missing
             return list(range(total_chunks))
         
         file_size = os.path.getsize(file_path)
+        
+        if chunks and 'offset' in chunks[0]:
+            return [chunk['id'] for chunk in chunks if chunk['offset'] + chunk['size'] > file_size]
         downloaded_chunks = file_size // self.chunk_size
         
         # All chunks after downloaded_chunks are missing
         return list(range(downloaded_chunks, total_chunks))
 
+def count_chunks(manifest: Dict) -> int:
+    """Total transfer chunks of a file or folder manifest (file chunks + pack chunks)"""
+    if 'files' in manifest:
+        return sum(f['totalChunks'] for f in manifest['files']) + len(manifest.get('packs', []))
+    return manifest.get('totalChunks', 0)
+
+def get_stored_hash(chunk_info: Dict) -> str:
+    """Hash of a chunk as stored on the relay (compressed form if compressed)"""
+    return chunk_info.get('compressedHash', chunk_info['hash'])
+
 def format_size(size_bytes: int) -> str:
     """Format bytes to human readable size"""
     for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
@@ -200,7 +503,7 @@ if __name__ == "__main__":
         print(f"✅ Folder: {manifest['folderName']}")
         print(f"📦 Total Size: {format_size(manifest['totalSize'])}")
         print(f"📄 Files: {manifest['totalFiles']}")
-        print(f"🔢 Total Chunks: {sum(f['totalChunks'] for f in manifest['files'])}")
+        print(f"🔢 Total Chunks: {count_chunks(manifest)}")
     
     else:
         print(f"❌ Path not found: {path}")
@@ -209,6 +512,6 @@ if __name__ == "__main__":
     # Save manifest
     output_file = "manifest.json"
     with open(output_file, 'w') as f:
-        json.dump(manifest, f, indent=2)
+        json.dump(manifest, f, indent=2, default=json_default)
     
     print(f"\n💾 Manifest saved to: {output_file}")
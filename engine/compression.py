@@ -0,0 +1,120 @@
+"""
+Compression - Per-chunk compression for relay transfers
+zlib is always available; zstd is used when the zstandard package is installed
+Chunks compressed while a manifest is built are spooled to disk by their stored
+hash, so the upload reads them back instead of compressing a second time
+"""
+import hashlib
+import os
+import sys
+import time
+import zlib
+from typing import Iterable, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import COMPRESSION_SPOOL, COMPRESSION_SPOOL_DIR
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ALGORITHMS = ('zlib', 'zstd')
+SAMPLE_SIZE = 64 * 1024              # bytes test-compressed before a whole chunk
+
+def get_algorithm(preferred: Optional[str]) -> Optional[str]:
+    """
+    Resolve the configured algorithm to one available here
+    zstd falls back to zlib when zstandard isn't installed; None disables compression
+    """
+    if not preferred:
+        return None
+    if preferred not in ALGORITHMS:
+        raise ValueError(f"Unknown compression: {preferred}")
+    if preferred == 'zstd' and zstandard is None:
+        return 'zlib'
+    return preferred
+
+def compress(data: bytes, algorithm: str, level: int) -> bytes:
+    """Compress data with zlib or zstd"""
+    if algorithm == 'zlib':
+        return zlib.compress(data, level)
+    if algorithm == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f"Unknown compression: {algorithm}")
+
+def decompress(data: bytes, algorithm: str) -> bytes:
+    """Decompress a zlib or zstd chunk"""
+    if algorithm == 'zlib':
+        return zlib.decompress(data)
+    if algorithm == 'zstd':
+        if zstandard is None:
+            raise Exception("Chunk is zstd-compressed; install the zstandard package to receive it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown compression: {algorithm}")
+
+def compress_chunk(data: bytes, algorithm: Optional[str], level: int, min_savings: float) -> Optional[bytes]:
+    """
+    Compress a chunk if it's worth it
+    Returns None for chunks that don't shrink by min_savings (they are sent raw)
+    """
+    if not algorithm or not data:
+        return None
+
+    limit = 1 - min_savings
+
+    # Cheap test on a sample so media/archives are skipped without compressing the whole chunk
+    if len(data) > 2 * SAMPLE_SIZE:
+        sample = data[:SAMPLE_SIZE]
+        if len(compress(sample, algorithm, 1)) > len(sample) * limit:
+            return None
+
+    compressed = compress(data, algorithm, level)
+    if len(compressed) > len(data) * limit:
+        return None
+    return compressed
+
+def spool_chunk(stored_hash: str, data: bytes):
+    """Keep a compressed chunk until it is uploaded (no-op when spooling is off)"""
+    if not COMPRESSION_SPOOL:
+        return
+    path = os.path.join(COMPRESSION_SPOOL_DIR, stored_hash)
+    if os.path.exists(path):
+        return
+    os.makedirs(COMPRESSION_SPOOL_DIR, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.part"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def read_spooled(stored_hash: str) -> Optional[bytes]:
+    """A spooled compressed chunk, or None if it's missing or damaged"""
+    try:
+        with open(os.path.join(COMPRESSION_SPOOL_DIR, stored_hash), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    # Hashing is far cheaper than compressing again
+    return data if hashlib.sha256(data).hexdigest() == stored_hash else None
+
+def discard_spooled(stored_hashes: Iterable[str]):
+    """Drop spooled chunks once the relay has them"""
+    for stored_hash in stored_hashes:
+        try:
+            os.remove(os.path.join(COMPRESSION_SPOOL_DIR, stored_hash))
+        except OSError:
+            pass
+
+def prune_spool(max_age: float):
+    """Remove chunks left by uploads that were abandoned more than max_age seconds ago"""
+    cutoff = time.time() - max_age
+    try:
+        entries = list(os.scandir(COMPRESSION_SPOOL_DIR))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
@@ -0,0 +1,72 @@
+"""
+Download Journal - Record of verified chunks for resuming LAN downloads
+An append-only file next to the output: a header with the manifest fingerprint,
+then one fixed-size entry per chunk written and verified. A resumed download
+skips exactly the journaled chunks; a torn last entry is ignored.
+"""
+import os
+import struct
+from typing import Set, Tuple
+
+MAGIC = b'SAJ1'
+ENTRY = struct.Struct('<iI')         # file index (-1 single file, PACK_INDEX packs), chunk id
+SINGLE_FILE = -1
+PACK_INDEX = -2
+
+class DownloadJournal:
+    """Completed (file_index, chunk_id) pairs of one download"""
+    
+    def __init__(self, path: str, fingerprint: str):
+        self.path = path
+        self.header = MAGIC + bytes.fromhex(fingerprint)
+        self.done: Set[Tuple[int, int]] = set()
+        self.resumed = False
+        self._file = None
+    
+    def open(self) -> Set[Tuple[int, int]]:
+        """
+        Load a journal left by an interrupted download of the same manifest
+        A journal for other content is discarded; returns the completed entries
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+        
+        if data[:len(self.header)] == self.header:
+            body = data[len(self.header):]
+            usable = len(body) - len(body) % ENTRY.size
+            self.done = set(ENTRY.iter_unpack(body[:usable]))
+            self.resumed = True
+            self._file = open(self.path, 'r+b')
+            self._file.seek(len(self.header) + usable)
+            self._file.truncate()
+        else:
+            self._file = open(self.path, 'wb')
+            self._file.write(self.header)
+            self._file.flush()
+        return self.done
+    
+    def record(self, file_index: int, chunk_id: int):
+        """Journal a chunk once its data is written"""
+        self.done.add((file_index, chunk_id))
+        self._file.write(ENTRY.pack(file_index, chunk_id))
+        self._file.flush()
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def remove(self):
+        """Delete the journal after a complete download"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+def get_journal_path(output_path: str) -> str:
+    """Journal file kept next to a download's output file or folder"""
+    return str(output_path).rstrip('/\\') + '.sajournal'
@@ -0,0 +1,158 @@
+"""
+File Cache - LRU cache of open file handles for the LAN server
+Concurrent chunk requests to the same file share one handle and read it with
+positional reads (or sendfile), so nothing depends on the shared file position.
+Only idle handles are closed when the cache is over its cap. Files that may still
+grow (a seeding receiver's download) are sized on every read, and a path that gets
+replaced on disk has to be evicted so later reads open the new file.
+"""
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import LAN_MAX_OPEN_FILES
+
+class CachedFile:
+    """An open read-only file shared by concurrent readers"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.fobj = open(path, 'rb', buffering=0)
+        self.refs = 0
+        # Only needed where os.pread is missing (Windows)
+        self._seek_lock = threading.Lock()
+    
+    def fileno(self) -> int:
+        return self.fobj.fileno()
+    
+    @property
+    def size(self) -> int:
+        """Current size (re-read each time: the file may still be written to)"""
+        return os.fstat(self.fobj.fileno()).st_size
+    
+    def pread(self, offset: int, size: int) -> bytes:
+        """Read size bytes at offset without relying on the file position"""
+        size = max(0, min(size, self.size - offset))
+        if hasattr(os, 'pread'):
+            parts = []
+            while size > 0:
+                data = os.pread(self.fobj.fileno(), size, offset)
+                if not data:
+                    break
+                parts.append(data)
+                offset += len(data)
+                size -= len(data)
+            return b''.join(parts)
+        
+        with self._seek_lock:
+            self.fobj.seek(offset)
+            return self.fobj.read(size)
+    
+    def close(self):
+        self.fobj.close()
+
+class FileHandleCache:
+    """Keeps up to max_open files open, closing the least recently used idle ones"""
+    
+    def __init__(self, max_open: int = LAN_MAX_OPEN_FILES):
+        self.max_open = max_open
+        self.files: "OrderedDict[str, CachedFile]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def try_acquire(self, path: str) -> Optional[CachedFile]:
+        """Get the handle for path if it's already open (never blocks on I/O), else None"""
+        with self.lock:
+            cached = self.files.get(path)
+            if cached is not None:
+                self.files.move_to_end(path)
+                cached.refs += 1
+                self.hits += 1
+            return cached
+    
+    def acquire(self, path: str) -> CachedFile:
+        """Get an open handle for path (opening it on a miss); pair with release()"""
+        cached = self.try_acquire(path)
+        if cached is not None:
+            return cached
+        
+        # Open outside the lock; if another thread raced us, keep its handle
+        opened = CachedFile(path)
+        with self.lock:
+            cached = self.files.get(path)
+            if cached is None:
+                cached = opened
+                self.files[path] = cached
+                self.misses += 1
+            else:
+                self.files.move_to_end(path)
+                self.hits += 1
+            cached.refs += 1
+            self._trim()
+        
+        if cached is not opened:
+            opened.close()
+        return cached
+    
+    def release(self, cached: CachedFile):
+        with self.lock:
+            cached.refs -= 1
+            if self.files.get(cached.path) is not cached and cached.refs == 0:
+                cached.close()
+            else:
+                self._trim()
+    
+    def evict(self, path: str):
+        """Forget path's handle (it was replaced on disk); a busy one closes on its last release"""
+        with self.lock:
+            cached = self.files.pop(path, None)
+            if cached is not None and cached.refs == 0:
+                cached.close()
+    
+    @contextmanager
+    def open(self, path: str):
+        """Context manager form of acquire/release"""
+        cached = self.acquire(path)
+        try:
+            yield cached
+        finally:
+            self.release(cached)
+    
+    def pread(self, path: str, offset: int, size: int) -> bytes:
+        """Read size bytes of path at offset through the cache"""
+        with self.open(path) as cached:
+            return cached.pread(offset, size)
+    
+    def _trim(self):
+        """Close least recently used idle handles until under the cap (caller holds the lock)"""
+        if len(self.files) <= self.max_open:
+            return
+        for path in list(self.files):
+            if len(self.files) <= self.max_open:
+                break
+            cached = self.files[path]
+            if cached.refs == 0:
+                del self.files[path]
+                cached.close()
+    
+    def close_all(self):
+        """Close every idle handle and forget the busy ones (closed on their last release)"""
+        with self.lock:
+            for cached in self.files.values():
+                if cached.refs == 0:
+                    cached.close()
+            self.files.clear()
+    
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                'open_files': len(self.files),
+                'max_open': self.max_open,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,214 @@
+"""
+LAN Discovery - Find a LAN sender from a pair code over UDP multicast/broadcast
+The sender's announcer listens on LAN_DISCOVERY_PORT (UDP) and answers queries
+for its transfer key; the receiver multicasts/broadcasts a query and takes the
+first answer, so resolving a pair code on the same LAN takes a few milliseconds.
+The key is a hash of the pair code and transfer id, so the code itself is never
+broadcast. Receivers seeding the transfer answer for the same key.
+"""
+import asyncio
+import hashlib
+import json
+import socket
+import struct
+import sys
+import os
+from typing import List, Optional, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (
+    LAN_DISCOVERY_PORT, LAN_MULTICAST_GROUP, LAN_DISCOVERY_TIMEOUT, LAN_DISCOVERY_RETRY, LAN_DISCOVERY_SETTLE
+)
+
+APP = 'sendanywhere'
+VERSION = 1
+
+# (ip, http port, stream port or None)
+LANPeer = Tuple[str, int, Optional[int]]
+
+def get_transfer_key(pair_code: str, transfer_id: str) -> str:
+    """Discovery key for a transfer (the pair code is never sent in clear)"""
+    return hashlib.sha256(f"{pair_code}:{transfer_id}".encode()).hexdigest()[:32]
+
+def get_local_ip() -> str:
+    """
+    Best guess at this host's LAN address without needing internet access
+    connect() on a UDP socket only picks a route, nothing is sent
+    """
+    for target in (LAN_MULTICAST_GROUP, '10.255.255.255', '192.168.255.255', '8.8.8.8'):
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.connect((target, LAN_DISCOVERY_PORT))
+                ip = s.getsockname()[0]
+            if ip and not ip.startswith(('0.', '127.')):
+                return ip
+        except OSError:
+            continue
+    
+    try:
+        for ip in socket.gethostbyname_ex(socket.gethostname())[2]:
+            if not ip.startswith('127.'):
+                return ip
+    except OSError:
+        pass
+    return "127.0.0.1"
+
+def encode_message(message: dict) -> bytes:
+    return json.dumps(dict(message, app=APP, v=VERSION)).encode()
+
+def decode_message(data: bytes) -> Optional[dict]:
+    """Parse a discovery datagram; None for anything that isn't ours"""
+    try:
+        message = json.loads(data.decode())
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(message, dict) or message.get('app') != APP or message.get('v') != VERSION:
+        return None
+    return message
+
+class AnnouncerProtocol(asyncio.DatagramProtocol):
+    """Answers discovery queries for one transfer key"""
+    
+    def __init__(self, key: str, port: int, stream_port: Optional[int]):
+        self.key = key
+        # id tells apart the answers of one server reached through several addresses
+        self.reply = encode_message({'type': 'peer', 'key': key, 'port': port, 'stream': stream_port,
+                                     'id': os.urandom(8).hex()})
+        self.transport = None
+    
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def datagram_received(self, data, addr):
+        message = decode_message(data)
+        if message and message.get('type') == 'query' and message.get('key') == self.key:
+            self.transport.sendto(self.reply, addr)
+
+class LANAnnouncer:
+    """UDP announcer run by LANTransferServer while it serves a paired transfer"""
+    
+    def __init__(self, key: str, port: int, stream_port: Optional[int] = None,
+                 discovery_port: int = LAN_DISCOVERY_PORT):
+        self.key = key
+        self.port = port
+        self.stream_port = stream_port
+        self.discovery_port = discovery_port
+        self.transport = None
+    
+    def make_socket(self) -> socket.socket:
+        """Socket on the discovery port that receives broadcast and multicast queries"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Several senders on one host can all answer
+        if hasattr(socket, 'SO_REUSEPORT'):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            except OSError:
+                pass
+        sock.bind(('', self.discovery_port))
+        
+        try:
+            membership = struct.pack('4s4s', socket.inet_aton(LAN_MULTICAST_GROUP), socket.inet_aton('0.0.0.0'))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except OSError:
+            # No multicast route (e.g. offline host); broadcast queries still arrive
+            pass
+        return sock
+    
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: AnnouncerProtocol(self.key, self.port, self.stream_port),
+            sock=self.make_socket()
+        )
+    
+    def stop(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+class ResolverProtocol(asyncio.DatagramProtocol):
+    """Collects peer answers for a key; found is set on the first"""
+    
+    def __init__(self, key: str, found: asyncio.Future):
+        self.key = key
+        self.found = found
+        self.peers: List[LANPeer] = []
+        self.seen = set()
+    
+    def datagram_received(self, data, addr):
+        message = decode_message(data)
+        if (message and message.get('type') == 'peer' and message.get('key') == self.key
+                and isinstance(message.get('port'), int)):
+            stream_port = message.get('stream')
+            peer = (addr[0], message['port'], stream_port if isinstance(stream_port, int) else None)
+            server_id = message.get('id', peer)
+            if server_id not in self.seen:
+                self.seen.add(server_id)
+                self.peers.append(peer)
+            if not self.found.done():
+                self.found.set_result(peer)
+
+async def resolve_peer(pair_code: str, transfer_id: str, timeout: float = LAN_DISCOVERY_TIMEOUT,
+                       discovery_port: int = LAN_DISCOVERY_PORT) -> Optional[LANPeer]:
+    """
+    Find a LAN server of a transfer (the sender or a seeding receiver)
+    Returns (ip, port, stream_port), or None if nobody answers within timeout
+    """
+    peers = await resolve_peers(pair_code, transfer_id, timeout, discovery_port, settle=0)
+    return peers[0] if peers else None
+
+async def resolve_peers(pair_code: str, transfer_id: str, timeout: float = LAN_DISCOVERY_TIMEOUT,
+                        discovery_port: int = LAN_DISCOVERY_PORT,
+                        settle: float = LAN_DISCOVERY_SETTLE) -> List[LANPeer]:
+    """
+    Find every LAN server of a transfer
+    Queries go to the multicast group, the broadcast address and this host; after
+    the first answer, others are collected for settle seconds (empty list if nobody
+    answers within timeout)
+    """
+    loop = asyncio.get_running_loop()
+    key = get_transfer_key(pair_code, transfer_id)
+    found = loop.create_future()
+    
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        sock.bind(('', 0))
+    except OSError:
+        sock.close()
+        return []
+    
+    transport, protocol = await loop.create_datagram_endpoint(lambda: ResolverProtocol(key, found), sock=sock)
+    query = encode_message({'type': 'query', 'key': key})
+    targets = [(LAN_MULTICAST_GROUP, discovery_port), ('255.255.255.255', discovery_port), ('127.0.0.1', discovery_port)]
+    
+    def send_queries():
+        for target in targets:
+            try:
+                transport.sendto(query, target)
+            except OSError:
+                # Unroutable target (no multicast/broadcast route); the others may still work
+                pass
+    
+    try:
+        deadline = loop.time() + timeout
+        while not found.done():
+            send_queries()
+            
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(asyncio.shield(found), min(LAN_DISCOVERY_RETRY, remaining))
+            except asyncio.TimeoutError:
+                pass
+        
+        if found.done() and settle > 0:
+            # One more round of queries, then give slower peers a moment to answer
+            send_queries()
+            await asyncio.sleep(settle)
+        return list(protocol.peers)
+    finally:
+        transport.close()
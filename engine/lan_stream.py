@@ -0,0 +1,290 @@
+"""
+LAN Stream - Persistent multiplexed TCP transport for LAN transfers
+A few long-lived connections carry framed requests; clients pipeline several
+requests per connection and responses are matched by request id. File data
+is sent with sendfile. Used by LANTransferClient when the server advertises
+a stream port, with plain HTTP as the fallback.
+
+Frames (little-endian):
+  handshake  MAGIC both ways
+  request    request_id u32, kind u8, file_index i32 (-1 = single file), a u64, b u64
+  response   request_id u32, status u8 (0 ok, 1 error), length u64, payload
+"""
+import asyncio
+import socket
+import struct
+import sys
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import LAN_SOCKET_BUFFER, LAN_STREAM_CONNECTIONS, LAN_STREAM_PIPELINE
+from engine.file_cache import CachedFile, FileHandleCache
+
+MAGIC = b'SALS\x01'
+REQUEST = struct.Struct('<IBiQQ')
+RESPONSE = struct.Struct('<IBQ')
+
+# Request kinds
+KIND_CHUNK = 0      # a = chunk id
+KIND_PACK = 1       # a = pack id
+KIND_RANGE = 2      # a = offset, b = length
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# A request resolves to a file span (path, offset, count) or in-memory bytes
+Source = Union[Tuple[str, int, int], bytes]
+
+def configure_socket(sock: Optional[socket.socket]):
+    """Apply LAN socket buffer sizes and disable Nagle"""
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if LAN_SOCKET_BUFFER:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, LAN_SOCKET_BUFFER)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, LAN_SOCKET_BUFFER)
+    except OSError:
+        pass
+
+def make_listen_socket(port: int, host: str = '0.0.0.0', reuse_port: bool = False) -> socket.socket:
+    """
+    Bound TCP socket for a LAN listener (buffer sizes set before listen so they apply to accepted sockets)
+    reuse_port lets several worker processes bind the same port (the kernel spreads connections)
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    configure_socket(sock)
+    sock.bind((host, port))
+    return sock
+
+class ServerStats:
+    """Requests and bytes served by one LAN server process"""
+    
+    def __init__(self):
+        self.requests = 0
+        self.bytes_sent = 0
+    
+    def add(self, nbytes: int):
+        self.requests += 1
+        self.bytes_sent += nbytes
+
+async def send_span(transport, cached: CachedFile, offset: int, count: int,
+                    write: Callable[[bytes], Awaitable[None]]):
+    """
+    Send count bytes of a cached file from offset with sendfile
+    Falls back to a positional read in a worker thread (e.g. TLS); the handle
+    may be shared, so the loop's own seek-and-read fallback is never used
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.sendfile(transport, cached.fobj, offset, count, fallback=False)
+    except RuntimeError:
+        # Also raised as SendfileNotAvailableError when the transport can't sendfile
+        if transport.is_closing():
+            raise ConnectionResetError("Connection lost")
+        await write(await loop.run_in_executor(None, cached.pread, offset, count))
+
+async def acquire_file(files: FileHandleCache, path: str) -> CachedFile:
+    """Get a cached handle, opening misses in a worker thread"""
+    cached = files.try_acquire(path)
+    if cached is None:
+        cached = await asyncio.get_running_loop().run_in_executor(None, files.acquire, path)
+    return cached
+
+class LANStreamServer:
+    """Serves framed requests; resolve(kind, file_index, a, b) maps a request to a Source"""
+    
+    def __init__(self, resolve: Callable[[int, int, int, int], Awaitable[Source]], port: int,
+                 files: Optional[FileHandleCache] = None, stats: Optional[ServerStats] = None):
+        self.resolve = resolve
+        self.port = port
+        self.files = files if files is not None else FileHandleCache()
+        self.stats = stats if stats is not None else ServerStats()
+        self.server: Optional[asyncio.AbstractServer] = None
+    
+    async def start(self, host: str = '0.0.0.0', sock: Optional[socket.socket] = None, reuse_port: bool = False):
+        """Listen on the stream port, or on an already bound socket handed over by a parent process"""
+        if sock is None:
+            sock = make_listen_socket(self.port, host, reuse_port)
+        self.server = await asyncio.start_server(self.handle_connection, sock=sock)
+    
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+    
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer requests on one connection in order until the client disconnects"""
+        configure_socket(writer.get_extra_info('socket'))
+        
+        async def write(data: bytes):
+            writer.write(data)
+            await writer.drain()
+        
+        try:
+            if await reader.readexactly(len(MAGIC)) != MAGIC:
+                return
+            await write(MAGIC)
+            
+            while True:
+                try:
+                    header = await reader.readexactly(REQUEST.size)
+                except asyncio.IncompleteReadError:
+                    return
+                request_id, kind, file_index, a, b = REQUEST.unpack(header)
+                
+                try:
+                    source = await self.resolve(kind, file_index, a, b)
+                except Exception as e:
+                    message = str(e).encode()
+                    await write(RESPONSE.pack(request_id, STATUS_ERROR, len(message)) + message)
+                    continue
+                
+                if isinstance(source, bytes):
+                    self.stats.add(len(source))
+                    await write(RESPONSE.pack(request_id, STATUS_OK, len(source)) + source)
+                    continue
+                
+                file_path, offset, count = source
+                try:
+                    cached = await acquire_file(self.files, file_path)
+                except OSError as e:
+                    message = str(e).encode()
+                    await write(RESPONSE.pack(request_id, STATUS_ERROR, len(message)) + message)
+                    continue
+                try:
+                    count = max(0, min(count, cached.size - offset))
+                    self.stats.add(count)
+                    await write(RESPONSE.pack(request_id, STATUS_OK, count))
+                    if count:
+                        await send_span(writer.transport, cached, offset, count, write)
+                finally:
+                    self.files.release(cached)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Cancelled on server shutdown; nothing awaits this handler
+            pass
+        finally:
+            writer.close()
+
+class StreamConnection:
+    """One client connection with up to `depth` pipelined requests in flight"""
+    
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, depth: int):
+        self.reader = reader
+        self.writer = writer
+        self.slots = asyncio.Semaphore(depth)
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.closed = False
+        self.task = asyncio.create_task(self._read_responses())
+    
+    async def request(self, request_id: int, kind: int, file_index: int, a: int, b: int) -> bytes:
+        async with self.slots:
+            if self.closed:
+                raise ConnectionError("LAN stream closed")
+            future = asyncio.get_running_loop().create_future()
+            self.pending[request_id] = future
+            self.writer.write(REQUEST.pack(request_id, kind, file_index, a, b))
+            await self.writer.drain()
+            return await future
+    
+    async def _read_responses(self):
+        """Resolve pending requests as their responses arrive"""
+        error: Exception = ConnectionError("LAN stream closed")
+        try:
+            while True:
+                request_id, status, length = RESPONSE.unpack(await self.reader.readexactly(RESPONSE.size))
+                payload = await self.reader.readexactly(length)
+                future = self.pending.pop(request_id, None)
+                if future is None or future.done():
+                    continue
+                if status == STATUS_OK:
+                    future.set_result(payload)
+                else:
+                    future.set_exception(Exception(payload.decode(errors='replace')))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = ConnectionError(f"LAN stream lost: {e}")
+        finally:
+            self.closed = True
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.pending.clear()
+    
+    async def close(self):
+        self.closed = True
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.writer.close()
+
+class LANStreamClient:
+    """Pool of stream connections to one LAN server; requests go to the least busy connection"""
+    
+    def __init__(self, host: str, port: int, connections: int = LAN_STREAM_CONNECTIONS,
+                 depth: int = LAN_STREAM_PIPELINE):
+        self.host = host
+        self.port = port
+        self.connections_wanted = connections
+        self.depth = depth
+        self.connections: List[StreamConnection] = []
+        self.next_id = 0
+    
+    @property
+    def capacity(self) -> int:
+        """Requests that can be in flight across the pool"""
+        return self.connections_wanted * self.depth
+    
+    async def _open(self) -> StreamConnection:
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        configure_socket(sock)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, (self.host, self.port))
+            reader, writer = await asyncio.open_connection(sock=sock)
+        except Exception:
+            sock.close()
+            raise
+        
+        writer.write(MAGIC)
+        await writer.drain()
+        if await reader.readexactly(len(MAGIC)) != MAGIC:
+            writer.close()
+            raise ConnectionError("LAN stream handshake failed")
+        return StreamConnection(reader, writer, self.depth)
+    
+    async def connect(self):
+        """Open the connection pool"""
+        self.connections = list(await asyncio.gather(*(self._open() for _ in range(self.connections_wanted))))
+    
+    async def close(self):
+        await asyncio.gather(*(c.close() for c in self.connections))
+        self.connections = []
+    
+    async def request(self, kind: int, file_index: int, a: int, b: int = 0) -> bytes:
+        """Send one request on the least busy open connection, reopening dropped ones"""
+        self.connections = [c for c in self.connections if not c.closed]
+        while len(self.connections) < self.connections_wanted:
+            self.connections.append(await self._open())
+        
+        connection = min(self.connections, key=lambda c: len(c.pending))
+        self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+        return await connection.request(self.next_id, kind, file_index, a, b)
+    
+    async def fetch_chunk(self, file_index: int, chunk_id: int) -> bytes:
+        return await self.request(KIND_CHUNK, file_index, chunk_id)
+    
+    async def fetch_pack(self, pack_id: int) -> bytes:
+        return await self.request(KIND_PACK, -1, pack_id)
+    
+    async def fetch_range(self, file_index: int, start: int, length: int) -> bytes:
+        return await self.request(KIND_RANGE, file_index, start, length)
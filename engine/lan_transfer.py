@@ -1,37 +1,153 @@
 """
 LAN Transfer - Direct HTTP transfer over local network
 Fastest mode: 80-120 MB/s
+Chunks and whole files are sent with kernel sendfile (no copies through Python)
+When both sides support it, chunks travel over the persistent stream transport
+(engine/lan_stream.py) instead of one HTTP request per chunk
 """
 import asyncio
-from aiohttp import web
+import bisect
+import multiprocessing
+import queue
 import socket
+from aiohttp import web
 import sys
 import os
 from pathlib import Path
+from typing import Optional, Set, Tuple
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import LAN_DISCOVERY_PORT
+from config import (
+    LAN_DISCOVERY_PORT, LAN_STREAM, LAN_STREAM_PORT, LAN_WORKERS, LAN_WORKER_STATS_INTERVAL, LAN_SEED_PORT
+)
 from engine.chunk_manager import ChunkManager
+from engine.download_journal import PACK_INDEX, SINGLE_FILE
+from engine.file_cache import FileHandleCache
+from engine.lan_discovery import LANAnnouncer, get_local_ip, get_transfer_key
+from engine.lan_stream import (
+    KIND_CHUNK, KIND_PACK, KIND_RANGE, LANStreamClient, LANStreamServer, ServerStats, Source,
+    acquire_file, make_listen_socket, send_span
+)
+from engine.manifest_codec import MANIFEST_MEDIA_TYPE, encode_compact, dumps_manifest, load_manifest
+
+class FileSpanResponse(web.StreamResponse):
+    """
+    Response that sends count bytes of a file from offset with loop.sendfile
+    The file comes from the server's handle cache, so concurrent requests share it
+    """
+    
+    def __init__(self, files: FileHandleCache, file_path: str, offset: int, count: int,
+                 headers: Optional[dict] = None):
+        super().__init__(headers=headers)
+        self.files = files
+        self.file_path = file_path
+        self.offset = offset
+        self.count = count
+        self.content_type = 'application/octet-stream'
+    
+    async def prepare(self, request):
+        cached = await acquire_file(self.files, self.file_path)
+        try:
+            # Never promise more than the file holds (last chunk of a fixed-size manifest)
+            count = max(0, min(self.count, cached.size - self.offset))
+            self.content_length = count
+            
+            writer = await super().prepare(request)
+            if count == 0:
+                await super().write_eof()
+                return writer
+            
+            transport = request.transport
+            if transport is None:
+                raise ConnectionResetError("Connection lost")
+            await send_span(transport, cached, self.offset, count, writer.write)
+            await super().write_eof()
+            return writer
+        finally:
+            self.files.release(cached)
 
 class LANTransferServer:
-    """HTTP server for LAN direct transfer"""
+    """
+    HTTP server for LAN direct transfer
+    have, when set, limits serving to those (file_index, chunk_id) pairs (download
+    journal numbering); a sender serves everything, a seeder only what it has verified
+    """
     
-    def __init__(self, manifest: dict, port: int = LAN_DISCOVERY_PORT):
+    def __init__(self, manifest: dict, port: int = LAN_DISCOVERY_PORT,
+                 stream_port: Optional[int] = LAN_STREAM_PORT if LAN_STREAM else None,
+                 workers: int = LAN_WORKERS):
         self.manifest = manifest
         self.port = port
+        self.stream_port = stream_port
+        self.stream_server: Optional[LANStreamServer] = None
+        self.stream_ready = False
+        self.announcer: Optional[LANAnnouncer] = None
         self.chunk_manager = ChunkManager(mode='lan')
+        # Open files shared by every chunk request (one handle per file, LRU-capped)
+        self.files = FileHandleCache()
+        self.stats = ServerStats()
         self.app = web.Application()
+        self.app.on_response_prepare.append(self.count_response)
         self.setup_routes()
+        self.runner: Optional[web.AppRunner] = None
+        
+        # Multi-process serving (workers > 1): this process only supervises and sums stats
+        self.workers = max(1, workers)
+        self.processes = []
+        self.stats_queue = None
+        self.worker_stats = {}
+        self._stats_task: Optional[asyncio.Task] = None
+        
+        self.have: Optional[Set[Tuple[int, int]]] = None
+        self._chunk_starts = {}
     
     def setup_routes(self):
         """Setup HTTP routes"""
         self.app.router.add_get('/manifest', self.handle_manifest)
         self.app.router.add_get('/chunk/{chunk_id}', self.handle_chunk)
         self.app.router.add_get('/file/{file_index}/chunk/{chunk_id}', self.handle_file_chunk)
+        self.app.router.add_get('/file', self.handle_file)
+        self.app.router.add_get('/file/{file_index}', self.handle_file)
+        self.app.router.add_get('/pack/{pack_id}', self.handle_pack)
+        self.app.router.add_get('/have', self.handle_have)
+    
+    async def count_response(self, request, response):
+        """Count every HTTP response and its body size in the server stats"""
+        self.stats.add(response.content_length or 0)
     
     async def handle_manifest(self, request):
-        """Return transfer manifest"""
-        return web.json_response(self.manifest)
+        """Return transfer manifest (binary form if the client accepts it, else JSON)"""
+        # Advertise the stream transport; clients that don't know it ignore the header
+        headers = {'X-Stream-Port': str(self.stream_port)} if self.stream_server else {}
+        if self.have is not None:
+            headers['X-Partial'] = '1'
+        if MANIFEST_MEDIA_TYPE in request.headers.get('Accept', ''):
+            return web.Response(body=encode_compact(self.manifest), content_type=MANIFEST_MEDIA_TYPE, headers=headers)
+        return web.json_response(self.manifest, dumps=dumps_manifest, headers=headers)
+    
+    async def handle_have(self, request):
+        """Chunks a partial server can serve so far (complete once it has everything)"""
+        have = self.have
+        if have is None:
+            return web.json_response({'complete': True})
+        return web.json_response({'complete': False, 'chunks': sorted(have)})
+    
+    def is_available(self, file_index: int, start: int, end: int) -> bool:
+        """Whether every chunk overlapping bytes [start, end) of a file may be served"""
+        have = self.have
+        if have is None:
+            return True
+        
+        starts = self._chunk_starts.get(file_index)
+        if starts is None:
+            file_info = self.manifest if file_index == SINGLE_FILE else self.manifest['files'][file_index]
+            starts = [self.chunk_manager.get_chunk_span(file_info, chunk_id)[0]
+                      for chunk_id in range(file_info['totalChunks'])]
+            self._chunk_starts[file_index] = starts
+        
+        first = max(0, bisect.bisect_right(starts, start) - 1)
+        last = bisect.bisect_left(starts, max(end, start + 1))
+        return all((file_index, chunk_id) in have for chunk_id in range(first, last))
     
     async def handle_chunk(self, request):
         """Handle single file chunk download"""
@@ -40,12 +156,13 @@ class LANTransferServer:
         # For single file transfers
         if 'filePath' in self.manifest:
             file_path = self.manifest['filePath']
+            if self.have is not None and (SINGLE_FILE, chunk_id) not in self.have:
+                return web.json_response({'error': 'Chunk not available yet'}, status=404)
             
             try:
-                chunk_data = self.chunk_manager.read_chunk(file_path, chunk_id)
-                return web.Response(
-                    body=chunk_data,
-                    content_type='application/octet-stream',
+                offset, size = self.chunk_manager.get_chunk_span(self.manifest, chunk_id)
+                return FileSpanResponse(
+                    self.files, file_path, offset, size,
                     headers={
                         'Content-Disposition': f'attachment; filename="chunk_{chunk_id:06d}"'
                     }
@@ -67,12 +184,13 @@ class LANTransferServer:
             
             file_info = self.manifest['files'][file_index]
             file_path = file_info['filePath']
+            if self.have is not None and (file_index, chunk_id) not in self.have:
+                return web.json_response({'error': 'Chunk not available yet'}, status=404)
             
             try:
-                chunk_data = self.chunk_manager.read_chunk(file_path, chunk_id)
-                return web.Response(
-                    body=chunk_data,
-                    content_type='application/octet-stream',
+                offset, size = self.chunk_manager.get_chunk_span(file_info, chunk_id)
+                return FileSpanResponse(
+                    self.files, file_path, offset, size,
                     headers={
                         'Content-Disposition': f'attachment; filename="chunk_{chunk_id:06d}"'
                     }
@@ -82,51 +200,398 @@ class LANTransferServer:
         
         return web.json_response({'error': 'Invalid request'}, status=400)
     
-    def get_local_ip(self) -> str:
-        """Get local IP address"""
+    async def handle_file(self, request):
+        """
+        Whole file download (/file for a single file, /file/{index} in a folder)
+        Supports Range requests; sent with sendfile
+        """
+        if 'file_index' in request.match_info:
+            files = self.manifest.get('files', [])
+            file_index = int(request.match_info['file_index'])
+            if file_index >= len(files) or 'pack' in files[file_index]:
+                return web.json_response({'error': 'File index out of range'}, status=404)
+            file_path = files[file_index]['filePath']
+            size = files[file_index]['size']
+        elif 'filePath' in self.manifest:
+            file_index = SINGLE_FILE
+            file_path = self.manifest['filePath']
+            size = self.manifest['size']
+        else:
+            return web.json_response({'error': 'Invalid request'}, status=400)
+        
+        if self.have is not None:
+            span = request.http_range
+            start = span.start or 0
+            end = size if span.stop is None else span.stop
+            if not self.is_available(file_index, start, end):
+                return web.json_response({'error': 'Range not available yet'}, status=404)
+        
+        return web.FileResponse(file_path, headers={'Content-Type': 'application/octet-stream'})
+    
+    async def handle_pack(self, request):
+        """Handle pack chunk download (small folder files concatenated)"""
+        pack_id = int(request.match_info['pack_id'])
+        packs = self.manifest.get('packs', [])
+        
+        if pack_id >= len(packs):
+            return web.json_response({'error': 'Pack index out of range'}, status=404)
+        if self.have is not None and (PACK_INDEX, pack_id) not in self.have:
+            return web.json_response({'error': 'Pack not available yet'}, status=404)
+        
         try:
-            # Create a socket to get local IP
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            local_ip = s.getsockname()[0]
-            s.close()
-            return local_ip
-        except:
-            return "127.0.0.1"
-    
-    async def start(self):
-        """Start the LAN server"""
-        runner = web.AppRunner(self.app)
-        await runner.setup()
-        site = web.TCPSite(runner, '0.0.0.0', self.port)
+            loop = asyncio.get_running_loop()
+            pack_data = await loop.run_in_executor(None, self.read_pack, packs[pack_id])
+            return web.Response(
+                body=pack_data,
+                content_type='application/octet-stream',
+                headers={
+                    'Content-Disposition': f'attachment; filename="pack_{pack_id:06d}"'
+                }
+            )
+        except Exception as e:
+            return web.json_response({'error': str(e)}, status=500)
+    
+    def read_pack(self, pack_info: dict) -> bytes:
+        """Concatenate the files of a pack chunk through the handle cache"""
+        files = self.manifest['files']
+        return b''.join(
+            self.files.pread(files[file_index]['filePath'], 0, files[file_index]['size'])
+            for file_index in pack_info['files']
+        )
+    
+    async def resolve_stream(self, kind: int, file_index: int, a: int, b: int) -> Source:
+        """Map a stream request to a file span or pack bytes (file_index -1 = single file)"""
+        if kind == KIND_PACK:
+            packs = self.manifest.get('packs', [])
+            if a >= len(packs):
+                raise Exception('Pack index out of range')
+            if self.have is not None and (PACK_INDEX, a) not in self.have:
+                raise Exception('Pack not available yet')
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.read_pack, packs[a])
+        
+        if file_index < 0:
+            if 'filePath' not in self.manifest:
+                raise Exception('Invalid request')
+            file_index = SINGLE_FILE
+            file_info = self.manifest
+        else:
+            files = self.manifest.get('files', [])
+            if file_index >= len(files) or 'pack' in files[file_index]:
+                raise Exception('File index out of range')
+            file_info = files[file_index]
+        
+        if kind == KIND_CHUNK:
+            if self.have is not None and (file_index, a) not in self.have:
+                raise Exception('Chunk not available yet')
+            offset, size = self.chunk_manager.get_chunk_span(file_info, a)
+            return file_info['filePath'], offset, size
+        if kind == KIND_RANGE:
+            if not self.is_available(file_index, a, a + b):
+                raise Exception('Range not available yet')
+            return file_info['filePath'], a, b
+        raise Exception(f'Unknown request kind {kind}')
+    
+    def get_local_ip(self) -> str:
+        """Get local IP address (works without an internet route)"""
+        return get_local_ip()
+    
+    async def start(self, sockets: Optional[tuple] = None, reuse_port: bool = False, quiet: bool = False):
+        """
+        Start the LAN server
+        With workers > 1 the sockets are served by worker processes instead (see start_workers)
+        sockets/reuse_port are how a worker process gets its listeners
+        """
+        if self.workers > 1:
+            return await self.start_workers()
+        
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        if sockets is not None:
+            site = web.SockSite(self.runner, sockets[0])
+        else:
+            site = web.TCPSite(self.runner, '0.0.0.0', self.port, reuse_port=reuse_port)
         await site.start()
         
         local_ip = self.get_local_ip()
-        print(f"🌐 LAN Server started at http://{local_ip}:{self.port}")
+        if not quiet:
+            print(f"🌐 LAN Server started at http://{local_ip}:{self.port}")
+        
+        if self.stream_port:
+            stream_server = LANStreamServer(self.resolve_stream, self.stream_port, self.files, self.stats)
+            try:
+                stream_sock = sockets[1] if sockets is not None else None
+                if sockets is None or stream_sock is not None:
+                    await stream_server.start(sock=stream_sock, reuse_port=reuse_port)
+                    self.stream_server = stream_server
+                    self.stream_ready = True
+                    if not quiet:
+                        print(f"⚡ LAN stream transport on port {self.stream_port}")
+            except OSError as e:
+                print(f"⚠️  LAN stream transport unavailable ({e}), serving over HTTP only")
+        return local_ip
+    
+    async def start_workers(self):
+        """
+        Serve with worker processes, each running its own event loop
+        Workers bind the ports with SO_REUSEPORT where available (the kernel spreads
+        connections); elsewhere the listening sockets are created here and passed to them
+        """
+        ctx = multiprocessing.get_context('spawn')
+        self.stats_queue = ctx.Queue()
+        reuse_port = hasattr(socket, 'SO_REUSEPORT')
+        
+        sockets = None
+        if not reuse_port:
+            stream_sock = None
+            if self.stream_port:
+                try:
+                    stream_sock = make_listen_socket(self.stream_port)
+                except OSError as e:
+                    print(f"⚠️  LAN stream transport unavailable ({e}), serving over HTTP only")
+            sockets = (make_listen_socket(self.port), stream_sock)
+        
+        for worker_id in range(self.workers):
+            process = ctx.Process(
+                target=run_worker,
+                args=(worker_id, self.manifest, self.port, self.stream_port, sockets, reuse_port, self.stats_queue),
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+        
+        # Wait until every worker is listening
+        loop = asyncio.get_running_loop()
+        ready = 0
+        while ready < self.workers:
+            try:
+                message = await loop.run_in_executor(None, self.stats_queue.get, True, 30)
+            except queue.Empty:
+                await self.stop()
+                raise Exception("LAN workers failed to start")
+            if message[0] == 'failed':
+                await self.stop()
+                raise Exception(f"LAN worker {message[1]} failed to start: {message[2]}")
+            if message[0] == 'ready':
+                ready += 1
+                self.stream_ready = message[2]
+        
+        self._stats_task = asyncio.create_task(self._collect_stats())
+        
+        local_ip = self.get_local_ip()
+        print(f"🌐 LAN Server started at http://{local_ip}:{self.port} ({self.workers} worker processes)")
+        if self.stream_ready:
+            print(f"⚡ LAN stream transport on port {self.stream_port}")
         return local_ip
+    
+    async def _collect_stats(self):
+        """Keep the latest stats report of every worker"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                message = await loop.run_in_executor(None, self.stats_queue.get, True, LAN_WORKER_STATS_INTERVAL)
+            except queue.Empty:
+                continue
+            if message[0] == 'stats':
+                self.worker_stats[message[1]] = message[2]
+    
+    def get_worker_stats(self) -> dict:
+        """Stats of this server process"""
+        cache = self.files.get_stats()
+        return {
+            'requests': self.stats.requests,
+            'bytes_sent': self.stats.bytes_sent,
+            'open_files': cache['open_files'],
+            'cache_hits': cache['hits'],
+            'cache_misses': cache['misses'],
+        }
+    
+    def get_stats(self) -> dict:
+        """Serving stats, summed over worker processes when there are several"""
+        if self.workers == 1:
+            return dict(self.get_worker_stats(), workers=1)
+        
+        per_worker = [self.worker_stats.get(worker_id, {}) for worker_id in range(self.workers)]
+        summary = {key: sum(stats.get(key, 0) for stats in per_worker)
+                   for key in ('requests', 'bytes_sent', 'open_files', 'cache_hits', 'cache_misses')}
+        summary['workers'] = self.workers
+        summary['per_worker'] = per_worker
+        return summary
+    
+    async def stop(self):
+        """Stop serving (worker processes are terminated)"""
+        if self.announcer is not None:
+            self.announcer.stop()
+            self.announcer = None
+        if self._stats_task is not None:
+            self._stats_task.cancel()
+            self._stats_task = None
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join(5)
+        self.processes = []
+        if self.stream_server is not None:
+            await self.stream_server.stop()
+            self.stream_server = None
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+        self.files.close_all()
+    
+    async def announce(self, pair_code: str, transfer_id: str):
+        """Answer LAN discovery queries for this transfer so receivers find us from the pair code"""
+        stream_port = self.stream_port if self.stream_ready else None
+        announcer = LANAnnouncer(get_transfer_key(pair_code, transfer_id), self.port, stream_port)
+        try:
+            await announcer.start()
+            self.announcer = announcer
+            print(f"📣 Announcing on the LAN (UDP {announcer.discovery_port})")
+        except OSError as e:
+            print(f"⚠️  LAN discovery unavailable ({e}); receivers need this IP")
+
+def run_worker(worker_id: int, manifest: dict, port: int, stream_port: Optional[int],
+               sockets: Optional[tuple], reuse_port: bool, stats_queue):
+    """Worker process entry point: serve the transfer in this process's own event loop"""
+    async def serve():
+        server = LANTransferServer(manifest, port, stream_port, workers=1)
+        try:
+            await server.start(sockets=sockets, reuse_port=reuse_port, quiet=True)
+        except Exception as e:
+            stats_queue.put(('failed', worker_id, str(e)))
+            return
+        stats_queue.put(('ready', worker_id, server.stream_ready))
+        
+        while True:
+            await asyncio.sleep(LAN_WORKER_STATS_INTERVAL)
+            stats_queue.put(('stats', worker_id, server.get_worker_stats()))
+    
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+def make_seed_manifest(manifest: dict, output_path: str) -> dict:
+    """Copy of a download manifest pointing at the receiver's copy (what its seeder serves)"""
+    seed = dict(manifest)
+    if 'files' in manifest:
+        seed['files'] = [dict(file_info, filePath=str(Path(output_path) / file_info['relativePath']))
+                         for file_info in manifest['files']]
+    else:
+        seed['filePath'] = str(output_path)
+    return seed
+
+class LANSeeder(LANTransferServer):
+    """
+    LAN server a receiver runs for the chunks it has verified
+    Announced for the same pair code as the sender, so other receivers on the LAN
+    find it and pull from it; have grows as the download writes chunks
+    """
+    
+    def __init__(self, pair_code: str, transfer_id: str, port: int = LAN_SEED_PORT,
+                 stream_port: Optional[int] = LAN_SEED_PORT + 1 if LAN_STREAM else None):
+        # One process: the chunk list lives in this one
+        super().__init__({}, port, stream_port, workers=1)
+        self.pair_code = pair_code
+        self.transfer_id = transfer_id
+        self.have = set()
+        self.running = False
+    
+    async def seed(self, manifest: dict, output_path: str) -> bool:
+        """Start serving output_path as the download of manifest; False if seeding isn't possible"""
+        self.manifest = make_seed_manifest(manifest, output_path)
+        try:
+            local_ip = await self.start(quiet=True)
+        except OSError as e:
+            print(f"⚠️  Not seeding to other receivers: {e}")
+            await self.stop()
+            return False
+        self.running = True
+        print(f"🌱 Seeding to other receivers at http://{local_ip}:{self.port}")
+        await self.announce(self.pair_code, self.transfer_id)
+        return True
+    
+    def set_complete(self):
+        """Serve everything from now on (the download finished and was verified)"""
+        self.have = None
 
 class LANTransferClient:
     """Client for downloading via LAN"""
     
     def __init__(self, server_ip: str, port: int = LAN_DISCOVERY_PORT):
+        self.server_ip = server_ip
         self.server_url = f"http://{server_ip}:{port}"
         self.chunk_manager = ChunkManager(mode='lan')
+        
+        # Stream transport, used once the server advertises it in the manifest response
+        self.stream_port: Optional[int] = None
+        self.stream: Optional[LANStreamClient] = None
+        self._stream_lock = asyncio.Lock()
+        # Server is a seeder that only has some chunks (see get_have)
+        self.partial = False
     
     async def get_manifest(self) -> dict:
         """Get manifest from server"""
         import aiohttp
         
         async with aiohttp.ClientSession() as session:
-            async with session.get(f"{self.server_url}/manifest") as resp:
+            async with session.get(
+                f"{self.server_url}/manifest",
+                headers={'Accept': f"{MANIFEST_MEDIA_TYPE}, application/json"}
+            ) as resp:
                 if resp.status == 200:
-                    return await resp.json()
+                    stream_port = resp.headers.get('X-Stream-Port')
+                    if LAN_STREAM and stream_port and stream_port.isdigit():
+                        self.stream_port = int(stream_port)
+                    self.partial = resp.headers.get('X-Partial') == '1'
+                    return load_manifest(await resp.read())
                 else:
                     raise Exception(f"Failed to get manifest: {resp.status}")
     
+    async def get_have(self) -> Optional[Set[Tuple[int, int]]]:
+        """(file_index, chunk_id) pairs a partial server has so far; None once it has everything"""
+        import aiohttp
+        
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{self.server_url}/have") as resp:
+                if resp.status != 200:
+                    raise Exception(f"Failed to get chunk list: {resp.status}")
+                have = await resp.json()
+        if have.get('complete'):
+            self.partial = False
+            return None
+        return {tuple(entry) for entry in have['chunks']}
+    
+    async def get_stream(self) -> Optional[LANStreamClient]:
+        """Stream transport to the server, or None to use HTTP (not advertised or can't connect)"""
+        if self.stream_port is None:
+            return None
+        async with self._stream_lock:
+            if self.stream is None and self.stream_port is not None:
+                stream = LANStreamClient(self.server_ip, self.stream_port)
+                try:
+                    await stream.connect()
+                    self.stream = stream
+                except (OSError, asyncio.IncompleteReadError) as e:
+                    print(f"⚠️  LAN stream transport unavailable ({e}), using HTTP")
+                    await stream.close()
+                    self.stream_port = None
+            return self.stream
+    
+    async def close(self):
+        """Close the stream transport connections"""
+        if self.stream is not None:
+            await self.stream.close()
+            self.stream = None
+    
     async def download_chunk(self, chunk_id: int) -> bytes:
         """Download a single chunk"""
         import aiohttp
         
+        stream = await self.get_stream()
+        if stream is not None:
+            return await stream.fetch_chunk(-1, chunk_id)
+        
         async with aiohttp.ClientSession() as session:
             async with session.get(f"{self.server_url}/chunk/{chunk_id}") as resp:
                 if resp.status == 200:
@@ -138,12 +603,49 @@ class LANTransferClient:
         """Download a chunk from a specific file in folder transfer"""
         import aiohttp
         
+        stream = await self.get_stream()
+        if stream is not None:
+            return await stream.fetch_chunk(file_index, chunk_id)
+        
         async with aiohttp.ClientSession() as session:
             async with session.get(f"{self.server_url}/file/{file_index}/chunk/{chunk_id}") as resp:
                 if resp.status == 200:
                     return await resp.read()
                 else:
                     raise Exception(f"Failed to download chunk {chunk_id} from file {file_index}: {resp.status}")
+    
+    async def download_range(self, start: int, end: int, file_index: Optional[int] = None) -> bytes:
+        """Download bytes [start, end) of the file (or of a folder file) with a Range request"""
+        import aiohttp
+        
+        stream = await self.get_stream()
+        if stream is not None:
+            return await stream.fetch_range(-1 if file_index is None else file_index, start, end - start)
+        
+        url = f"{self.server_url}/file" if file_index is None else f"{self.server_url}/file/{file_index}"
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url, headers={'Range': f"bytes={start}-{end - 1}"}) as resp:
+                if resp.status in (200, 206):
+                    data = await resp.read()
+                    # A server ignoring Range returns the whole file
+                    return data if resp.status == 206 else data[start:end]
+                else:
+                    raise Exception(f"Failed to download range {start}-{end}: {resp.status}")
+    
+    async def download_pack(self, pack_id: int) -> bytes:
+        """Download a pack chunk of small folder files"""
+        import aiohttp
+        
+        stream = await self.get_stream()
+        if stream is not None:
+            return await stream.fetch_pack(pack_id)
+        
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{self.server_url}/pack/{pack_id}") as resp:
+                if resp.status == 200:
+                    return await resp.read()
+                else:
+                    raise Exception(f"Failed to download pack {pack_id}: {resp.status}")
 
 if __name__ == "__main__":
     # Test LAN server
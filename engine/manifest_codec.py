@@ -0,0 +1,325 @@
+"""
+Manifest Codec - Compact binary manifests for huge transfers
+A chunk list is stored as a ChunkTable: raw 32-byte SHA256 digests in one
+bytearray, chunk ids implicit, sizes implicit for fixed-size chunks and an
+offset table for content-defined ones. Compressed chunks keep their stored
+size and hash in a sparse side table.
+
+ChunkTable behaves like the old list of {id, hash, size} dicts (entries are
+built on access), so manifests work the same whichever form they arrive in.
+JSON stays available as a compatibility view (json_default / to_list).
+
+Binary layout (little-endian): MAGIC, version, header length, JSON header (the
+manifest with every ChunkTable replaced by a small descriptor), then each
+table's digests, uint64 offsets and compressed entries in header order.
+"""
+import json
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MAGIC = b'SAMF'
+VERSION = 1
+MANIFEST_MEDIA_TYPE = 'application/x-sendanywhere-manifest'
+HASH_SIZE = 32
+
+PREFIX = struct.Struct('<4sBI')      # magic, version, header length
+COMPRESSED_ENTRY = struct.Struct('<II')  # chunk id, stored size (digest follows)
+
+class ChunkTable:
+    """Array-backed chunk list of one file"""
+
+    def __init__(self, chunk_size: int, compression: Optional[str] = None):
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.size = 0
+        self.hashes = bytearray()
+        # Start offset of every chunk; None while all chunks but the last are chunk_size
+        self.offsets: Optional[array] = None
+        # {chunk_id: (stored size, stored digest)} for compressed chunks
+        self.compressed: Dict[int, Tuple[int, bytes]] = {}
+
+    def __len__(self) -> int:
+        return len(self.hashes) // HASH_SIZE
+
+    def __iter__(self) -> Iterator[Dict]:
+        for chunk_id in range(len(self)):
+            yield self[chunk_id]
+
+    def __getitem__(self, chunk_id):
+        """Manifest entry {id, hash, size} (+ offset, compression fields) built on access"""
+        if isinstance(chunk_id, slice):
+            return [self[i] for i in range(*chunk_id.indices(len(self)))]
+        if chunk_id < 0:
+            chunk_id += len(self)
+        if not 0 <= chunk_id < len(self):
+            raise IndexError("chunk id out of range")
+
+        offset, size = self.span(chunk_id)
+        chunk_info = {'id': chunk_id, 'hash': self.hash(chunk_id), 'size': size}
+        if self.offsets is not None:
+            chunk_info['offset'] = offset
+
+        compressed = self.compressed.get(chunk_id)
+        if compressed is not None:
+            chunk_info['compression'] = self.compression
+            chunk_info['compressedSize'] = compressed[0]
+            chunk_info['compressedHash'] = compressed[1].hex()
+        return chunk_info
+
+    def hash(self, chunk_id: int) -> str:
+        """Hex SHA256 of a chunk's data"""
+        return bytes(self.hashes[chunk_id * HASH_SIZE:(chunk_id + 1) * HASH_SIZE]).hex()
+
+    def stored_hash(self, chunk_id: int) -> str:
+        """Hash of a chunk as stored on the relay (compressed form if compressed)"""
+        compressed = self.compressed.get(chunk_id)
+        return compressed[1].hex() if compressed is not None else self.hash(chunk_id)
+
+    def compression_of(self, chunk_id: int) -> Optional[str]:
+        """Compression of a chunk (None = stored raw)"""
+        return self.compression if chunk_id in self.compressed else None
+
+    def span(self, chunk_id: int) -> Tuple[int, int]:
+        """(offset, size) of a chunk in the file"""
+        if self.offsets is not None:
+            offset = self.offsets[chunk_id]
+            end = self.offsets[chunk_id + 1] if chunk_id + 1 < len(self.offsets) else self.size
+            return offset, end - offset
+        offset = chunk_id * self.chunk_size
+        return offset, min(self.chunk_size, self.size - offset)
+
+    def append(self, chunk_info: Dict):
+        """Add the next chunk from a {id, hash, size, ...} entry"""
+        chunk_id = len(self)
+        if chunk_info.get('id', chunk_id) != chunk_id:
+            raise ValueError(f"Chunk ids must be sequential: expected {chunk_id}, got {chunk_info['id']}")
+
+        offset = chunk_info.get('offset', self.size)
+        if offset != self.size:
+            raise ValueError(f"Chunk {chunk_id} offset {offset} doesn't follow the previous chunk")
+
+        # Fall back to an offset table once sizes stop being implicit
+        if self.offsets is None and ('offset' in chunk_info or self.size != chunk_id * self.chunk_size):
+            self.offsets = array('Q', (i * self.chunk_size for i in range(chunk_id)))
+        if self.offsets is not None:
+            self.offsets.append(offset)
+
+        self.hashes += bytes.fromhex(chunk_info['hash'])
+        self.size += chunk_info['size']
+
+        if 'compressedHash' in chunk_info:
+            if self.compression and chunk_info['compression'] != self.compression:
+                raise ValueError("Mixed chunk compression in one file")
+            self.compression = chunk_info['compression']
+            self.compressed[chunk_id] = (chunk_info['compressedSize'], bytes.fromhex(chunk_info['compressedHash']))
+
+    @classmethod
+    def from_list(cls, chunks: List[Dict], chunk_size: int) -> Optional["ChunkTable"]:
+        """Build a table from JSON chunk entries (None if they can't be represented)"""
+        table = cls(chunk_size)
+        try:
+            for chunk_info in chunks:
+                table.append(chunk_info)
+        except (KeyError, TypeError, ValueError):
+            return None
+        return table
+
+    def to_list(self) -> List[Dict]:
+        """JSON compatibility view"""
+        return list(self)
+
+    def describe(self) -> Dict:
+        """Header descriptor written in place of the table"""
+        return {
+            'count': len(self),
+            'chunkSize': self.chunk_size,
+            'size': self.size,
+            'offsets': self.offsets is not None,
+            'compression': self.compression,
+            'compressed': len(self.compressed)
+        }
+
+    def encode(self) -> bytes:
+        """Binary body: digests, offsets, compressed entries"""
+        parts = [bytes(self.hashes)]
+        if self.offsets is not None:
+            offsets = array('Q', self.offsets)
+            if sys.byteorder == 'big':
+                offsets.byteswap()
+            parts.append(offsets.tobytes())
+        for chunk_id in sorted(self.compressed):
+            size, digest = self.compressed[chunk_id]
+            parts.append(COMPRESSED_ENTRY.pack(chunk_id, size) + digest)
+        return b''.join(parts)
+
+    @classmethod
+    def decode(cls, descriptor: Dict, data: memoryview, pos: int) -> Tuple["ChunkTable", int]:
+        """Read a table described by descriptor from data[pos:]; returns (table, new pos)"""
+        table = cls(descriptor['chunkSize'], descriptor.get('compression'))
+        table.size = descriptor['size']
+        count = descriptor['count']
+
+        end = pos + count * HASH_SIZE
+        table.hashes = bytearray(data[pos:end])
+        pos = end
+
+        if descriptor.get('offsets'):
+            end = pos + count * 8
+            table.offsets = array('Q')
+            table.offsets.frombytes(data[pos:end])
+            if sys.byteorder == 'big':
+                table.offsets.byteswap()
+            pos = end
+
+        entry_size = COMPRESSED_ENTRY.size + HASH_SIZE
+        for _ in range(descriptor.get('compressed', 0)):
+            chunk_id, size = COMPRESSED_ENTRY.unpack_from(data, pos)
+            table.compressed[chunk_id] = (size, bytes(data[pos + COMPRESSED_ENTRY.size:pos + entry_size]))
+            pos += entry_size
+
+        if pos > len(data):
+            raise ValueError("Truncated manifest")
+        return table, pos
+
+class StoredHashes:
+    """
+    Stored hash of every relay chunk of a manifest, in relay chunk id order
+    Folder chunks are numbered file after file, then pack chunks; hashes are
+    looked up on access instead of being flattened into a list
+    """
+
+    def __init__(self, manifest: Dict):
+        if 'files' in manifest:
+            self.tables = [f['chunks'] for f in manifest['files'] if f.get('totalChunks', 0)]
+            self.packs = manifest.get('packs', [])
+        else:
+            self.tables = [manifest['chunks']] if manifest.get('chunks') else []
+            self.packs = []
+
+        self.starts = []
+        total = 0
+        for table in self.tables:
+            self.starts.append(total)
+            total += len(table)
+        self.file_chunks = total
+
+    def __len__(self) -> int:
+        return self.file_chunks + len(self.packs)
+
+    def __iter__(self) -> Iterator[Optional[str]]:
+        for chunk_id in range(len(self)):
+            yield self[chunk_id]
+
+    def __getitem__(self, chunk_id: int) -> Optional[str]:
+        if not 0 <= chunk_id < len(self):
+            raise IndexError("chunk id out of range")
+        if chunk_id >= self.file_chunks:
+            pack_info = self.packs[chunk_id - self.file_chunks]
+            return pack_info.get('compressedHash', pack_info.get('hash'))
+
+        index = bisect_right(self.starts, chunk_id) - 1
+        table = self.tables[index]
+        local_id = chunk_id - self.starts[index]
+        if isinstance(table, ChunkTable):
+            return table.stored_hash(local_id)
+        chunk_info = table[local_id]
+        return chunk_info.get('compressedHash', chunk_info.get('hash'))
+
+def _file_entries(manifest: Dict) -> List[Dict]:
+    """Entries that may carry a chunk list (the manifest itself or its files)"""
+    return manifest['files'] if 'files' in manifest else [manifest]
+
+def compact_manifest(manifest: Dict) -> Dict:
+    """Replace JSON chunk lists with ChunkTables in place (lists that don't fit are kept)"""
+    default_size = manifest.get('chunkSize', 0)
+    for entry in _file_entries(manifest):
+        chunks = entry.get('chunks')
+        if isinstance(chunks, list):
+            table = ChunkTable.from_list(chunks, entry.get('chunkSize', default_size))
+            if table is not None:
+                entry['chunks'] = table
+    return manifest
+
+def encode_compact(manifest: Dict) -> bytes:
+    """Serialize a manifest in the binary form"""
+    default_size = manifest.get('chunkSize', 0)
+    tables = []
+
+    def header_entry(entry: Dict) -> Dict:
+        chunks = entry.get('chunks')
+        if isinstance(chunks, list):
+            chunks = ChunkTable.from_list(chunks, entry.get('chunkSize', default_size)) or chunks
+        if not isinstance(chunks, ChunkTable):
+            return entry
+        tables.append(chunks)
+        return {**entry, 'chunks': {'table': chunks.describe()}}
+
+    if 'files' in manifest:
+        header = {**manifest, 'files': [header_entry(f) for f in manifest['files']]}
+    else:
+        header = header_entry(manifest)
+
+    header_body = json.dumps(header, separators=(',', ':')).encode()
+    return b''.join([PREFIX.pack(MAGIC, VERSION, len(header_body)), header_body] + [t.encode() for t in tables])
+
+def is_compact(data: bytes) -> bool:
+    """Check for the binary manifest magic"""
+    return data[:len(MAGIC)] == MAGIC
+
+def _read_prefix(data: bytes) -> int:
+    """Validate the prefix and return the header length"""
+    if len(data) < PREFIX.size:
+        raise ValueError("Truncated manifest")
+    magic, version, header_size = PREFIX.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a binary manifest")
+    if version != VERSION:
+        raise ValueError(f"Unsupported manifest version {version}")
+    return header_size
+
+def decode_compact(data: bytes) -> Dict:
+    """Parse a binary manifest (chunk lists come back as ChunkTables)"""
+    header_size = _read_prefix(data)
+    view = memoryview(data)
+    pos = PREFIX.size + header_size
+    manifest = json.loads(bytes(view[PREFIX.size:pos]))
+
+    try:
+        for entry in _file_entries(manifest):
+            chunks = entry.get('chunks')
+            if isinstance(chunks, dict) and 'table' in chunks:
+                entry['chunks'], pos = ChunkTable.decode(chunks['table'], view, pos)
+    except (struct.error, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid manifest: {e}")
+    return manifest
+
+def read_header(path: str) -> Dict:
+    """Read only the JSON header of a binary manifest file (chunk tables are left as descriptors)"""
+    with open(path, 'rb') as f:
+        header_size = _read_prefix(f.read(PREFIX.size))
+        return json.loads(f.read(header_size))
+
+def load_manifest(data: bytes) -> Dict:
+    """Parse a manifest body in either form"""
+    if is_compact(data):
+        return decode_compact(data)
+    return json.loads(data)
+
+def json_default(obj):
+    """json.dumps default= hook: ChunkTables are written as plain chunk lists"""
+    if isinstance(obj, ChunkTable):
+        return obj.to_list()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dumps_manifest(manifest: Dict, **kwargs) -> str:
+    """JSON compatibility view of a manifest"""
+    return json.dumps(manifest, default=json_default, **kwargs)
+
+def manifest_summary(manifest: Dict) -> Dict:
+    """Manifest without per-chunk entries (for pair codes; receivers fetch the full one)"""
+    if 'files' in manifest:
+        return {**manifest, 'files': [{k: v for k, v in f.items() if k != 'chunks'} for f in manifest['files']]}
+    return {k: v for k, v in manifest.items() if k != 'chunks'}
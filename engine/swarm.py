@@ -0,0 +1,318 @@
+"""
+Swarm - Multi-source chunk scheduler
+Pulls the chunks of one transfer from every available source at once (relay, the
+sender's LAN server, other receivers). Sources take work in proportion to their
+observed throughput; once the queue runs dry, idle fast sources duplicate chunks
+still held by slow ones and the first verified copy wins.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import MAX_RETRY_ATTEMPTS, SWARM_STEAL_FACTOR, SWARM_RATE_SMOOTHING, LAN_SEED_REFRESH
+from engine.download_journal import PACK_INDEX
+from engine.tail_latency import backoff_delay
+
+class ChunkJob:
+    """
+    One unit of work: consecutive chunks of a file, or a pack chunk
+    file_index is the manifest file index (-1 for a single file); pack_info is set for packs
+    """
+    
+    def __init__(self, file_index: int, chunk_ids: List[int], offset: int, size: int,
+                 pack_info: Optional[dict] = None):
+        self.file_index = file_index
+        self.chunk_ids = chunk_ids
+        self.offset = offset
+        self.size = size
+        self.pack_info = pack_info
+        self.attempts: Dict['SwarmSource', tuple] = {}   # source -> (start time, task)
+        self.failures = 0
+        self.done = False
+
+class SourceBusyError(Exception):
+    """Source asked us to back off for retry_after seconds (not counted as a failure)"""
+    
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class SwarmSource:
+    """A place chunks can be fetched from; subclasses implement can_fetch and fetch"""
+    
+    def __init__(self, name: str, slots: int):
+        self.name = name
+        self.slots = slots
+        self.rate: Optional[float] = None     # bytes/s of one request (smoothed)
+        self.bytes = 0
+        self.chunks = 0
+        self.failures = 0
+        self.disabled = False
+        self.active = set()                   # jobs being fetched from this source
+        self.partial = False                  # may get more chunks later (a seeder still downloading)
+    
+    def can_fetch(self, job: ChunkJob) -> bool:
+        return True
+    
+    async def fetch(self, job: ChunkJob) -> bytes:
+        raise NotImplementedError
+    
+    async def close(self):
+        pass
+    
+    async def refresh(self):
+        """Called when there's nothing this source can fetch (a partial source re-reads what it has)"""
+        pass
+    
+    def record(self, size: int, elapsed: float):
+        """Update throughput after a successful fetch"""
+        sample = size / max(elapsed, 1e-6)
+        self.rate = sample if self.rate is None else (
+            SWARM_RATE_SMOOTHING * sample + (1 - SWARM_RATE_SMOOTHING) * self.rate
+        )
+        self.bytes += size
+        self.chunks += 1
+        self.failures = 0
+    
+    def expected_time(self, size: int) -> float:
+        """Seconds this source should need for size bytes (unknown sources look fast so they get tried)"""
+        if not self.rate:
+            return 0.0
+        return size / self.rate
+
+class LANSource(SwarmSource):
+    """
+    A LAN server (the sender or a seeding receiver)
+    Files are matched to the download manifest by relative path and hash, so the
+    server's chunk layout doesn't matter: file chunks are fetched as byte ranges.
+    A partial seeder serves the same manifest as ours, so its chunk list (have)
+    uses our chunk ids
+    """
+    
+    def __init__(self, client, lan_manifest: dict, manifest: dict, slots: int):
+        super().__init__(f"lan {client.server_ip}", slots)
+        self.client = client
+        self.partial = client.partial
+        self.have = set()
+        self.checked = 0.0
+        
+        # download manifest file index -> server file index (None = server's single file)
+        self.file_map: Dict[int, Optional[int]] = {}
+        if 'files' in manifest and 'files' in lan_manifest:
+            lan_files = {f['relativePath']: (i, f) for i, f in enumerate(lan_manifest['files']) if 'pack' not in f}
+            for file_index, file_info in enumerate(manifest['files']):
+                match = lan_files.get(file_info['relativePath'])
+                if match and match[1]['hash'] == file_info['hash']:
+                    self.file_map[file_index] = match[0]
+        elif 'files' not in manifest and 'files' not in lan_manifest and lan_manifest['hash'] == manifest['hash']:
+            self.file_map[-1] = None
+        
+        # Packs are only usable when the server packed the same files the same way
+        self.pack_map = {pack['hash']: pack['id'] for pack in lan_manifest.get('packs', [])}
+    
+    @property
+    def usable(self) -> bool:
+        return bool(self.file_map or self.pack_map)
+    
+    def can_fetch(self, job: ChunkJob) -> bool:
+        if job.pack_info is not None:
+            if self.partial and (PACK_INDEX, job.pack_info['id']) not in self.have:
+                return False
+            return job.pack_info['hash'] in self.pack_map
+        if self.partial and any((job.file_index, chunk_id) not in self.have for chunk_id in job.chunk_ids):
+            return False
+        return job.file_index in self.file_map
+    
+    async def refresh(self):
+        """Re-read a partial seeder's chunk list (at most every LAN_SEED_REFRESH seconds)"""
+        if not self.partial or time.monotonic() - self.checked < LAN_SEED_REFRESH:
+            return
+        self.checked = time.monotonic()
+        try:
+            have = await self.client.get_have()
+        except Exception as e:
+            self.failures += 1
+            if self.failures >= MAX_RETRY_ATTEMPTS:
+                self.disabled = True
+                print(f"⚠️  Dropping source {self.name}: {e}")
+            return
+        if have is None:
+            self.partial = False
+        else:
+            self.have = have
+    
+    async def fetch(self, job: ChunkJob) -> bytes:
+        if job.pack_info is not None:
+            return await self.client.download_pack(self.pack_map[job.pack_info['hash']])
+        return await self.client.download_range(job.offset, job.offset + job.size, self.file_map[job.file_index])
+    
+    async def close(self):
+        await self.client.close()
+
+class SwarmScheduler:
+    """
+    Runs jobs over several sources
+    Each source gets `slots` workers pulling from a shared queue. Near the end a slow
+    source stops taking new work it couldn't finish before the others drain the
+    queue, and idle sources duplicate stragglers held by slower ones.
+    """
+    
+    def __init__(self, jobs: List[ChunkJob], sources: List[SwarmSource],
+                 verify: Callable[[ChunkJob, bytes], Awaitable[bool]],
+                 on_done: Callable[[ChunkJob, bytes], Awaitable[None]]):
+        self.queue: Deque[ChunkJob] = deque(jobs)
+        self.queued_bytes = sum(job.size for job in jobs)
+        self.sources = sources
+        self.verify = verify
+        self.on_done = on_done
+        self.remaining = len(jobs)
+        self.error: Optional[BaseException] = None
+        self.steals = 0
+        self._changed = asyncio.Event()
+    
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+    
+    async def _wait(self, timeout: float = 0.25):
+        """Wait for a job to finish or fail (or a while, so straggler estimates are refreshed)"""
+        event = self._changed
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    
+    def _in_flight(self):
+        for source in self.sources:
+            yield from source.active
+    
+    def _pick(self, source: SwarmSource) -> Optional[ChunkJob]:
+        """Next job for a free worker of source: queued work first, then a straggler to duplicate"""
+        for job in self.queue:
+            if not source.can_fetch(job):
+                continue
+            # Near the end, leave work to much faster sources when they'd drain the queue before this one finished it
+            faster = [s for s in self.sources if s is not source and not s.disabled and s.can_fetch(job)
+                      and s.rate and s.expected_time(job.size) * SWARM_STEAL_FACTOR < source.expected_time(job.size)]
+            if faster and self.queued_bytes / sum(s.rate * s.slots for s in faster) < source.expected_time(job.size):
+                break
+            self.queue.remove(job)
+            self.queued_bytes -= job.size
+            return job
+        
+        # Nothing queued for this source: duplicate the in-flight job furthest from finishing
+        now = time.monotonic()
+        best = None
+        best_left = 0.0
+        for job in self._in_flight():
+            if job.done or source in job.attempts or len(job.attempts) > 1 or not source.can_fetch(job):
+                continue
+            left = min(start + holder.expected_time(job.size) - now for holder, (start, _) in job.attempts.items())
+            if left > source.expected_time(job.size) * SWARM_STEAL_FACTOR and left > best_left:
+                best, best_left = job, left
+        if best is not None:
+            self.steals += 1
+        return best
+    
+    def _stuck(self) -> bool:
+        """True when nothing is in flight and no live source can fetch what's queued (or get it later)"""
+        if any(True for _ in self._in_flight()):
+            return False
+        live = [s for s in self.sources if not s.disabled]
+        if any(s.partial for s in live):
+            return False
+        return not any(s.can_fetch(job) for job in self.queue for s in live)
+    
+    async def _attempt(self, source: SwarmSource, job: ChunkJob):
+        start = time.monotonic()
+        task = asyncio.ensure_future(source.fetch(job))
+        job.attempts[source] = (start, task)
+        source.active.add(job)
+        error = None
+        try:
+            data = await task
+            if not await self.verify(job, data):
+                raise Exception(f"Hash mismatch from {source.name}")
+        except asyncio.CancelledError:
+            if job.done and task.cancelled():
+                return          # another source delivered it first
+            raise
+        except Exception as e:
+            error = e
+        finally:
+            job.attempts.pop(source, None)
+            source.active.discard(job)
+        
+        if error is not None:
+            if isinstance(error, SourceBusyError):
+                delay = error.retry_after
+            else:
+                source.failures += 1
+                job.failures += 1
+                delay = backoff_delay(source.failures)
+                if source.failures >= MAX_RETRY_ATTEMPTS and not source.disabled:
+                    source.disabled = True
+                    print(f"⚠️  Dropping source {source.name}: {error}")
+                if job.failures >= MAX_RETRY_ATTEMPTS * len(self.sources):
+                    self.error = error
+            if not job.done and not job.attempts:
+                self.queue.appendleft(job)
+                self.queued_bytes += job.size
+            self._notify()
+            await asyncio.sleep(delay)
+            return
+        
+        source.record(job.size, time.monotonic() - start)
+        if job.done:
+            return
+        job.done = True
+        for _, other in job.attempts.values():
+            other.cancel()
+        try:
+            await self.on_done(job, data)
+        except Exception as e:
+            self.error = e
+        self.remaining -= 1
+        self._notify()
+    
+    async def _worker(self, source: SwarmSource):
+        while self.remaining and self.error is None and not source.disabled:
+            job = self._pick(source)
+            if job is None:
+                await source.refresh()
+                if self._stuck():
+                    self.error = Exception("No source has the remaining chunks")
+                    self._notify()
+                    return
+                await self._wait()
+                continue
+            await self._attempt(source, job)
+    
+    async def run(self):
+        """Fetch every job; raises if a job can't be fetched from any source"""
+        workers = [asyncio.ensure_future(self._worker(source))
+                   for source in self.sources for _ in range(source.slots)]
+        try:
+            while self.remaining and self.error is None and not all(w.done() for w in workers):
+                await self._wait()
+            if self.error is not None:
+                raise self.error
+            if self.remaining:
+                raise Exception(f"{self.remaining} chunks could not be downloaded")
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+    
+    def summary(self) -> List[str]:
+        """One line per source: share of bytes and speed"""
+        total = sum(s.bytes for s in self.sources) or 1
+        return [
+            f"{s.name}: {s.chunks} chunks, {100 * s.bytes // total}%"
+            + (f", {s.rate / 1e6:.1f} MB/s per request" if s.rate else "")
+            for s in self.sources
+        ]
@@ -0,0 +1,152 @@
+"""
+Tail Latency - Timeouts, hedged requests and retry backoff for relay chunk requests
+Each transfer tracks its recent chunk latencies: every request gets a timeout from
+a high percentile of them, and once most of the transfer is done a request still
+running past the hedge percentile gets a duplicate (first success wins). Retries
+back off with full jitter and draw on a per-transfer budget, so a struggling relay
+isn't hit by a retry storm.
+"""
+import asyncio
+import random
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (
+    MAX_RETRY_ATTEMPTS, RETRY_DELAY, RETRY_MAX_DELAY, RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN,
+    LATENCY_WINDOW, LATENCY_MIN_SAMPLES, CHUNK_TIMEOUT, CHUNK_TIMEOUT_PERCENTILE, CHUNK_TIMEOUT_MULTIPLIER,
+    CHUNK_TIMEOUT_MIN, HEDGE_AFTER, HEDGE_PERCENTILE
+)
+
+T = TypeVar('T')
+
+def backoff_delay(attempt: int, base: float = RETRY_DELAY, cap: float = RETRY_MAX_DELAY) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2^(attempt - 1)))"""
+    return random.uniform(0, min(cap, base * 2 ** max(0, attempt - 1)))
+
+class RetryBudget:
+    """Retries allowed as a fraction of the requests made (plus a floor)"""
+    
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, floor: int = RETRY_BUDGET_MIN):
+        self.ratio = ratio
+        self.floor = floor
+        self.requests = 0
+        self.retries = 0
+    
+    def record_request(self):
+        self.requests += 1
+    
+    def try_retry(self) -> bool:
+        """Take one retry from the budget; False once it's used up"""
+        if self.retries >= self.floor + self.ratio * self.requests:
+            return False
+        self.retries += 1
+        return True
+
+class LatencyTracker:
+    """Sliding window of request latencies"""
+    
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+    
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+    
+    def percentile(self, p: float) -> Optional[float]:
+        """p-th percentile of the window, None until there are LATENCY_MIN_SAMPLES"""
+        if len(self.samples) < LATENCY_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+class TailLatency:
+    """Timeouts, hedging and the retry budget for the chunk requests of one transfer"""
+    
+    def __init__(self, total: int):
+        self.total = total
+        self.completed = 0
+        self.latency = LatencyTracker()
+        self.budget = RetryBudget()
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+    
+    def timeout(self) -> float:
+        """Per-request timeout (CHUNK_TIMEOUT until enough latencies are known)"""
+        slow = self.latency.percentile(CHUNK_TIMEOUT_PERCENTILE)
+        if slow is None:
+            return CHUNK_TIMEOUT
+        return min(CHUNK_TIMEOUT, max(CHUNK_TIMEOUT_MIN, slow * CHUNK_TIMEOUT_MULTIPLIER))
+    
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds after which a request gets a duplicate; None before HEDGE_AFTER of the transfer is done"""
+        if self.completed < self.total * HEDGE_AFTER:
+            return None
+        return self.latency.percentile(HEDGE_PERCENTILE)
+    
+    async def request(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        """
+        One request: attempt() is started, duplicated if it straggles past the hedge
+        delay, and abandoned at the timeout; the first copy to succeed wins
+        """
+        self.budget.record_request()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout()
+        started = {}
+        
+        def launch() -> asyncio.Future:
+            task = asyncio.ensure_future(attempt())
+            started[task] = loop.time()
+            return task
+        
+        primary = launch()
+        pending = {primary}
+        hedge_at = self.hedge_delay()
+        error: Optional[BaseException] = None
+        try:
+            if hedge_at is not None and loop.time() + hedge_at < deadline:
+                await asyncio.wait(pending, timeout=hedge_at)
+                if not primary.done():
+                    self.hedges += 1
+                    pending.add(launch())
+            
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - loop.time()),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.timeouts += 1
+                    raise asyncio.TimeoutError(f"Request timed out after {self.timeout():.1f}s")
+                for task in done:
+                    if task.exception() is None:
+                        self.latency.add(loop.time() - started[task])
+                        self.completed += 1
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    # A failed copy only counts if no other is still running
+                    error = task.exception()
+            raise error
+        finally:
+            for task in started:
+                task.cancel()
+            await asyncio.gather(*started, return_exceptions=True)
+    
+    async def call(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        """request() with up to MAX_RETRY_ATTEMPTS tries, jittered backoff and the retry budget"""
+        tries = 0
+        while True:
+            try:
+                return await self.request(attempt)
+            except Exception:
+                tries += 1
+                if tries >= MAX_RETRY_ATTEMPTS or not self.budget.try_retry():
+                    raise
+                await asyncio.sleep(backoff_delay(tries))
+    
+    def summary(self) -> str:
+        """How often hedging fired and won, plus timeouts and retries"""
+        requests = max(1, self.budget.requests)
+        return (f"hedged {self.hedges}/{self.budget.requests} requests ({100 * self.hedges / requests:.1f}%, "
+                f"{self.hedge_wins} won), {self.timeouts} timeouts, {self.budget.retries} retries")
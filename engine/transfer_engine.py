@@ -4,6 +4,10 @@ Handles mode detection, parallel downloads, and resume logic
 """
 import asyncio
 import aiohttp
+import gzip
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 from pathlib import Path
 import sys
@@ -12,11 +16,122 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import (
     MAX_PARALLEL_CHUNKS, MIN_PARALLEL_CHUNKS,
-    MAX_RETRY_ATTEMPTS, RETRY_DELAY,
-    RELAY_HOST, RELAY_PORT
+    MAX_RETRY_ATTEMPTS, RETRY_DELAY, MAX_BACKPRESSURE_WAIT, PIPELINE_POLL_INTERVAL, PIPELINE_STALL_TIMEOUT,
+    RELAY_HOST, RELAY_PORT, COMPRESSION_WORKERS, LAN_STRIPE_FILES, LAN_STRIPE_SIZE,
+    LAN_DISCOVERY_PORT, LAN_PREFER, CONNECTION_TIMEOUT, CLEANUP_AFTER_HOURS
 )
-from engine.chunk_manager import ChunkManager
-from engine.lan_transfer import LANTransferClient
+from engine.bandwidth import bandwidth
+from engine.chunk_manager import ChunkManager, get_stored_hash, count_chunks
+from engine.compression import compress, decompress, read_spooled, discard_spooled, prune_spool
+from engine.download_journal import DownloadJournal, PACK_INDEX, SINGLE_FILE, get_journal_path
+from engine.file_cache import FileHandleCache
+from engine.lan_discovery import resolve_peers
+from engine.lan_transfer import LANSeeder, LANTransferClient
+from engine.manifest_codec import ChunkTable, MANIFEST_MEDIA_TYPE, encode_compact, load_manifest
+from engine.swarm import ChunkJob, LANSource, SourceBusyError, SwarmScheduler, SwarmSource
+from engine.tail_latency import TailLatency, backoff_delay
+
+# Chunk (de)compression runs here so CPU work doesn't block the event loop
+compression_executor = ThreadPoolExecutor(max_workers=COMPRESSION_WORKERS)
+
+class RelayBusyError(Exception):
+    """Relay refused the request for now (429/503); retry after retry_after seconds"""
+    
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def get_retry_after(resp, default: float = RETRY_DELAY) -> float:
+    """Read Retry-After seconds from a response"""
+    try:
+        return max(0.0, float(resp.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return default
+
+def get_chunk_compressions(chunks: List[dict]) -> List[Optional[str]]:
+    """Compression of each manifest chunk entry (None = stored raw)"""
+    if isinstance(chunks, ChunkTable):
+        return [chunks.compression_of(chunk_id) for chunk_id in range(len(chunks))]
+    return [chunk.get('compression') for chunk in chunks]
+
+def get_compressed_hashes(manifest: dict) -> List[str]:
+    """Stored hashes of a manifest's compressed chunks (files and packs)"""
+    hashes = []
+    for file_manifest in manifest.get('files', [manifest]):
+        chunks = file_manifest.get('chunks', [])
+        if isinstance(chunks, ChunkTable):
+            hashes += [digest.hex() for _, digest in chunks.compressed.values()]
+        else:
+            hashes += [chunk['compressedHash'] for chunk in chunks if 'compressedHash' in chunk]
+    hashes += [pack['compressedHash'] for pack in manifest.get('packs', []) if 'compressedHash' in pack]
+    return hashes
+
+def encode_manifest(manifest: dict) -> bytes:
+    """
+    Serialize a manifest for the relay: binary chunk tables, gzip for the JSON header
+    (level 1: raw digests don't compress, file names do)
+    """
+    return gzip.compress(encode_compact(manifest), compresslevel=1)
+
+class RelaySource(SwarmSource):
+    """
+    The relay as a swarm source
+    Serves whole chunks only (by relay chunk id: a folder's file chunks in order,
+    then its packs); stored-compressed chunks are decoded before they're verified.
+    Requests are timed out and hedged like a relay-only download (see TailLatency);
+    the scheduler does the retrying
+    """
+    
+    def __init__(self, engine: 'TransferEngine', transfer_id: str, manifest: dict, slots: int):
+        super().__init__("relay", slots)
+        self.engine = engine
+        self.transfer_id = transfer_id
+        self.url = f"{engine.relay_url}/transfer/{transfer_id}/chunk"
+        self.session: Optional[aiohttp.ClientSession] = None
+        
+        # First relay chunk id of every file, and of the packs
+        self.first_ids = {SINGLE_FILE: 0}
+        relay_chunk_id = 0
+        for file_index, file_info in enumerate(manifest.get('files', [])):
+            if 'pack' not in file_info:
+                self.first_ids[file_index] = relay_chunk_id
+                relay_chunk_id += file_info['totalChunks']
+        self.first_ids[PACK_INDEX] = relay_chunk_id
+        self.files = manifest['files'] if 'files' in manifest else {SINGLE_FILE: manifest}
+        self.tail = TailLatency(count_chunks(manifest))
+    
+    def can_fetch(self, job: ChunkJob) -> bool:
+        return len(job.chunk_ids) == 1
+    
+    async def fetch(self, job: ChunkJob) -> bytes:
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        
+        chunk_id = job.chunk_ids[0]
+        url = f"{self.url}/{self.first_ids[job.file_index] + chunk_id}"
+        
+        async def get() -> bytes:
+            async with self.session.get(url) as resp:
+                if resp.status in (429, 503):
+                    raise SourceBusyError(f"Relay busy: {resp.status}", get_retry_after(resp))
+                if resp.status != 200:
+                    raise Exception(f"Download failed: {resp.status}")
+                return await resp.read()
+        
+        data = await self.tail.request(get)
+        await self.engine.bandwidth.throttle(self.transfer_id, len(data))
+        
+        if job.pack_info is not None:
+            compression = job.pack_info.get('compression')
+        else:
+            chunks = self.files[job.file_index].get('chunks', [])
+            compression = chunks[chunk_id].get('compression') if chunk_id < len(chunks) else None
+        return await self.engine._decode_chunk(data, compression)
+    
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
 
 class TransferEngine:
     """Main transfer orchestration engine"""
@@ -30,236 +145,1017 @@ class TransferEngine:
         self.chunk_manager = ChunkManager(mode=mode)
         self.parallel_workers = MAX_PARALLEL_CHUNKS
         self.relay_url = f"http://{RELAY_HOST}:{RELAY_PORT}"
+        self.bandwidth = bandwidth          # relay byte limits, shared process-wide
     
     async def upload_to_relay(self, transfer_id: str, manifest: dict, progress_callback=None):
         """Upload file/folder to relay server"""
         
         # Create transfer on relay
+        await self.create_relay_transfer(transfer_id, manifest)
+        
+        # Resume: chunks the relay already holds with a matching hash are skipped
+        present = await self.get_relay_chunks(transfer_id)
+        if present:
+            print(f"⏩ Resuming: {len(present)} chunks already on relay")
+        
+        # Upload chunks
+        loop = asyncio.get_running_loop()
+        try:
+            if 'files' in manifest:
+                # Folder transfer
+                await self._upload_folder_chunks(transfer_id, manifest, progress_callback, present)
+            else:
+                # Single file transfer
+                await self._upload_file_chunks(transfer_id, manifest, progress_callback, present)
+        finally:
+            self.bandwidth.release(transfer_id)
+        
+        # The relay has every chunk: drop their spooled compressed copies (and any abandoned ones)
+        if manifest.get('compression'):
+            await loop.run_in_executor(None, discard_spooled, get_compressed_hashes(manifest))
+            await loop.run_in_executor(None, prune_spool, CLEANUP_AFTER_HOURS * 3600)
+    
+    async def create_relay_transfer(self, transfer_id: str, manifest: dict):
+        """Create (or re-create, keeping its chunks) a transfer on the relay"""
+        
+        # Manifest goes in a gzip body in the binary form (query strings can't hold large folder manifests)
+        loop = asyncio.get_running_loop()
+        manifest_body = await loop.run_in_executor(None, encode_manifest, manifest)
+        
+        # Wait out backpressure if the relay is full
+        waited = 0.0
+        while True:
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.post(
+                        f"{self.relay_url}/transfer/create",
+                        params={'transfer_id': transfer_id},
+                        data=manifest_body,
+                        headers={'Content-Type': MANIFEST_MEDIA_TYPE, 'Content-Encoding': 'gzip'}
+                    ) as resp:
+                        if resp.status in (429, 503):
+                            raise RelayBusyError(await resp.text(), get_retry_after(resp))
+                        if resp.status != 200:
+                            raise Exception(f"Failed to create transfer: {await resp.text()}")
+                break
+            except RelayBusyError as e:
+                if waited >= MAX_BACKPRESSURE_WAIT:
+                    raise Exception(f"Failed to create transfer: relay busy ({e})")
+                waited += e.retry_after
+                await asyncio.sleep(e.retry_after)
+    
+    async def upload_folder_streaming(self, transfer_id: str, folder_path: str, progress_callback=None,
+                                      on_created=None) -> dict:
+        """
+        Scan, hash and upload a folder at the same time
+        A worker thread walks and hashes files while each file's chunks are uploaded
+        as soon as it is done. The relay gets the full manifest at the end (re-creating
+        the transfer keeps its chunks), then pack chunks and any chunk that didn't
+        match the manifest are uploaded. Returns the folder manifest.
+        on_created: awaited with the placeholder manifest once the relay has the transfer
+        (e.g. to hand out the pair code before the scan)
+        """
+        # Placeholder manifest so the relay accepts chunks while the folder is scanned
+        placeholder = {
+            'folderName': Path(folder_path).name,
+            'totalSize': 0,
+            'totalFiles': 0,
+            'files': [],
+            'streaming': True
+        }
+        await self.create_relay_transfer(transfer_id, placeholder)
+        if on_created:
+            await on_created(placeholder)
+        present = await self.get_relay_chunks(transfer_id)
+        
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        
+        def scan():
+            try:
+                for item in self.chunk_manager.iter_folder_manifest(folder_path):
+                    if stop.is_set():
+                        return
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, ('error', e))
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+        
+        scanner = loop.run_in_executor(None, scan)
+        semaphore = asyncio.Semaphore(self.parallel_workers)
+        tasks = set()
+        files = []
+        packs = []
+        relay_chunk_id = 0
+        # Counted as they're queued: the total isn't known before the scan ends
+        tail = TailLatency(0)
+        
+        async def upload_chunk(relay_chunk_id: int, file_info: dict, chunk: dict):
+            try:
+                await self._upload_chunk(
+                    transfer_id, relay_chunk_id, lambda: self._read_upload_chunk(file_info, chunk['id']),
+                    get_stored_hash(chunk), tail
+                )
+                if progress_callback:
+                    progress_callback(relay_chunk_id, None)
+            finally:
+                semaphore.release()
+        
+        try:
+            while (item := await queue.get()) is not None:
+                kind, entry = item
+                if kind == 'error':
+                    raise entry
+                if kind == 'pack':
+                    packs.append(entry)
+                    continue
+                
+                files.append(entry)
+                for chunk in entry['chunks']:
+                    if present.get(relay_chunk_id) == get_stored_hash(chunk):
+                        if progress_callback:
+                            progress_callback(relay_chunk_id, None)
+                    else:
+                        # Bounded in-flight uploads: wait for a slot before starting the next
+                        tail.total += 1
+                        await semaphore.acquire()
+                        task = asyncio.create_task(upload_chunk(relay_chunk_id, entry, chunk))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                    relay_chunk_id += 1
+                
+                # Surface upload failures without waiting for the scan to finish
+                for task in [t for t in tasks if t.done()]:
+                    task.result()
+            
+            await asyncio.gather(*tasks)
+            await scanner
+        finally:
+            stop.set()
+            for task in tasks:
+                task.cancel()
+        if tail.hedges or tail.timeouts or tail.budget.retries:
+            print(f"🐢 Tail latency: {tail.summary()}")
+        
+        manifest = self.chunk_manager.build_folder_manifest(folder_path, files, packs)
+        
+        # Full manifest: relay verifies from here on; uploads packs and anything that didn't match
+        await self.upload_to_relay(transfer_id, manifest)
+        if progress_callback:
+            for pack_info in packs:
+                progress_callback(relay_chunk_id + pack_info['id'], None)
+        
+        return manifest
+    
+    async def upload_file_pipelined(self, transfer_id: str, manifest: dict, progress_callback=None) -> dict:
+        """
+        Hash and upload a file in one pass (transfer already created with a pipelined manifest)
+        Each chunk leaves as soon as it is hashed, with its hash so receivers can verify it
+        before the full manifest exists. The final manifest (chunk hashes + file hash)
+        replaces the pipelined one at the end. Chunks are sent uncompressed.
+        Returns the final manifest.
+        """
+        file_path = manifest['filePath']
+        chunk_size = manifest['chunkSize']
+        total_chunks = manifest['totalChunks']
+        present = await self.get_relay_chunks(transfer_id)
+        if present:
+            print(f"⏩ Resuming: {len(present)} chunks already on relay")
+        
+        loop = asyncio.get_running_loop()
+        file_hash = hashlib.sha256()
+        chunks = ChunkTable(chunk_size)
+        semaphore = asyncio.Semaphore(self.parallel_workers)
+        tasks = set()
+        tail = TailLatency(total_chunks - len(present))
+        
+        async def upload_chunk(chunk_id: int, chunk_data: bytes, chunk_hash: str):
+            try:
+                async def read_chunk() -> bytes:
+                    return chunk_data
+                await self._upload_chunk(transfer_id, chunk_id, read_chunk, chunk_hash, tail)
+                if progress_callback:
+                    progress_callback(chunk_id, total_chunks)
+            finally:
+                semaphore.release()
+        
+        def read_and_hash(f) -> tuple:
+            chunk_data = f.read(chunk_size)
+            file_hash.update(chunk_data)
+            return chunk_data, hashlib.sha256(chunk_data).hexdigest()
+        
+        try:
+            with open(file_path, 'rb') as f:
+                for chunk_id in range(total_chunks):
+                    # Hold at most parallel_workers chunks in memory
+                    await semaphore.acquire()
+                    chunk_data, chunk_hash = await loop.run_in_executor(None, read_and_hash, f)
+                    if not chunk_data:
+                        semaphore.release()
+                        raise Exception(f"File changed while sending: {file_path}")
+                    chunks.append({'id': chunk_id, 'hash': chunk_hash, 'size': len(chunk_data)})
+                    
+                    if present.get(chunk_id) == chunk_hash:
+                        semaphore.release()
+                        if progress_callback:
+                            progress_callback(chunk_id, total_chunks)
+                        continue
+                    
+                    task = asyncio.create_task(upload_chunk(chunk_id, chunk_data, chunk_hash))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    
+                    # Surface upload failures without reading the rest of the file
+                    for task in [t for t in tasks if t.done()]:
+                        task.result()
+                
+                if f.read(1):
+                    raise Exception(f"File changed while sending: {file_path}")
+            
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        if tail.hedges or tail.timeouts or tail.budget.retries:
+            print(f"🐢 Tail latency: {tail.summary()}")
+        
+        final = {k: v for k, v in manifest.items() if k != 'pipelined'}
+        final['hash'] = file_hash.hexdigest()
+        final['chunks'] = chunks
+        
+        # Final manifest: relay verifies what it holds and anything that didn't match is resent
+        await self.upload_to_relay(transfer_id, final)
+        return final
+    
+    async def get_relay_chunks(self, transfer_id: str) -> Dict[int, str]:
+        """Get {relay_chunk_id: hash} of chunks already stored on the relay"""
         async with aiohttp.ClientSession() as session:
-            import json
-            async with session.post(
-                f"{self.relay_url}/transfer/create",
-                params={
-                    'transfer_id': transfer_id,
-                    'manifest': json.dumps(manifest)
-                }
+            async with session.get(
+                f"{self.relay_url}/transfer/{transfer_id}/status",
+                params={'hashes': 'true'}
             ) as resp:
+                if resp.status == 404:
+                    return {}
                 if resp.status != 200:
-                    raise Exception(f"Failed to create transfer: {await resp.text()}")
+                    raise Exception(f"Failed to get transfer status: {await resp.text()}")
+                status = await resp.json()
         
-        # Upload chunks
-        if 'files' in manifest:
-            # Folder transfer
-            await self._upload_folder_chunks(transfer_id, manifest, progress_callback)
-        else:
-            # Single file transfer
-            await self._upload_file_chunks(transfer_id, manifest, progress_callback)
+        return {int(chunk_id): chunk_hash for chunk_id, chunk_hash in status.get('chunk_hashes', {}).items()}
     
-    async def _upload_file_chunks(self, transfer_id: str, manifest: dict, progress_callback=None):
-        """Upload chunks for a single file"""
-        file_path = manifest['filePath']
+    async def _upload_file_chunks(self, transfer_id: str, manifest: dict, progress_callback=None,
+                                  present: Optional[Dict[int, str]] = None):
+        """
+        Upload chunks for a single file (only those missing from present)
+        Stragglers near the end are hedged (see TailLatency)
+        """
         total_chunks = manifest['totalChunks']
+        present = present or {}
         
         # Upload chunks in parallel
         semaphore = asyncio.Semaphore(self.parallel_workers)
         
-        async def upload_chunk(chunk_id: int):
+        async def upload_chunk(chunk: dict):
             async with semaphore:
-                for attempt in range(MAX_RETRY_ATTEMPTS):
-                    try:
-                        chunk_data = self.chunk_manager.read_chunk(file_path, chunk_id)
-                        
-                        async with aiohttp.ClientSession() as session:
-                            form = aiohttp.FormData()
-                            form.add_field('file', chunk_data, filename=f'chunk_{chunk_id:06d}')
-                            
-                            async with session.post(
-                                f"{self.relay_url}/transfer/{transfer_id}/chunk/{chunk_id}",
-                                data=form
-                            ) as resp:
-                                if resp.status == 200:
-                                    if progress_callback:
-                                        progress_callback(chunk_id, total_chunks)
-                                    return
-                                else:
-                                    raise Exception(f"Upload failed: {await resp.text()}")
-                    
-                    except Exception as e:
-                        if attempt == MAX_RETRY_ATTEMPTS - 1:
-                            raise
-                        await asyncio.sleep(RETRY_DELAY * (attempt + 1))
+                await self._upload_chunk(transfer_id, chunk['id'], lambda: self._read_upload_chunk(manifest, chunk['id']),
+                                         tail=tail)
+                if progress_callback:
+                    progress_callback(chunk['id'], total_chunks)
         
-        # Upload all chunks
-        tasks = [upload_chunk(i) for i in range(total_chunks)]
+        # Upload the gaps
+        tasks = []
+        for chunk in manifest['chunks']:
+            if present.get(chunk['id']) == get_stored_hash(chunk):
+                if progress_callback:
+                    progress_callback(chunk['id'], total_chunks)
+            else:
+                tasks.append(upload_chunk(chunk))
+        tail = TailLatency(len(tasks))
         await asyncio.gather(*tasks)
+        if tail.hedges or tail.timeouts or tail.budget.retries:
+            print(f"🐢 Tail latency: {tail.summary()}")
     
-    async def _upload_folder_chunks(self, transfer_id: str, manifest: dict, progress_callback=None):
-        """Upload chunks for all files in folder"""
-        total_chunks = sum(f['totalChunks'] for f in manifest['files'])
-        uploaded = 0
+    async def _read_upload_chunk(self, file_manifest: dict, chunk_id: int) -> bytes:
+        """
+        Read a chunk as the relay stores it: compressed chunks come from the spool
+        written with the manifest, or are compressed again in the worker pool
+        """
+        chunks = file_manifest['chunks']
+        if isinstance(chunks, ChunkTable):
+            compression = chunks.compression_of(chunk_id)
+        else:
+            compression = chunks[chunk_id].get('compression')
         
-        for file_info in manifest['files']:
-            file_path = file_info['filePath']
-            file_chunks = file_info['totalChunks']
-            
-            # Upload this file's chunks
-            for chunk_id in range(file_chunks):
-                chunk_data = self.chunk_manager.read_chunk(file_path, chunk_id)
-                
-                async with aiohttp.ClientSession() as session:
-                    form = aiohttp.FormData()
-                    form.add_field('file', chunk_data, filename=f'chunk_{chunk_id:06d}')
-                    
-                    async with session.post(
-                        f"{self.relay_url}/transfer/{transfer_id}/chunk/{uploaded}",
-                        data=form
-                    ) as resp:
-                        if resp.status != 200:
-                            raise Exception(f"Upload failed: {await resp.text()}")
+        loop = asyncio.get_running_loop()
+        if compression:
+            spooled = await loop.run_in_executor(None, read_spooled, get_stored_hash(chunks[chunk_id]))
+            if spooled is not None:
+                return spooled
+        
+        offset, size = self.chunk_manager.get_chunk_span(file_manifest, chunk_id)
+        chunk_data = self.chunk_manager.read_chunk(file_manifest['filePath'], chunk_id, offset, size)
+        if not compression:
+            return chunk_data
+        
+        level = file_manifest.get('compressionLevel')
+        return await loop.run_in_executor(compression_executor, compress, chunk_data, compression, level)
+    
+    async def _read_upload_pack(self, manifest: dict, pack_info: dict) -> bytes:
+        """Read (and compress) a pack chunk of small folder files in the worker pool (spooled if possible)"""
+        loop = asyncio.get_running_loop()
+        compression = pack_info.get('compression')
+        if compression:
+            spooled = await loop.run_in_executor(None, read_spooled, get_stored_hash(pack_info))
+            if spooled is not None:
+                return spooled
+        
+        pack_data = await loop.run_in_executor(compression_executor, self.chunk_manager.read_pack, manifest, pack_info)
+        if not compression:
+            return pack_data
+        return await loop.run_in_executor(
+            compression_executor, compress, pack_data, compression, manifest.get('compressionLevel')
+        )
+    
+    async def _decode_chunk(self, chunk_data: bytes, compression: Optional[str]) -> bytes:
+        """Decompress a downloaded chunk in the worker pool"""
+        if not compression:
+            return chunk_data
+        
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(compression_executor, decompress, chunk_data, compression)
+    
+    async def _upload_chunk(self, transfer_id: str, relay_chunk_id: int, read_chunk,
+                            chunk_hash: Optional[str] = None, tail: Optional[TailLatency] = None):
+        """
+        Upload one chunk with retries; read_chunk() returns its bytes (re-read on every attempt)
+        Chunks rejected by the relay hash check are re-read and resent right away;
+        429/503 responses are retried after the relay's Retry-After, other failures
+        after a jittered backoff (within tail's retry budget, which also times out
+        and hedges the requests). Every send waits for the bandwidth limits first.
+        chunk_hash publishes the chunk's hash with it when the relay manifest doesn't have it yet
+        """
+        async def post(chunk_data: bytes) -> Optional[str]:
+            """One upload; returns the relay's rejection if the hash check failed"""
+            async with aiohttp.ClientSession() as session:
+                form = aiohttp.FormData()
+                form.add_field('file', chunk_data, filename=f'chunk_{relay_chunk_id:06d}')
                 
-                uploaded += 1
-                if progress_callback:
-                    progress_callback(uploaded, total_chunks)
+                async with session.post(
+                    f"{self.relay_url}/transfer/{transfer_id}/chunk/{relay_chunk_id}",
+                    data=form,
+                    headers={'X-Chunk-Hash': chunk_hash} if chunk_hash else None
+                ) as resp:
+                    if resp.status == 200:
+                        return None
+                    if resp.status in (429, 503):
+                        raise RelayBusyError(await resp.text(), get_retry_after(resp))
+                    if resp.status == 422:
+                        return await resp.text()
+                    raise Exception(f"Upload failed: {await resp.text()}")
+        
+        attempt = 0
+        waited = 0.0
+        while True:
+            try:
+                chunk_data = await read_chunk()
+                await self.bandwidth.throttle(transfer_id, len(chunk_data))
+                if tail is not None:
+                    rejected = await tail.request(lambda: post(chunk_data))
+                else:
+                    rejected = await post(chunk_data)
+                if rejected is None:
+                    return
+                if attempt >= MAX_RETRY_ATTEMPTS - 1:
+                    raise Exception(f"Upload failed: {rejected}")
+                # Corrupted in transit - resend without backoff
+                attempt += 1
+                continue
+            
+            except RelayBusyError as e:
+                # Backpressure is not a failure: wait as told without using up retries
+                if waited >= MAX_BACKPRESSURE_WAIT:
+                    raise Exception(f"Upload failed: relay busy for {waited:.0f}s ({e})")
+                waited += e.retry_after
+                await asyncio.sleep(e.retry_after)
+            
+            except Exception as e:
+                attempt += 1
+                if attempt >= MAX_RETRY_ATTEMPTS or (tail is not None and not tail.budget.try_retry()):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
     
-    async def download_from_relay(self, transfer_id: str, output_path: str, progress_callback=None):
-        """Download file/folder from relay server"""
+    async def _upload_folder_chunks(self, transfer_id: str, manifest: dict, progress_callback=None,
+                                    present: Optional[Dict[int, str]] = None):
+        """
+        Upload chunks for all files in folder (only those missing from present)
+        Pack chunks of small files follow the file chunks in relay chunk id order;
+        chunks go up in parallel and stragglers near the end are hedged (see TailLatency)
+        """
+        total_chunks = count_chunks(manifest)
+        present = present or {}
+        semaphore = asyncio.Semaphore(self.parallel_workers)
         
-        # Get manifest
+        async def upload_chunk(relay_chunk_id: int, read_chunk):
+            async with semaphore:
+                await self._upload_chunk(transfer_id, relay_chunk_id, read_chunk, tail=tail)
+                if progress_callback:
+                    progress_callback(relay_chunk_id, total_chunks)
+        
+        def file_reader(file_info: dict, chunk_id: int):
+            return lambda: self._read_upload_chunk(file_info, chunk_id)
+        
+        def pack_reader(pack_info: dict):
+            return lambda: self._read_upload_pack(manifest, pack_info)
+        
+        # File chunks, then pack chunks
+        tasks = []
+        relay_chunk_id = 0
+        entries = [(chunk, file_reader(file_info, chunk['id']))
+                   for file_info in manifest['files'] for chunk in file_info['chunks']]
+        entries += [(pack_info, pack_reader(pack_info)) for pack_info in manifest.get('packs', [])]
+        for entry, read_chunk in entries:
+            if present.get(relay_chunk_id) == get_stored_hash(entry):
+                if progress_callback:
+                    progress_callback(relay_chunk_id, total_chunks)
+            else:
+                tasks.append(upload_chunk(relay_chunk_id, read_chunk))
+            relay_chunk_id += 1
+        tail = TailLatency(len(tasks))
+        await asyncio.gather(*tasks)
+        if tail.hedges or tail.timeouts or tail.budget.retries:
+            print(f"🐢 Tail latency: {tail.summary()}")
+    
+    async def get_relay_manifest(self, transfer_id: str) -> dict:
+        """Get a transfer manifest from the relay (binary form; chunk tables are read lazily)"""
         async with aiohttp.ClientSession() as session:
-            async with session.get(f"{self.relay_url}/transfer/{transfer_id}/manifest") as resp:
+            async with session.get(
+                f"{self.relay_url}/transfer/{transfer_id}/manifest",
+                headers={'Accept': f"{MANIFEST_MEDIA_TYPE}, application/json"}
+            ) as resp:
                 if resp.status != 200:
                     raise Exception(f"Failed to get manifest: {await resp.text()}")
-                manifest = await resp.json()
+                body = await resp.read()
+        
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, load_manifest, body)
+    
+    async def wait_for_manifest(self, transfer_id: str) -> dict:
+        """Get the relay manifest, waiting while a streaming folder upload is still scanning"""
+        while True:
+            manifest = await self.get_relay_manifest(transfer_id)
+            if not manifest.get('streaming'):
+                return manifest
+            await asyncio.sleep(PIPELINE_POLL_INTERVAL)
+    
+    async def download_from_relay(self, transfer_id: str, output_path: str, progress_callback=None) -> dict:
+        """Download file/folder from relay server; returns the (final) manifest"""
+        
+        # Get manifest
+        manifest = await self.get_relay_manifest(transfer_id)
         
         # Download chunks
-        if 'files' in manifest:
-            # Folder transfer
-            await self._download_folder_chunks(transfer_id, manifest, output_path, progress_callback)
-        else:
-            # Single file transfer
-            await self._download_file_chunks(transfer_id, manifest, output_path, progress_callback)
+        try:
+            if manifest.get('pipelined'):
+                # Sender is still hashing: follow its uploads
+                return await self._download_pipelined(transfer_id, manifest, output_path, progress_callback)
+            if 'files' in manifest:
+                # Folder transfer
+                await self._download_folder_chunks(transfer_id, manifest, output_path, progress_callback)
+            else:
+                # Single file transfer
+                await self._download_file_chunks(transfer_id, manifest, output_path, progress_callback)
+            return manifest
+        finally:
+            self.bandwidth.release(transfer_id)
+    
+    async def _download_pipelined(self, transfer_id: str, manifest: dict, output_path: str,
+                                  progress_callback=None) -> dict:
+        """
+        Download a file while the sender is still hashing and uploading it
+        Chunks are fetched as they appear on the relay and checked against the hash the
+        sender published with each one; ends once every chunk is in and the sender has
+        posted the final manifest (returned)
+        """
+        total_chunks = manifest['totalChunks']
+        chunk_size = manifest['chunkSize']
+        done = set()
+        semaphore = asyncio.Semaphore(self.parallel_workers)
+        loop = asyncio.get_running_loop()
+        
+        # Start from a fresh file; chunks are written at their offsets as they arrive
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'wb') as f:
+            f.truncate(manifest['size'])
+        
+        # Stragglers near the end are hedged, failures retried with backoff (see TailLatency)
+        tail = TailLatency(total_chunks)
+        
+        async def fetch(chunk_id: int, chunk_hash: str) -> bytes:
+            """One verified fetch (a mismatch is retried like any other failure)"""
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{self.relay_url}/transfer/{transfer_id}/chunk/{chunk_id}") as resp:
+                    if resp.status != 200:
+                        raise Exception(f"Download failed: {resp.status}")
+                    chunk_data = await resp.read()
+            actual = await loop.run_in_executor(None, self.chunk_manager.calculate_chunk_hash, chunk_data)
+            if actual != chunk_hash:
+                raise Exception(f"Chunk {chunk_id} hash mismatch")
+            return chunk_data
+        
+        async def download_chunk(chunk_id: int, chunk_hash: str):
+            async with semaphore:
+                chunk_data = await tail.call(lambda: fetch(chunk_id, chunk_hash))
+                await self.bandwidth.throttle(transfer_id, len(chunk_data))
+                self.chunk_manager.write_chunk(output_path, chunk_id, chunk_data, chunk_id * chunk_size)
+                done.add(chunk_id)
+                if progress_callback:
+                    progress_callback(chunk_id, total_chunks)
+        
+        idle = 0.0
+        while True:
+            published = await self.get_relay_chunks(transfer_id)
+            new = {chunk_id: h for chunk_id, h in published.items() if chunk_id not in done and h}
+            await asyncio.gather(*(download_chunk(chunk_id, h) for chunk_id, h in new.items()))
+            
+            if len(done) >= total_chunks:
+                manifest = await self.get_relay_manifest(transfer_id)
+                if not manifest.get('pipelined'):
+                    if tail.hedges or tail.timeouts or tail.budget.retries:
+                        print(f"🐢 Tail latency: {tail.summary()}")
+                    return manifest
+            
+            if new:
+                idle = 0.0
+                continue
+            if idle >= PIPELINE_STALL_TIMEOUT:
+                raise Exception(f"Sender stopped uploading ({len(done)}/{total_chunks} chunks received)")
+            idle += PIPELINE_POLL_INTERVAL
+            await asyncio.sleep(PIPELINE_POLL_INTERVAL)
+    
+    async def _prepare_delta(self, file_manifest: dict, output_path: str):
+        """
+        Delta sync against an existing copy at output_path
+        Chunks found in the local copy are reused; returns (chunk ids to download, path to write)
+        Moved chunks are assembled in output_path + '.delta', which replaces the
+        original in _finish_delta; otherwise the file is patched in place
+        """
+        if 'chunks' not in file_manifest:
+            missing = self.chunk_manager.get_missing_chunks(output_path, file_manifest['totalChunks'])
+            return missing, output_path
+        
+        loop = asyncio.get_running_loop()
+        missing, reuse = await loop.run_in_executor(None, self.chunk_manager.plan_delta, output_path, file_manifest)
+        if reuse:
+            print(f"🔁 Delta: reusing {len(reuse)}/{len(file_manifest['chunks'])} chunks of {Path(output_path).name}")
+        
+        spans = {chunk_id: self.chunk_manager.get_chunk_span(file_manifest, chunk_id) for chunk_id in reuse}
+        
+        if all(reuse[chunk_id] == spans[chunk_id][0] for chunk_id in reuse):
+            # Every reused chunk is already in place: only trim and fill the gaps
+            if os.path.exists(output_path) and os.path.getsize(output_path) > file_manifest['size']:
+                os.truncate(output_path, file_manifest['size'])
+            return missing, output_path
+        
+        def copy_reused(delta_path: str):
+            with open(output_path, 'rb') as src, open(delta_path, 'wb') as dst:
+                dst.truncate(file_manifest['size'])
+                for chunk_id, src_offset in reuse.items():
+                    offset, size = spans[chunk_id]
+                    src.seek(src_offset)
+                    dst.seek(offset)
+                    dst.write(src.read(size))
+        
+        delta_path = output_path + ".delta"
+        await loop.run_in_executor(None, copy_reused, delta_path)
+        return missing, delta_path
+    
+    def _finish_delta(self, target_path: str, output_path: str):
+        """Move an assembled delta file over the old copy"""
+        if target_path != output_path:
+            os.replace(target_path, output_path)
     
     async def _download_file_chunks(self, transfer_id: str, manifest: dict, output_path: str, progress_callback=None):
-        """Download chunks for a single file"""
+        """Download chunks for a single file (only those not in an existing copy)"""
         total_chunks = manifest['totalChunks']
+        compressions = get_chunk_compressions(manifest.get('chunks', []))
         
-        # Get missing chunks (for resume)
-        missing_chunks = self.chunk_manager.get_missing_chunks(output_path, total_chunks)
+        # Get missing chunks (resume / delta sync against an existing copy)
+        missing_chunks, target_path = await self._prepare_delta(manifest, output_path)
+        if progress_callback:
+            for chunk_id in sorted(set(range(total_chunks)) - set(missing_chunks)):
+                progress_callback(chunk_id, total_chunks)
         
         if not missing_chunks:
+            self._finish_delta(target_path, output_path)
             print("✅ File already complete!")
             return
         
-        # Download chunks in parallel
+        # Download chunks in parallel; stragglers near the end are hedged (see TailLatency)
         semaphore = asyncio.Semaphore(self.parallel_workers)
+        tail = TailLatency(len(missing_chunks))
+        
+        async def fetch(chunk_id: int) -> bytes:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(
+                    f"{self.relay_url}/transfer/{transfer_id}/chunk/{chunk_id}"
+                ) as resp:
+                    if resp.status == 200:
+                        return await resp.read()
+                    else:
+                        raise Exception(f"Download failed: {resp.status}")
         
         async def download_chunk(chunk_id: int):
             async with semaphore:
-                for attempt in range(MAX_RETRY_ATTEMPTS):
-                    try:
-                        async with aiohttp.ClientSession() as session:
-                            async with session.get(
-                                f"{self.relay_url}/transfer/{transfer_id}/chunk/{chunk_id}"
-                            ) as resp:
-                                if resp.status == 200:
-                                    chunk_data = await resp.read()
-                                    self.chunk_manager.write_chunk(output_path, chunk_id, chunk_data)
-                                    
-                                    if progress_callback:
-                                        progress_callback(chunk_id, total_chunks)
-                                    return
-                                else:
-                                    raise Exception(f"Download failed: {resp.status}")
-                    
-                    except Exception as e:
-                        if attempt == MAX_RETRY_ATTEMPTS - 1:
-                            raise
-                        await asyncio.sleep(RETRY_DELAY * (attempt + 1))
+                chunk_data = await tail.call(lambda: fetch(chunk_id))
+                await self.bandwidth.throttle(transfer_id, len(chunk_data))
+                if chunk_id < len(compressions):
+                    chunk_data = await self._decode_chunk(chunk_data, compressions[chunk_id])
+                offset, _ = self.chunk_manager.get_chunk_span(manifest, chunk_id)
+                self.chunk_manager.write_chunk(target_path, chunk_id, chunk_data, offset)
+                
+                if progress_callback:
+                    progress_callback(chunk_id, total_chunks)
         
         # Download missing chunks
         tasks = [download_chunk(i) for i in missing_chunks]
         await asyncio.gather(*tasks)
+        self._finish_delta(target_path, output_path)
+        if tail.hedges or tail.timeouts or tail.budget.retries:
+            print(f"🐢 Tail latency: {tail.summary()}")
     
     async def _download_folder_chunks(self, transfer_id: str, manifest: dict, output_path: str, progress_callback=None):
-        """Download chunks for all files in folder"""
+        """
+        Download chunks for all files in folder (small files arrive in pack chunks)
+        Each file's chunks come in parallel; every request is timed out, hedged near
+        the end and retried with backoff (see TailLatency)
+        """
         base_path = Path(output_path)
-        total_chunks = sum(f['totalChunks'] for f in manifest['files'])
+        total_chunks = count_chunks(manifest)
         chunk_offset = 0
+        semaphore = asyncio.Semaphore(self.parallel_workers)
+        # Chunks already here are taken off the total as they're found
+        tail = TailLatency(total_chunks)
+        
+        async def fetch(relay_chunk_id: int) -> bytes:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(
+                    f"{self.relay_url}/transfer/{transfer_id}/chunk/{relay_chunk_id}"
+                ) as resp:
+                    if resp.status != 200:
+                        raise Exception(f"Download failed: {resp.status}")
+                    return await resp.read()
         
         for file_info in manifest['files']:
+            if 'pack' in file_info:
+                continue
+            
             # Create file path
             file_path = base_path / file_info['relativePath']
             file_path.parent.mkdir(parents=True, exist_ok=True)
+            compressions = get_chunk_compressions(file_info.get('chunks', []))
+            
+            # Unchanged files are skipped; changed ones only fetch differing chunks
+            missing_chunks, target_path = await self._prepare_delta(file_info, str(file_path))
+            tail.total -= file_info['totalChunks'] - len(missing_chunks)
+            if progress_callback:
+                for chunk_id in sorted(set(range(file_info['totalChunks'])) - set(missing_chunks)):
+                    progress_callback(chunk_offset + chunk_id, total_chunks)
+            
+            async def download_chunk(file_info: dict, chunk_offset: int, chunk_id: int):
+                async with semaphore:
+                    chunk_data = await tail.call(lambda: fetch(chunk_offset + chunk_id))
+                    await self.bandwidth.throttle(transfer_id, len(chunk_data))
+                    if chunk_id < len(compressions):
+                        chunk_data = await self._decode_chunk(chunk_data, compressions[chunk_id])
+                    offset, _ = self.chunk_manager.get_chunk_span(file_info, chunk_id)
+                    self.chunk_manager.write_chunk(target_path, chunk_id, chunk_data, offset)
+                    
+                    if progress_callback:
+                        progress_callback(chunk_offset + chunk_id, total_chunks)
             
             # Download this file's chunks
-            for chunk_id in range(file_info['totalChunks']):
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(
-                        f"{self.relay_url}/transfer/{transfer_id}/chunk/{chunk_offset + chunk_id}"
-                    ) as resp:
-                        if resp.status == 200:
-                            chunk_data = await resp.read()
-                            self.chunk_manager.write_chunk(str(file_path), chunk_id, chunk_data)
-                            
-                            if progress_callback:
-                                progress_callback(chunk_offset + chunk_id, total_chunks)
-                        else:
-                            raise Exception(f"Download failed: {resp.status}")
+            await asyncio.gather(*(download_chunk(file_info, chunk_offset, chunk_id) for chunk_id in missing_chunks))
             
+            self._finish_delta(target_path, str(file_path))
             chunk_offset += file_info['totalChunks']
+        
+        # Download pack chunks and unpack their files (packs already present locally are skipped)
+        loop = asyncio.get_running_loop()
+        for pack_info in manifest.get('packs', []):
+            relay_chunk_id = chunk_offset + pack_info['id']
+            
+            if not await loop.run_in_executor(None, self.chunk_manager.is_pack_current, manifest, pack_info, base_path):
+                pack_data = await tail.call(lambda: fetch(relay_chunk_id))
+                await self.bandwidth.throttle(transfer_id, len(pack_data))
+                
+                pack_data = await self._decode_chunk(pack_data, pack_info.get('compression'))
+                await loop.run_in_executor(None, self.chunk_manager.unpack, manifest, pack_info, pack_data, base_path)
+            else:
+                tail.total -= 1
+            
+            if progress_callback:
+                progress_callback(relay_chunk_id, total_chunks)
+        
+        if tail.hedges or tail.timeouts or tail.budget.retries:
+            print(f"🐢 Tail latency: {tail.summary()}")
     
-    async def download_from_lan(self, server_ip: str, output_path: str, progress_callback=None):
-        """Download file/folder via LAN direct"""
-        from engine.lan_transfer import LANTransferClient
+    async def find_lan_peers(self, pair_code: str, transfer_id: str) -> List[tuple]:
+        """
+        Look for the sender and seeding receivers on the LAN (UDP discovery)
+        Returns (ip, port, stream_port) of those that answer and are reachable
+        """
+        if not LAN_PREFER:
+            return []
         
-        client = LANTransferClient(server_ip)
+        async def reachable(peer: tuple) -> bool:
+            # Make sure it's reachable over TCP, not just answering datagrams
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(peer[0], peer[1]), CONNECTION_TIMEOUT)
+                writer.close()
+                return True
+            except (OSError, asyncio.TimeoutError):
+                return False
         
-        # Get manifest
-        manifest = await client.get_manifest()
+        peers = await resolve_peers(pair_code, transfer_id)
+        checks = await asyncio.gather(*(reachable(peer) for peer in peers))
+        return [peer for peer, ok in zip(peers, checks) if ok]
+    
+    async def download_from_lan(self, server_ip: str, output_path: str, progress_callback=None,
+                                port: int = LAN_DISCOVERY_PORT) -> dict:
+        """Download file/folder via LAN direct; returns the manifest"""
+        client = LANTransferClient(server_ip, port)
+        
+        try:
+            # Get manifest
+            manifest = await client.get_manifest()
+            source = await self._make_lan_source(client, manifest, manifest)
+            await self._download_swarm(manifest, output_path, [source], progress_callback)
+            return manifest
+        finally:
+            await client.close()
+    
+    async def download_multi_source(self, transfer_id: str, output_path: str, peers: List[tuple],
+                                    progress_callback=None, seeder: Optional[LANSeeder] = None) -> dict:
+        """
+        Download a transfer from the relay and LAN peers (ip, port, ...) at once
+        The relay's manifest is the reference when the relay has the transfer;
+        peers serving different content are left out. With a seeder, chunks are
+        served to other receivers as soon as they're verified. Returns the manifest
+        """
+        manifest = None
+        try:
+            manifest = await self.get_relay_manifest(transfer_id)
+        except Exception as e:
+            print(f"⚠️  Relay unavailable, LAN only: {e}")
+        
+        relay_has_transfer = manifest is not None
+        if relay_has_transfer and manifest.get('pipelined'):
+            # Sender is still hashing: only the relay knows which chunks exist yet
+            try:
+                return await self._download_pipelined(transfer_id, manifest, output_path, progress_callback)
+            finally:
+                self.bandwidth.release(transfer_id)
+        
+        clients = [LANTransferClient(peer[0], peer[1]) for peer in peers]
+        sources: List[SwarmSource] = []
+        try:
+            for client in clients:
+                try:
+                    lan_manifest = await client.get_manifest()
+                except Exception as e:
+                    print(f"⚠️  Skipping LAN peer {client.server_ip}: {e}")
+                    continue
+                if manifest is None:
+                    manifest = lan_manifest
+                source = await self._make_lan_source(client, lan_manifest, manifest)
+                if source is not None and source.usable:
+                    sources.append(source)
+            
+            if manifest is None:
+                raise Exception("Transfer not available from the relay or any LAN peer")
+            relay = None
+            if relay_has_transfer:
+                relay = RelaySource(self, transfer_id, manifest, self.parallel_workers)
+                sources.append(relay)
+            
+            have = None
+            files = None
+            if seeder is not None and await seeder.seed(manifest, output_path):
+                have = seeder.have
+                files = seeder.files
+            await self._download_swarm(manifest, output_path, sources, progress_callback, have, files)
+            if relay is not None and (relay.tail.hedges or relay.tail.timeouts):
+                print(f"🐢 Tail latency: {relay.tail.summary()}")
+            return manifest
+        finally:
+            await asyncio.gather(*(source.close() for source in sources), return_exceptions=True)
+            await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+            self.bandwidth.release(transfer_id)
+    
+    async def _make_lan_source(self, client: LANTransferClient, lan_manifest: dict,
+                               manifest: dict) -> Optional[LANSource]:
+        """
+        Swarm source for a LAN server; the stream transport pipelines requests, so give it enough slots to fill it
+        None for a partial seeder of another chunk layout (its chunk list can't be mapped to ours)
+        """
+        if client.partial and (self.chunk_manager.get_manifest_fingerprint(lan_manifest)
+                               != self.chunk_manager.get_manifest_fingerprint(manifest)):
+            return None
+        stream = await client.get_stream()
+        slots = self.parallel_workers if stream is None else max(self.parallel_workers, stream.capacity)
+        return LANSource(client, lan_manifest, manifest, slots)
+    
+    async def _download_swarm(self, manifest: dict, output_path: str, sources: List[SwarmSource],
+                              progress_callback=None, have: Optional[set] = None,
+                              files: Optional[FileHandleCache] = None):
+        """
+        Download a file or folder from one or more sources
+        Chunks are scheduled over every source by throughput and checked against the
+        manifest hash; each verified chunk is journaled so an interrupted download
+        resumes exactly where it stopped. Chunks that are in place in their final
+        file are added to have (what a seeder may serve); files is that seeder's
+        handle cache, evicted whenever a file is moved into place
+        """
+        if have is None:
+            have = set()
+        loop = asyncio.get_running_loop()
+        total_chunks = count_chunks(manifest)
+        completed = 0
+        
+        def report():
+            nonlocal completed
+            completed += 1
+            if progress_callback:
+                progress_callback(completed, total_chunks)
+        
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        journal = DownloadJournal(get_journal_path(output_path),
+                                  self.chunk_manager.get_manifest_fingerprint(manifest))
+        done = journal.open()
+        if journal.resumed:
+            print(f"⏩ Resuming download: {len(done)}/{total_chunks} chunks already here")
         
-        # Download based on type
         if 'files' in manifest:
-            # Folder transfer
-            await self._download_lan_folder(client, manifest, output_path, progress_callback)
+            base_path = Path(output_path)
+            file_entries = [(file_index, file_info, str(base_path / file_info['relativePath']))
+                            for file_index, file_info in enumerate(manifest['files']) if 'pack' not in file_info]
         else:
-            # Single file transfer
-            await self._download_lan_file(client, manifest, output_path, progress_callback)
-    
-    async def _download_lan_file(self, client, manifest: dict, output_path: str, progress_callback=None):
-        """Download single file via LAN"""
-        total_chunks = manifest['totalChunks']
+            base_path = None
+            file_entries = [(SINGLE_FILE, manifest, output_path)]
         
-        # Download chunks in parallel
-        semaphore = asyncio.Semaphore(self.parallel_workers)
+        # Runs of chunks need range requests, which the relay can't serve
+        stripe = all(isinstance(source, LANSource) for source in sources)
         
-        async def download_chunk(chunk_id: int):
-            async with semaphore:
-                chunk_data = await client.download_chunk(chunk_id)
-                self.chunk_manager.write_chunk(output_path, chunk_id, chunk_data)
-                
-                if progress_callback:
-                    progress_callback(chunk_id, total_chunks)
+        # Plan every file: journaled chunks are done; otherwise delta sync against any existing copy
+        jobs = []
+        remaining = {}
+        targets = {}
+        for file_index, file_info, file_path in file_entries:
+            chunk_ids = range(file_info['totalChunks'])
+            # An interrupted delta assembly carries on in its .delta file
+            target_path = file_path + ".delta" if os.path.exists(file_path + ".delta") else file_path
+            if journal.resumed and os.path.exists(target_path):
+                missing = [chunk_id for chunk_id in chunk_ids if (file_index, chunk_id) not in done]
+            else:
+                missing, target_path = await self._prepare_delta(file_info, file_path)
+            
+            targets[file_index] = target_path
+            remaining[file_index] = len(missing)
+            for _ in range(file_info['totalChunks'] - len(missing)):
+                report()
+            if not missing:
+                self._finish_lan_file(file_info, target_path, file_path, files)
+                have.update((file_index, chunk_id) for chunk_id in chunk_ids)
+            else:
+                if files is not None:
+                    # Seeded: full size up front, so the file never looks shorter than a chunk in have
+                    self._presize(target_path, file_info['size'])
+                if target_path == file_path:
+                    missing_ids = set(missing)
+                    have.update((file_index, chunk_id) for chunk_id in chunk_ids if chunk_id not in missing_ids)
+            
+            for run in self._plan_lan_runs(file_info, missing, stripe):
+                start, _ = self.chunk_manager.get_chunk_span(file_info, run[0])
+                last_offset, last_size = self.chunk_manager.get_chunk_span(file_info, run[-1])
+                end = min(last_offset + last_size, file_info['size'])
+                jobs.append(ChunkJob(file_index, run, start, end - start))
         
-        tasks = [download_chunk(i) for i in range(total_chunks)]
-        await asyncio.gather(*tasks)
-    
-    async def _download_lan_folder(self, client, manifest: dict, output_path: str, progress_callback=None):
-        """Download folder via LAN"""
-        base_path = Path(output_path)
-        total_chunks = sum(f['totalChunks'] for f in manifest['files'])
-        downloaded = 0
+        for pack_info in manifest.get('packs', []):
+            if (PACK_INDEX, pack_info['id']) in done or await loop.run_in_executor(
+                    None, self.chunk_manager.is_pack_current, manifest, pack_info, base_path):
+                have.add((PACK_INDEX, pack_info['id']))
+                report()
+            else:
+                jobs.append(ChunkJob(PACK_INDEX, [pack_info['id']], 0, pack_info['size'], pack_info))
         
-        for file_index, file_info in enumerate(manifest['files']):
-            file_path = base_path / file_info['relativePath']
-            file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_infos = {file_index: (file_info, file_path) for file_index, file_info, file_path in file_entries}
+        
+        def check(job: ChunkJob, data: bytes) -> bool:
+            if len(data) != job.size:
+                return False
+            if job.pack_info is not None:
+                return self.chunk_manager.calculate_chunk_hash(data) == job.pack_info['hash']
+            chunks = file_infos[job.file_index][0]['chunks']
+            pos = 0
+            for chunk_id in job.chunk_ids:
+                size = chunks[chunk_id]['size']
+                if self.chunk_manager.calculate_chunk_hash(data[pos:pos + size]) != chunks[chunk_id]['hash']:
+                    return False
+                pos += size
+            return True
+        
+        async def verify(job: ChunkJob, data: bytes) -> bool:
+            return await loop.run_in_executor(None, check, job, data)
+        
+        async def on_done(job: ChunkJob, data: bytes):
+            if job.pack_info is not None:
+                # Small files come in pack chunks
+                await loop.run_in_executor(None, self.chunk_manager.unpack, manifest, job.pack_info, data, base_path)
+                journal.record(PACK_INDEX, job.pack_info['id'])
+                have.add((PACK_INDEX, job.pack_info['id']))
+                report()
+                return
             
-            for chunk_id in range(file_info['totalChunks']):
-                chunk_data = await client.download_file_chunk(file_index, chunk_id)
-                self.chunk_manager.write_chunk(str(file_path), chunk_id, chunk_data)
-                
-                downloaded += 1
-                if progress_callback:
-                    progress_callback(downloaded, total_chunks)
+            file_info, file_path = file_infos[job.file_index]
+            pos = 0
+            for chunk_id in job.chunk_ids:
+                offset, size = self.chunk_manager.get_chunk_span(file_info, chunk_id)
+                self.chunk_manager.write_chunk(targets[job.file_index], chunk_id, data[pos:pos + size], offset)
+                journal.record(job.file_index, chunk_id)
+                pos += size
+                report()
+            if targets[job.file_index] == file_path:
+                have.update((job.file_index, chunk_id) for chunk_id in job.chunk_ids)
+            
+            remaining[job.file_index] -= len(job.chunk_ids)
+            if remaining[job.file_index] == 0:
+                self._finish_lan_file(file_info, targets[job.file_index], file_path, files)
+                # A delta assembly is only servable once it's moved into place
+                have.update((job.file_index, chunk_id) for chunk_id in range(file_info['totalChunks']))
+        
+        if jobs and not sources:
+            journal.close()
+            raise Exception("No source to download from")
+        
+        scheduler = SwarmScheduler(jobs, sources, verify, on_done)
+        try:
+            await scheduler.run()
+        except BaseException:
+            # Finished chunks stay journaled for the next attempt
+            journal.close()
+            raise
+        journal.remove()
+        
+        if len(sources) > 1:
+            for line in scheduler.summary():
+                print(f"   📡 {line}")
+    
+    def _plan_lan_runs(self, file_info: dict, missing: List[int], stripe: bool = True) -> List[List[int]]:
+        """
+        Group a file's missing chunks into requests
+        One chunk per request, or with LAN_STRIPE_FILES (and stripe, i.e. every source
+        serves ranges) runs of consecutive chunks up to LAN_STRIPE_SIZE fetched as one range
+        """
+        if not (LAN_STRIPE_FILES and stripe):
+            return [[chunk_id] for chunk_id in missing]
+        
+        runs = []
+        run = []
+        run_size = 0
+        for chunk_id in missing:
+            _, size = self.chunk_manager.get_chunk_span(file_info, chunk_id)
+            if run and (chunk_id != run[-1] + 1 or run_size + size > LAN_STRIPE_SIZE):
+                runs.append(run)
+                run, run_size = [], 0
+            run.append(chunk_id)
+            run_size += size
+        if run:
+            runs.append(run)
+        return runs
+    
+    def _presize(self, path: str, size: int):
+        """Extend a file being downloaded to its final size (never shrinks it)"""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            if os.fstat(f.fileno()).st_size < size:
+                f.truncate(size)
+    
+    def _finish_lan_file(self, file_info: dict, target_path: str, file_path: str,
+                         files: Optional[FileHandleCache] = None):
+        """
+        Trim a completed file to its manifest size and move delta assemblies into place
+        files: handle cache serving file_path, whose old handle is dropped when it's replaced
+        """
+        Path(target_path).parent.mkdir(parents=True, exist_ok=True)
+        if not os.path.exists(target_path):
+            # Empty file (no chunks)
+            open(target_path, 'wb').close()
+        elif os.path.getsize(target_path) > file_info['size']:
+            os.truncate(target_path, file_info['size'])
+        self._finish_delta(target_path, file_path)
+        if files is not None and target_path != file_path:
+            files.evict(file_path)
 
 if __name__ == "__main__":
     print("Transfer Engine Module")
@@ -4,16 +4,15 @@ Receiver CLI - Command-line tool for receiving files/folders
 import asyncio
 import sys
 import os
-from pathlib import Path
 import aiohttp
-import json
 from tqdm import tqdm
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from config import SIGNALING_HOST, SIGNALING_PORT
-from engine.chunk_manager import ChunkManager, format_size
+from config import SIGNALING_HOST, SIGNALING_PORT, LAN_DISCOVERY_PORT, LAN_SEED
+from engine.chunk_manager import ChunkManager, format_size, count_chunks
+from engine.lan_transfer import LANSeeder
 from engine.transfer_engine import TransferEngine
 
 class ReceiverCLI:
@@ -24,8 +23,12 @@ class ReceiverCLI:
         self.chunk_manager = ChunkManager(mode='relay')
         self.transfer_engine = TransferEngine(mode='relay')
     
-    async def receive_file(self, pair_code: str, output_dir: str = "."):
-        """Receive a file using pair code"""
+    async def receive_file(self, pair_code: str, output_dir: str = ".", keep_seeding: bool = False):
+        """
+        Receive a file using pair code
+        keep_seeding: serve verified chunks to other receivers on the LAN during the download,
+        and keep serving it afterwards until Ctrl+C (LAN_SEED seeds during the download only)
+        """
         
         # Get pair info
         print(f"🔍 Looking up pair code: {pair_code}")
@@ -39,6 +42,10 @@ class ReceiverCLI:
         
         transfer_id = pair_info['transfer_id']
         manifest = pair_info['manifest']
+        if manifest.get('streaming'):
+            # Pair code was handed out before the sender finished scanning the folder
+            print(f"⏳ Sender is still scanning {manifest['folderName']}, waiting for it to finish...")
+            manifest = await self.transfer_engine.wait_for_manifest(transfer_id)
         
         # Display transfer info
         print(f"\n{'='*60}")
@@ -56,7 +63,7 @@ class ReceiverCLI:
             print(f"📁 Folder: {manifest['folderName']}")
             print(f"📦 Total Size: {format_size(manifest['totalSize'])}")
             print(f"📄 Files: {manifest['totalFiles']}")
-            print(f"🔢 Total Chunks: {sum(f['totalChunks'] for f in manifest['files'])}")
+            print(f"🔢 Total Chunks: {count_chunks(manifest)}")
             output_path = os.path.join(output_dir, manifest['folderName'])
         
         print(f"💾 Output: {output_path}")
@@ -68,8 +75,30 @@ class ReceiverCLI:
             print("❌ Download cancelled")
             return
         
-        # Download
-        await self._download_from_relay(transfer_id, manifest, output_path)
+        # Download from the relay and whatever LAN peers (sender, seeding receivers) answer,
+        # seeding our verified chunks to the other receivers meanwhile when asked to
+        peers = await self.transfer_engine.find_lan_peers(pair_code, transfer_id)
+        seeding = (LAN_SEED or keep_seeding) and not manifest.get('pipelined')
+        seeder = LANSeeder(pair_code, transfer_id) if seeding else None
+        try:
+            if peers or seeder:
+                if peers:
+                    print(f"\n🌐 Mode: LAN + RELAY ({len(peers)} LAN peers: {', '.join(peer[0] for peer in peers)})")
+                else:
+                    print(f"\n📡 Mode: RELAY SERVER")
+                complete = await self._download_multi_source(transfer_id, peers, manifest, output_path, seeder)
+                if complete and seeder is not None and seeder.running:
+                    seeder.set_complete()
+                    if keep_seeding:
+                        print(f"🌱 Seeding to other receivers, press Ctrl+C to stop")
+                        await asyncio.Event().wait()
+            else:
+                await self._download_from_relay(transfer_id, manifest, output_path)
+        finally:
+            if seeder is not None and seeder.running:
+                stats = seeder.get_stats()
+                print(f"🌱 Seeded {stats['requests']} requests, {format_size(stats['bytes_sent'])}")
+                await seeder.stop()
     
     async def _download_from_relay(self, transfer_id: str, manifest: dict, output_path: str):
         """Download from relay server"""
@@ -77,33 +106,18 @@ class ReceiverCLI:
         print(f"⬇️  Downloading chunks...")
         
         # Progress bar
-        total_chunks = manifest.get('totalChunks', sum(f['totalChunks'] for f in manifest.get('files', [])))
+        total_chunks = count_chunks(manifest)
         pbar = tqdm(total=total_chunks, desc="Downloading", unit="chunk")
         
         def progress_callback(chunk_id, total):
             pbar.update(1)
         
         try:
-            await self.transfer_engine.download_from_relay(transfer_id, output_path, progress_callback)
+            # Pipelined transfers only get their file hash once the sender has finished
+            manifest = await self.transfer_engine.download_from_relay(transfer_id, output_path, progress_callback)
             pbar.close()
             
-            # Verify file
-            print(f"\n🔍 Verifying integrity...")
-            if 'fileName' in manifest:
-                # Single file
-                if self.chunk_manager.verify_file(output_path, manifest['hash']):
-                    print(f"✅ File verified successfully!")
-                else:
-                    print(f"⚠️  Warning: File hash mismatch")
-            else:
-                # Folder - verify each file
-                verified = 0
-                for file_info in manifest['files']:
-                    file_path = os.path.join(output_path, file_info['relativePath'])
-                    if self.chunk_manager.verify_file(file_path, file_info['hash']):
-                        verified += 1
-                
-                print(f"✅ Verified {verified}/{len(manifest['files'])} files")
+            self._verify(manifest, output_path)
             
             print(f"\n✅ Download complete!")
             print(f"📁 Saved to: {output_path}")
@@ -112,6 +126,71 @@ class ReceiverCLI:
             pbar.close()
             print(f"\n❌ Download failed: {e}")
     
+    def _verify(self, manifest: dict, output_path: str) -> bool:
+        """Check the downloaded file or folder against the manifest hashes"""
+        print(f"\n🔍 Verifying integrity...")
+        if 'fileName' in manifest:
+            # Single file
+            if self.chunk_manager.verify_file(output_path, manifest['hash']):
+                print(f"✅ File verified successfully!")
+                return True
+            else:
+                print(f"⚠️  Warning: File hash mismatch")
+                return False
+        else:
+            # Folder - verify each file
+            verified = 0
+            for file_info in manifest['files']:
+                file_path = os.path.join(output_path, file_info['relativePath'])
+                if self.chunk_manager.verify_file(file_path, file_info['hash']):
+                    verified += 1
+            
+            print(f"✅ Verified {verified}/{len(manifest['files'])} files")
+            return verified == len(manifest['files'])
+    
+    async def _download_from_lan(self, server_ip: str, port: int, manifest: dict, output_path: str):
+        """Download directly from the sender's LAN server"""
+        await self._download_with(
+            lambda progress_callback: self.transfer_engine.download_from_lan(server_ip, output_path, progress_callback, port),
+            manifest, output_path
+        )
+    
+    async def _download_multi_source(self, transfer_id: str, peers: list, manifest: dict, output_path: str,
+                                     seeder: LANSeeder = None) -> bool:
+        """Download from LAN peers and the relay at once; True once complete"""
+        return await self._download_with(
+            lambda progress_callback: self.transfer_engine.download_multi_source(
+                transfer_id, output_path, peers, progress_callback, seeder
+            ),
+            manifest, output_path
+        )
+    
+    async def _download_with(self, download, manifest: dict, output_path: str) -> bool:
+        """Run download(progress_callback) with a progress bar, then verify; True if it all checks out"""
+        print(f"⬇️  Downloading...")
+        total_chunks = count_chunks(manifest)
+        pbar = tqdm(total=total_chunks, desc="Downloading", unit="chunk")
+        
+        def progress_callback(chunk_id, total):
+            pbar.update(1)
+        
+        try:
+            manifest = await download(progress_callback)
+            pbar.close()
+            verified = self._verify(manifest, output_path)
+            
+            if verified:
+                print(f"\n✅ Download complete!")
+            else:
+                print(f"\n❌ Download failed verification: run the same command again to retry")
+            print(f"📁 Saved to: {output_path}")
+            return verified
+        
+        except Exception as e:
+            pbar.close()
+            print(f"\n❌ Download failed: {e}")
+            return False
+    
     async def receive_from_lan(self, server_ip: str, output_dir: str = "."):
         """Receive via LAN direct"""
         print(f"\n🌐 Mode: LAN DIRECT")
@@ -135,18 +214,8 @@ class ReceiverCLI:
                 output_path = os.path.join(output_dir, manifest['folderName'])
             
             # Download
-            print(f"\n⬇️  Downloading...")
-            total_chunks = manifest.get('totalChunks', sum(f['totalChunks'] for f in manifest.get('files', [])))
-            pbar = tqdm(total=total_chunks, desc="Downloading", unit="chunk")
-            
-            def progress_callback(chunk_id, total):
-                pbar.update(1)
-            
-            await self.transfer_engine.download_from_lan(server_ip, output_path, progress_callback)
-            pbar.close()
-            
-            print(f"\n✅ Download complete!")
-            print(f"📁 Saved to: {output_path}")
+            print()
+            await self._download_from_lan(server_ip, LAN_DISCOVERY_PORT, manifest, output_path)
         
         except Exception as e:
             print(f"❌ Download failed: {e}")
@@ -159,12 +228,13 @@ async def main():
     
     if len(sys.argv) < 2:
         print("\nUsage:")
-        print("  python receiver_cli.py <pair_code> [output_dir]")
+        print("  python receiver_cli.py <pair_code> [output_dir] [--seed]   (direct over LAN when the sender is nearby)")
         print("  python receiver_cli.py lan <server_ip> [output_dir]")
         print("\nExamples:")
         print("  python receiver_cli.py 123456")
         print("  python receiver_cli.py 123456 downloads/")
         print("  python receiver_cli.py lan 192.168.1.100")
+        print("\n--seed serves the download to other receivers on the LAN (no authentication) until Ctrl+C")
         sys.exit(1)
     
     if sys.argv[1] == 'lan':
@@ -178,11 +248,12 @@ async def main():
         receiver = ReceiverCLI()
         await receiver.receive_from_lan(server_ip, output_dir)
     else:
-        pair_code = sys.argv[1]
-        output_dir = sys.argv[2] if len(sys.argv) > 2 else "."
+        args = [arg for arg in sys.argv[1:] if arg != '--seed']
+        pair_code = args[0]
+        output_dir = args[1] if len(args) > 1 else "."
         
         receiver = ReceiverCLI()
-        await receiver.receive_file(pair_code, output_dir)
+        await receiver.receive_file(pair_code, output_dir, keep_seeding='--seed' in sys.argv)
 
 if __name__ == "__main__":
     try:
@@ -5,17 +5,68 @@ import asyncio
 import sys
 import os
 from pathlib import Path
+from typing import Optional
 import aiohttp
 import json
+import time
+import uuid
 from tqdm import tqdm
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from config import SIGNALING_HOST, SIGNALING_PORT, LAN_DISCOVERY_PORT
-from engine.chunk_manager import ChunkManager, format_size
+from config import SIGNALING_HOST, SIGNALING_PORT, LAN_DISCOVERY_PORT, UPLOAD_STATE_FILE, PIPELINE_MIN_SIZE
+from engine.chunk_manager import ChunkManager, format_size, count_chunks
 from engine.transfer_engine import TransferEngine
 from engine.lan_transfer import LANTransferServer
+from engine.manifest_codec import manifest_summary
+
+class UploadState:
+    """
+    Relay uploads in progress, persisted so an interrupted send can be resumed
+    {source_path: {transfer_id, fingerprint, relay_url, updated_at}}
+    """
+    
+    def __init__(self, state_file: str = UPLOAD_STATE_FILE):
+        self.state_file = state_file
+    
+    def _load(self) -> dict:
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _save(self, state: dict):
+        Path(self.state_file).parent.mkdir(parents=True, exist_ok=True)
+        temp_file = self.state_file + ".tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(temp_file, self.state_file)
+    
+    def get(self, source_path: str, fingerprint: str, relay_url: str) -> Optional[str]:
+        """Get the transfer_id of an unfinished upload of the same content, or None"""
+        entry = self._load().get(source_path)
+        if entry and entry['fingerprint'] == fingerprint and entry['relay_url'] == relay_url:
+            return entry['transfer_id']
+        return None
+    
+    def put(self, source_path: str, transfer_id: str, fingerprint: str, relay_url: str):
+        """Remember an upload before it starts"""
+        state = self._load()
+        state[source_path] = {
+            'transfer_id': transfer_id,
+            'fingerprint': fingerprint,
+            'relay_url': relay_url,
+            'updated_at': time.time()
+        }
+        self._save(state)
+    
+    def remove(self, source_path: str):
+        """Forget a finished upload"""
+        state = self._load()
+        if state.pop(source_path, None) is not None:
+            self._save(state)
 
 class SenderCLI:
     """Command-line sender application"""
@@ -23,7 +74,10 @@ class SenderCLI:
     def __init__(self):
         self.signaling_url = f"http://{SIGNALING_HOST}:{SIGNALING_PORT}"
         self.chunk_manager = ChunkManager(mode='relay')
+        # LAN transfers never compress, so their manifests skip it
+        self.lan_chunk_manager = ChunkManager(mode='relay', compression=None)
         self.transfer_engine = TransferEngine(mode='relay')
+        self.upload_state = UploadState()
     
     async def send_file(self, file_path: str, mode: str = 'relay'):
         """Send a file or folder"""
@@ -34,32 +88,149 @@ class SenderCLI:
             print(f"❌ Path not found: {file_path}")
             return
         
+        # Folders sent via relay are scanned, hashed and uploaded at the same time
+        if path.is_dir() and mode != 'lan':
+            await self._send_folder_streaming(path)
+            return
+        
+        # Large files via relay are hashed and uploaded in one pass
+        if path.is_file() and mode != 'lan' and path.stat().st_size >= PIPELINE_MIN_SIZE:
+            await self._send_file_pipelined(path)
+            return
+        
         # Create manifest
         print(f"📦 Creating manifest...")
+        chunk_manager = self.lan_chunk_manager if mode == 'lan' else self.chunk_manager
         if path.is_file():
-            manifest = self.chunk_manager.create_file_manifest(str(path))
+            manifest = chunk_manager.create_file_manifest(str(path))
             print(f"📄 File: {manifest['fileName']}")
             print(f"📦 Size: {format_size(manifest['size'])}")
             print(f"🔢 Chunks: {manifest['totalChunks']}")
         else:
-            manifest = self.chunk_manager.create_folder_manifest(str(path))
+            manifest = chunk_manager.create_folder_manifest(str(path))
             print(f"📁 Folder: {manifest['folderName']}")
             print(f"📦 Total Size: {format_size(manifest['totalSize'])}")
             print(f"📄 Files: {manifest['totalFiles']}")
-            print(f"🔢 Total Chunks: {sum(f['totalChunks'] for f in manifest['files'])}")
+            print(f"🔢 Total Chunks: {count_chunks(manifest)}")
+        
+        # Reuse the transfer ID of an interrupted upload of the same content
+        source_path = str(path.resolve())
+        fingerprint = self.chunk_manager.get_manifest_fingerprint(manifest)
+        relay_url = self.transfer_engine.relay_url
+        transfer_id = None
+        
+        if mode != 'lan':
+            transfer_id = self.upload_state.get(source_path, fingerprint, relay_url)
+            if transfer_id:
+                print(f"♻️  Resuming interrupted upload: {transfer_id}")
         
         # Generate transfer ID
-        import uuid
-        transfer_id = str(uuid.uuid4())
+        if not transfer_id:
+            transfer_id = str(uuid.uuid4())
+        
+        pair_code = await self._create_pair_code(transfer_id, manifest)
+        if not pair_code:
+            return
+        
+        # Choose transfer mode
+        if mode == 'lan':
+            await self._send_via_lan(transfer_id, manifest, pair_code)
+        else:
+            self.upload_state.put(source_path, transfer_id, fingerprint, relay_url)
+            if await self._send_via_relay(transfer_id, manifest):
+                self.upload_state.remove(source_path)
+    
+    async def _send_file_pipelined(self, path: Path):
+        """Register a large file by size, share the pair code, then hash and upload it in one pass"""
+        manifest = self.chunk_manager.create_pipelined_manifest(str(path))
+        print(f"📄 File: {manifest['fileName']}")
+        print(f"📦 Size: {format_size(manifest['size'])}")
+        print(f"🔢 Chunks: {manifest['totalChunks']}")
+        
+        # Content isn't hashed yet: an unchanged file (size + mtime) resumes its transfer
+        source_path = str(path.resolve())
+        stat = path.stat()
+        fingerprint = f"pipelined:{stat.st_size}:{stat.st_mtime_ns}"
+        relay_url = self.transfer_engine.relay_url
+        
+        transfer_id = self.upload_state.get(source_path, fingerprint, relay_url)
+        if transfer_id:
+            print(f"♻️  Resuming interrupted upload: {transfer_id}")
+        else:
+            transfer_id = str(uuid.uuid4())
+        
+        try:
+            await self.transfer_engine.create_relay_transfer(transfer_id, manifest)
+        except Exception as e:
+            print(f"❌ {e}")
+            return
+        
+        # Receivers can start right away; they verify chunks against hashes as they are published
+        if not await self._create_pair_code(transfer_id, manifest):
+            return
+        
+        self.upload_state.put(source_path, transfer_id, fingerprint, relay_url)
+        if await self._send_via_relay(transfer_id, manifest):
+            self.upload_state.remove(source_path)
+    
+    async def _send_folder_streaming(self, path: Path):
+        """Upload a folder while it is still being scanned; the pair code is shown before the scan starts"""
+        source_path = str(path.resolve())
+        relay_url = self.transfer_engine.relay_url
+        
+        # Content isn't known before the scan; the relay skips chunks that already match
+        transfer_id = self.upload_state.get(source_path, 'streaming', relay_url)
+        if transfer_id:
+            print(f"♻️  Resuming interrupted upload: {transfer_id}")
+        else:
+            transfer_id = str(uuid.uuid4())
+        self.upload_state.put(source_path, transfer_id, 'streaming', relay_url)
         
-        # Create pair code
+        print(f"📁 Folder: {path.name}")
+        print(f"\n📡 Mode: RELAY SERVER")
+        self._print_bandwidth()
+        pbar = None
+        
+        async def on_created(placeholder):
+            # Receivers can look the code up now; they wait for the full manifest on the relay
+            nonlocal pbar
+            if not await self._create_pair_code(transfer_id, placeholder):
+                raise Exception("no pair code")
+            print(f"\n⬆️  Scanning and uploading...")
+            pbar = tqdm(desc="Uploading", unit="chunk")
+        
+        def progress_callback(chunk_id, total):
+            pbar.update(1)
+        
+        try:
+            manifest = await self.transfer_engine.upload_folder_streaming(
+                transfer_id, str(path), progress_callback, on_created
+            )
+        except Exception as e:
+            print(f"\n❌ Upload failed: {e}")
+            print(f"🔁 Run the same command again to resume the upload")
+            return
+        finally:
+            if pbar is not None:
+                pbar.close()
+        
+        self.upload_state.remove(source_path)
+        print(f"\n✅ Upload complete!")
+        print(f"📦 Total Size: {format_size(manifest['totalSize'])}")
+        print(f"📄 Files: {manifest['totalFiles']}")
+        print(f"🔢 Total Chunks: {count_chunks(manifest)}")
+        print(f"📥 Receiver can now download the folder")
+    
+    async def _create_pair_code(self, transfer_id: str, manifest: dict) -> Optional[str]:
+        """Register the transfer with the signaling server; returns the pair code"""
         print(f"\n🔗 Creating pair code...")
         async with aiohttp.ClientSession() as session:
             async with session.post(
                 f"{self.signaling_url}/pair/create",
                 params={
                     'transfer_id': transfer_id,
-                    'manifest': json.dumps(manifest)
+                    # Per-chunk entries stay on the relay/LAN server; receivers fetch them from there
+                    'manifest': json.dumps(manifest_summary(manifest))
                 }
             ) as resp:
                 if resp.status == 200:
@@ -70,44 +241,52 @@ class SenderCLI:
                     print(f"{'='*50}")
                     print(f"⏰ Expires in: {result['expires_in']} seconds")
                     print(f"\n👉 Share this code with the receiver!")
+                    return pair_code
                 else:
                     print(f"❌ Failed to create pair code: {await resp.text()}")
-                    return
-        
-        # Choose transfer mode
-        if mode == 'lan':
-            await self._send_via_lan(manifest, pair_code)
-        else:
-            await self._send_via_relay(transfer_id, manifest)
+                    return None
     
-    async def _send_via_relay(self, transfer_id: str, manifest: dict):
-        """Send via relay server"""
+    async def _send_via_relay(self, transfer_id: str, manifest: dict) -> bool:
+        """Send via relay server; returns True when every chunk is uploaded"""
         print(f"\n📡 Mode: RELAY SERVER")
+        self._print_bandwidth()
         print(f"⬆️  Uploading chunks...")
         
         # Progress bar
-        total_chunks = manifest.get('totalChunks', sum(f['totalChunks'] for f in manifest.get('files', [])))
+        total_chunks = count_chunks(manifest)
         pbar = tqdm(total=total_chunks, desc="Uploading", unit="chunk")
         
         def progress_callback(chunk_id, total):
             pbar.update(1)
         
         try:
-            await self.transfer_engine.upload_to_relay(transfer_id, manifest, progress_callback)
+            if manifest.get('pipelined'):
+                await self.transfer_engine.upload_file_pipelined(transfer_id, manifest, progress_callback)
+            else:
+                await self.transfer_engine.upload_to_relay(transfer_id, manifest, progress_callback)
             pbar.close()
             print(f"\n✅ Upload complete!")
             print(f"📥 Receiver can now download the file")
+            return True
         except Exception as e:
             pbar.close()
             print(f"\n❌ Upload failed: {e}")
+            print(f"🔁 Run the same command again to resume the upload")
+            return False
+    
+    def _print_bandwidth(self):
+        """Show the relay bandwidth limits when any are set"""
+        if self.transfer_engine.bandwidth.limited:
+            print(f"🚦 Bandwidth: {self.transfer_engine.bandwidth.describe()}")
     
-    async def _send_via_lan(self, manifest: dict, pair_code: str):
+    async def _send_via_lan(self, transfer_id: str, manifest: dict, pair_code: str):
         """Send via LAN direct"""
         print(f"\n🌐 Mode: LAN DIRECT (Fastest!)")
         
-        # Start LAN server
+        # Start LAN server; receivers on the LAN find it from the pair code
         server = LANTransferServer(manifest, port=LAN_DISCOVERY_PORT)
         local_ip = await server.start()
+        await server.announce(pair_code, transfer_id)
         
         print(f"📡 Server IP: {local_ip}:{LAN_DISCOVERY_PORT}")
         print(f"⏳ Waiting for receiver to connect...")
@@ -119,6 +298,11 @@ class SenderCLI:
                 await asyncio.sleep(1)
         except KeyboardInterrupt:
             print(f"\n\n🛑 Server stopped")
+        finally:
+            stats = server.get_stats()
+            print(f"📊 Served {stats['requests']} requests, {format_size(stats['bytes_sent'])} "
+                  f"({stats['workers']} worker process{'es' if stats['workers'] > 1 else ''})")
+            await server.stop()
 
 async def main():
     """Main entry point"""
@@ -126,21 +310,42 @@ async def main():
     print("🚀 Send Anywhere - Sender CLI")
     print("=" * 60)
     
-    if len(sys.argv) < 2:
+    # Options take a value: --limit 2M, --schedule 09:00-18:00=1M
+    args = sys.argv[1:]
+    options = {}
+    for flag in ('--limit', '--schedule'):
+        if flag in args:
+            i = args.index(flag)
+            options[flag] = args[i + 1] if i + 1 < len(args) else ''
+            del args[i:i + 2]
+    
+    if len(args) < 1:
         print("\nUsage:")
-        print("  python sender_cli.py <file_or_folder_path> [mode]")
+        print("  python sender_cli.py <file_or_folder_path> [mode] [--limit RATE] [--schedule SCHEDULE]")
         print("\nModes:")
         print("  relay  - Upload to relay server (default)")
         print("  lan    - Direct LAN transfer (fastest)")
+        print("\nRelay bandwidth (RATE like 512K or 2M bytes/s, 0 = unlimited):")
+        print("  --limit RATE          cap uploads at RATE")
+        print("  --schedule SCHEDULE   time-of-day caps, e.g. 09:00-18:00=1M,18:00-09:00=0")
         print("\nExamples:")
         print("  python sender_cli.py myfile.zip")
         print("  python sender_cli.py myfolder/ lan")
+        print("  python sender_cli.py bigfile.iso --schedule 09:00-18:00=2M")
         sys.exit(1)
     
-    file_path = sys.argv[1]
-    mode = sys.argv[2] if len(sys.argv) > 2 else 'relay'
+    file_path = args[0]
+    mode = args[1] if len(args) > 1 else 'relay'
     
     sender = SenderCLI()
+    try:
+        if '--limit' in options:
+            sender.transfer_engine.bandwidth.set_limit(options['--limit'])
+        if '--schedule' in options:
+            sender.transfer_engine.bandwidth.set_schedule(options['--schedule'])
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
     await sender.send_file(file_path, mode)
 
 if __name__ == "__main__":
@@ -425,7 +425,11 @@ function startCountdown(sec) {
 async function uploadToRelay(tid, m, files) {
     if (isP2PConnected) return;
     try {
-        await fetch(`${RELAY_URL}/transfer/create?transfer_id=${tid}&manifest=${encodeURIComponent(JSON.stringify(m))}`, { method: 'POST' });
+        await fetch(`${RELAY_URL}/transfer/create?transfer_id=${tid}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(m)
+        });
         let i = 0; for (const f of files) {
             const fd = new FormData(); fd.append('file', f);
             await fetch(`${RELAY_URL}/transfer/${tid}/chunk/${i++}`, { method: 'POST', body: fd });
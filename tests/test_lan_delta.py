@@ -0,0 +1,60 @@
+"""
+Regression tests for LAN downloads onto an existing copy (delta assembly)
+"""
+import asyncio
+import os
+import socket
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.file_cache import FileHandleCache
+from engine.lan_transfer import LANTransferServer
+from engine.transfer_engine import TransferEngine
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+async def serve_and_download(engine: TransferEngine, manifest: dict, output_path: str) -> dict:
+    port = free_port()
+    server = LANTransferServer(manifest, port=port, stream_port=None, workers=1)
+    await server.start(quiet=True)
+    try:
+        return await engine.download_from_lan('127.0.0.1', output_path, port=port)
+    finally:
+        await server.stop()
+
+def test_delta_download_onto_moved_chunks(tmp_path):
+    engine = TransferEngine(mode='lan')
+    chunk_size = engine.chunk_manager.chunk_size
+    a, b, c = (os.urandom(chunk_size) for _ in range(3))
+    
+    source = tmp_path / "source.bin"
+    source.write_bytes(a + b + c)
+    manifest = engine.chunk_manager.create_file_manifest(str(source))
+    
+    # Old copy has the chunks in another order, so they're assembled in a .delta file
+    output = tmp_path / "out" / "source.bin"
+    output.parent.mkdir()
+    output.write_bytes(b + a)
+    
+    asyncio.run(serve_and_download(engine, manifest, str(output)))
+    assert output.read_bytes() == a + b + c
+    assert not os.path.exists(str(output) + ".delta")
+    
+    # Downloading again onto the finished copy is a no-op
+    asyncio.run(serve_and_download(engine, manifest, str(output)))
+    assert output.read_bytes() == a + b + c
+
+def test_finish_lan_file_evicts_replaced_handle(tmp_path):
+    engine = TransferEngine(mode='lan')
+    path = tmp_path / "file.bin"
+    path.write_bytes(b"old contents")
+    files = FileHandleCache()
+    assert files.pread(str(path), 0, 3) == b"old"
+    
+    delta = tmp_path / "file.bin.delta"
+    delta.write_bytes(b"new")
+    engine._finish_lan_file({'size': 3}, str(delta), str(path), files)
+    assert files.pread(str(path), 0, 16) == b"new"